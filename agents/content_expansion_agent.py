@@ -1,82 +1,117 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
+from utils.llm_provider import get_llm
+from utils.llm_retry import call_with_retry
+from utils.llm_usage import bind_context, llm_config
+from rag_pipeline.context_packer import pack_context
 
 load_dotenv()
 
+# Max slides expanded in parallel (1 = sequential)
+EXPANSION_CONCURRENCY = int(os.getenv("EXPANSION_CONCURRENCY", 4))
+# Placeholder point for a slide that could not be expanded
+EXPANSION_FAILED = " Expansion failed, please retry."
+# Estimated-token budget for the prefetched context added to an expansion prompt
+EXPANSION_CONTEXT_TOKENS = int(os.getenv("EXPANSION_CONTEXT_TOKENS", 500))
+
 class ContentExpansionAgent:
-    def __init__(self):
-        # Load Groq API key
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise ValueError(" Missing GROQ_API_KEY in .env file")
-
-        # Use Groq LLM directly
-        self.llm = ChatGroq(
-            groq_api_key=groq_api_key,
-            model="llama-3.1-8b-instant",
-            temperature=0.3,
-            max_tokens=1200
-        )
-
-    def expand_outline(self, outline_json: dict):
+    def __init__(self, llm=None, max_concurrency: int = EXPANSION_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+
+        # Any chat model with .invoke() can be injected (e.g. a local fake for tests)
+        if llm is not None:
+            self.llm = llm
+            return
+
+        # Chat model from the configured provider (groq, fake, record or replay)
+        self.llm = get_llm("expansion", temperature=0.3, max_tokens=1200)
+
+    def expand_outline(self, outline_json: dict, max_concurrency: int = None, context=None):
         """
         Expands bullet points into concise statements (≤ 20 words each).
-        Processes slide by slide to avoid token limit issues.
+        Slides are independent, so up to max_concurrency slides are expanded
+        in parallel; output keeps the outline's slide order. With a
+        ContextStore, each slide is grounded in its prefetched chunks.
+        """
+        slides = outline_json["slides"]
+
+        def expand(i):
+            return self.expand_slide(slides[i], context.slide_context(i) if context else None)
+
+        workers = max(1, min(max_concurrency or self.max_concurrency, len(slides) or 1))
+        if workers == 1:
+            return {"slides": [expand(i) for i in range(len(slides))]}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return {"slides": list(executor.map(bind_context(expand), range(len(slides))))}
+
+    @staticmethod
+    def _context_text(context_docs):
+        """Distinct prefetched chunks for one slide, packed into the prompt budget."""
+        chunks = {}
+        for docs in context_docs or []:
+            for doc in docs:
+                chunks.setdefault(doc.metadata.get("chunk_id") or doc.page_content, doc)
+        return pack_context(list(chunks.values()), EXPANSION_CONTEXT_TOKENS)
+
+    def expand_slide(self, slide: dict, context_docs: list = None):
+        """
+        Expand one slide, falling back to a placeholder if the LLM call fails.
+        context_docs are the slide's prefetched chunks (one list per bullet), if any.
         """
-        expanded_slides = []
-
-        for slide in outline_json["slides"]:
-            slide_title = slide["title"]
-            bullet_points = slide["bullet_points"]
-
-            # Construct a minimal, deterministic prompt
-            prompt = f"""
-                        You are an API that outputs ONLY valid JSON.
-                        Do NOT add explanations, reasoning, <think> tags, or commentary.
-
-                        For the given slide, expand EACH bullet point into a concise yet **informative** statement.
-                        Treat every bullet point as a **mini-topic** and add relevant details, context, or implications.
-                        Make each expanded statement **engaging, clear, and insightful** but limit it to a **maximum of 30 words**.
-
-                        ### JSON format to return:
-                        {{
-                            "title": "{slide_title}",
-                            "detailed_points": [
-                                "Expanded statement for bullet 1",
-                                "Expanded statement for bullet 2"
-                            ]
-                        }}
-
-                        Slide to expand:
-                        {{
-                            "title": "{slide_title}",
-                            "bullet_points": {json.dumps(bullet_points)}
-                        }}
-                    """
-
-
-            try:
-                # Directly call Groq LLM
-                response = self.llm.invoke(prompt)
-                text_response = response.content.strip()
-
-                # Ensure valid JSON parsing
-                expanded_slide = json.loads(text_response)
-                expanded_slides.append(expanded_slide)
-
-            except json.JSONDecodeError:
-                print(f" JSON parse failed for slide: {slide_title}")
-                expanded_slides.append({
-                    "title": slide_title,
-                    "detailed_points": [" Expansion failed, please retry."]
-                })
-            except Exception as e:
-                print(f" LLM request failed for {slide_title}: {e}")
-                expanded_slides.append({
-                    "title": slide_title,
-                    "detailed_points": [" Expansion failed, please retry."]
-                })
-
-        return {"slides": expanded_slides}
+        slide_title = slide["title"]
+        bullet_points = slide["bullet_points"]
+        context_text = self._context_text(context_docs)
+        context_block = f"""
+                    Background from the uploaded documents (use it where relevant, do not cite it):
+                    {context_text}
+""" if context_text else ""
+
+        # Construct a minimal, deterministic prompt
+        prompt = f"""
+                    You are an API that outputs ONLY valid JSON.
+                    Do NOT add explanations, reasoning, <think> tags, or commentary.
+
+                    For the given slide, expand EACH bullet point into a concise yet **informative** statement.
+                    Treat every bullet point as a **mini-topic** and add relevant details, context, or implications.
+                    Make each expanded statement **engaging, clear, and insightful** but limit it to a **maximum of 30 words**.
+
+                    ### JSON format to return:
+                    {{
+                        "title": "{slide_title}",
+                        "detailed_points": [
+                            "Expanded statement for bullet 1",
+                            "Expanded statement for bullet 2"
+                        ]
+                    }}
+{context_block}
+                    Slide to expand:
+                    {{
+                        "title": "{slide_title}",
+                        "bullet_points": {json.dumps(bullet_points)}
+                    }}
+                """
+
+
+        try:
+            # Directly call Groq LLM
+            response = call_with_retry(self.llm.invoke, prompt, **llm_config("expansion"))
+            text_response = response.content.strip()
+
+            # Ensure valid JSON parsing
+            return json.loads(text_response)
+
+        except json.JSONDecodeError:
+            print(f" JSON parse failed for slide: {slide_title}")
+            return {
+                "title": slide_title,
+                "detailed_points": [EXPANSION_FAILED]
+            }
+        except Exception as e:
+            print(f" LLM request failed for {slide_title}: {e}")
+            return {
+                "title": slide_title,
+                "detailed_points": [EXPANSION_FAILED]
+            }
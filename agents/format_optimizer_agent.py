@@ -1,121 +1,302 @@
 import os
+import re
 import json
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
+from utils.llm_provider import get_llm
+from utils.llm_retry import call_with_retry
+from utils.llm_usage import TokenBudgetExceeded, llm_config
+from utils.tokens import estimate_tokens
 
 load_dotenv()
 
+# Per-call limits used to pack slides into batches: the completion cap and the
+# model's context window (prompt + completion)
+FORMAT_MAX_TOKENS = int(os.getenv("FORMAT_MAX_TOKENS", 2500))
+FORMAT_CONTEXT_TOKENS = int(os.getenv("FORMAT_CONTEXT_TOKENS", 8192))
+# Expected output per statement beyond its own text: status, design_hint and JSON punctuation
+OUTPUT_TOKENS_PER_POINT = 40
+# Fraction of max_tokens a batch's estimated output may use, leaving room for estimate error
+OUTPUT_HEADROOM = 0.8
+# "llm" (default): ask the model to merge statements with QA verdicts; "local": pair them in code
+FORMAT_MODE = os.getenv("FORMAT_MODE", "llm")
+# Design hints in local mode: "rules" (no LLM call) or "llm" (one hints-only call per batch)
+FORMAT_HINTS = os.getenv("FORMAT_HINTS", "rules")
+# Placeholder statements for slides that could not be formatted
+FORMAT_FAILED = " Formatting failed for this slide"
+OPTIMIZATION_FAILED = " Optimization failed"
+
+def _normalize(text):
+    return " ".join(str(text).lower().split())
+
+def merge_slide(expanded_slide: dict, validated_slide: dict):
+    """
+    Pair each expanded statement with its QA status. Verdicts are matched by
+    statement text, then by position when QA returned one verdict per point;
+    anything unmatched is flagged needs_review.
+    """
+    points = expanded_slide["detailed_points"]
+    validation = validated_slide.get("validation") if isinstance(validated_slide, dict) else None
+    verdicts = [v for v in validation if isinstance(v, dict)] if isinstance(validation, list) else []
+    by_text = {_normalize(v.get("point", "")): v for v in verdicts}
+    content = []
+    for i, point in enumerate(points):
+        verdict = by_text.get(_normalize(point))
+        if verdict is None and len(verdicts) == len(points):
+            verdict = verdicts[i]
+        status = "accurate" if verdict and _normalize(verdict.get("status", "")) == "accurate" else "needs_review"
+        content.append({"statement": point, "status": status})
+    return {"title": expanded_slide["title"], "content": content}
+
+_NUMBER = re.compile(r"\d")
+_COMPARISON = re.compile(r"\b(vs\.?|versus|compared|than|whereas)\b", re.I)
+_SEQUENCE = re.compile(r"\b(first|then|next|finally|step|stages?|phases?)\b", re.I)
+
+def rule_design_hint(statement: str, status: str, position: int):
+    """Deterministic design hint from the statement's shape."""
+    if status != "accurate":
+        return "Mark with a subtle review flag icon"
+    if _NUMBER.search(statement):
+        return "Highlight the key figure in bold, larger font"
+    if _COMPARISON.search(statement):
+        return "Two-column comparison layout"
+    if _SEQUENCE.search(statement):
+        return "Numbered step list or simple timeline"
+    if position == 0:
+        return "Lead bullet with an accent color"
+    if len(statement.split()) > 15:
+        return "Shorten to a single line with ample spacing"
+    return "Simple bullet with ample white space"
+
 class FormatOptimizerAgent:
-    def __init__(self):
-        # Load Groq API key
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise ValueError(" Missing GROQ_API_KEY in .env file")
-
-        # Use deterministic JSON-friendly LLM
-        self.llm = ChatGroq(
-            groq_api_key=groq_api_key,
-            model="llama-3.1-8b-instant",
-            temperature=0,
-            max_tokens=2500
-        )
+    def __init__(self, llm=None, mode: str = FORMAT_MODE, hints: str = FORMAT_HINTS):
+        self.mode = mode
+        self.hints = hints
 
-    def optimize_format(self, expanded_json: dict, validated_json: dict, batch_size: int = 5):
+        # Any chat model with .invoke() can be injected (e.g. a local fake for tests)
+        self.llm = llm
+        if llm is not None:
+            return
+
+        # Local merge with rule-based hints never calls the model
+        if mode == "local" and hints == "rules":
+            return
+
+        # Use deterministic JSON-friendly LLM from the configured provider
+        self.llm = get_llm("format", temperature=0, max_tokens=FORMAT_MAX_TOKENS)
+
+    def optimize_format(self, expanded_json: dict, validated_json: dict, batch_size: int = None):
         """
         Combines expanded + validated content into a final PPT-ready JSON.
-        Now processes slides in batches to avoid exceeding token limits.
+        In llm mode slides are packed into as few LLM calls as fit the token
+        limits (batch_size optionally caps slides per call).
+        """
+        all_slides = self.format_batch(expanded_json["slides"], validated_json["slides"], batch_size)
+        return {
+            "slides": all_slides,
+            "summary": self.summarize(all_slides)
+        }
+
+    @staticmethod
+    def _output_tokens(expanded_slide: dict):
+        """Estimated completion tokens for one formatted slide."""
+        return estimate_tokens(expanded_slide["title"]) + OUTPUT_TOKENS_PER_POINT + sum(
+            estimate_tokens(point) + OUTPUT_TOKENS_PER_POINT for point in expanded_slide["detailed_points"]
+        )
+
+    def plan_batches(self, expanded_slides: list, validated_slides: list, batch_size: int = None):
+        """
+        Greedily pack consecutive slides into batches whose estimated output stays
+        within max_tokens (with headroom) and whose prompt plus max_tokens fits the
+        context window. Returns lists of slide indices; an oversized slide gets a
+        batch of its own.
+        """
+        prompt_budget = FORMAT_CONTEXT_TOKENS - FORMAT_MAX_TOKENS
+        output_budget = FORMAT_MAX_TOKENS * OUTPUT_HEADROOM
+        base_prompt = estimate_tokens(self._build_prompt([], []))
+
+        batches, current, prompt_tokens, output_tokens = [], [], base_prompt, 0
+        for i, (expanded, validated) in enumerate(zip(expanded_slides, validated_slides)):
+            slide_prompt = estimate_tokens(json.dumps(expanded)) + estimate_tokens(json.dumps(validated))
+            slide_output = self._output_tokens(expanded)
+            full = batch_size is not None and len(current) >= batch_size
+            if current and (full or prompt_tokens + slide_prompt > prompt_budget
+                            or output_tokens + slide_output > output_budget):
+                batches.append(current)
+                current, prompt_tokens, output_tokens = [], base_prompt, 0
+            current.append(i)
+            prompt_tokens += slide_prompt
+            output_tokens += slide_output
+        if current:
+            batches.append(current)
+        return batches
+
+    def format_batch(self, expanded_slides: list, validated_slides: list, batch_size: int = None):
+        """
+        Format slides; returns the formatted slides in input order.
+        Local mode merges in code (plus at most one hints-only call per planned
+        batch); llm mode asks the model to merge, in token-budgeted calls.
         """
+        if self.mode == "local":
+            slides = [merge_slide(e, v) for e, v in zip(expanded_slides, validated_slides)]
+            if self.hints != "llm":
+                return self._apply_rule_hints(slides)
+            formatted = []
+            for indices in self.plan_batches(expanded_slides, validated_slides, batch_size):
+                formatted.extend(self._apply_llm_hints([slides[i] for i in indices]))
+            return formatted
+
         all_slides = []
-        slides = expanded_json["slides"]
-        validated_slides = validated_json["slides"]
-
-        for i in range(0, len(slides), batch_size):
-            # Slice slides for the current batch
-            batch_expanded = {"slides": slides[i:i + batch_size]}
-            batch_validated = {"slides": validated_slides[i:i + batch_size]}
-
-            prompt = f"""
-            You are an API that outputs ONLY valid JSON.
-            Do NOT include explanations, reasoning, or <think> tags.
-            Do NOT output anything before or after the JSON.
-
-            Combine the expanded content and QA validation results into a **final PPT-ready JSON**.
-
-            Rules:
-            - Preserve slide titles.
-            - For each expanded statement:
-                - If QA marked it as "accurate", include it under "status": "accurate".
-                - If QA marked it as "needs_review", include it but flag as "status": "needs_review".
-            - Include for each point:
-                - "statement" → final verified or review-needed text
-                - "status" → "accurate" or "needs_review"
-                - "design_hint" → minimal suggestion to make the slide visually appealing.
-
-            ### STRICT JSON FORMAT:
-            {{
-                "slides": [
-                    {{
-                        "title": "Slide title",
-                        "content": [
-                            {{
-                                "statement": "Final verified statement or needs-review statement",
-                                "status": "accurate or needs_review",
-                                "design_hint": "Suggested minimal visual styling"
-                            }}
-                        ]
-                    }}
-                ]
-            }}
-
-            Expanded content:
-            {json.dumps(batch_expanded)}
-
-            QA validation results:
-            {json.dumps(batch_validated)}
-            """
-
-            try:
-                response = self.llm.invoke(prompt)
-                text_response = response.content.strip()
-                batch_result = json.loads(text_response)
-                all_slides.extend(batch_result["slides"])
-
-            except json.JSONDecodeError:
-                print(f" JSON parsing failed in FormatOptimizerAgent for slides {i} - {i+batch_size}")
-                all_slides.extend([
-                    {
-                        "title": s["title"],
-                        "content": [{
-                            "statement": " Formatting failed for this slide",
-                            "status": "needs_review",
-                            "design_hint": "Manual design needed"
-                        }]
-                    }
-                    for s in batch_expanded["slides"]
-                ])
-            except Exception as e:
-                print(f" LLM request failed for slides {i} - {i+batch_size}: {e}")
-                all_slides.extend([
-                    {
-                        "title": s["title"],
-                        "content": [{
-                            "statement": " Optimization failed",
-                            "status": "needs_review",
-                            "design_hint": "Manual formatting required"
-                        }]
-                    }
-                    for s in batch_expanded["slides"]
-                ])
-
-        # Build final JSON summary
+        for indices in self.plan_batches(expanded_slides, validated_slides, batch_size):
+            all_slides.extend(self._format_with_retry(
+                [expanded_slides[i] for i in indices], [validated_slides[i] for i in indices]
+            ))
+        return all_slides
+
+    def _format_with_retry(self, expanded_slides: list, validated_slides: list):
+        """
+        Format one batch; if the response cannot be parsed (usually truncated
+        or oversized output) split the batch in half and retry each half, so
+        only the failing slides end up with fallback content. A failed request
+        (retries exhausted, circuit open) or an exhausted token budget goes
+        straight to the fallback: smaller batches would only add load.
+        """
+        slides, error = self._format_once(expanded_slides, validated_slides)
+        if error is None:
+            return slides
+        if len(expanded_slides) > 1 and error == "parse":
+            mid = len(expanded_slides) // 2
+            print(f" Retrying {len(expanded_slides)} slides as two smaller batches")
+            return (self._format_with_retry(expanded_slides[:mid], validated_slides[:mid])
+                    + self._format_with_retry(expanded_slides[mid:], validated_slides[mid:]))
+
+        if error == "parse":
+            statement, hint = FORMAT_FAILED, "Manual design needed"
+        else:
+            statement, hint = OPTIMIZATION_FAILED, "Manual formatting required"
+        return [
+            {
+                "title": s["title"],
+                "content": [{
+                    "statement": statement,
+                    "status": "needs_review",
+                    "design_hint": hint
+                }]
+            }
+            for s in expanded_slides
+        ]
+
+    @staticmethod
+    def _apply_rule_hints(slides: list):
+        for slide in slides:
+            for i, point in enumerate(slide["content"]):
+                point["design_hint"] = rule_design_hint(point["statement"], point["status"], i)
+        return slides
+
+    def _apply_llm_hints(self, slides: list):
+        """One small LLM call that only suggests design hints; rules fill any gaps."""
+        titles = ", ".join(s["title"] for s in slides)
+        payload = [{"title": s["title"], "statements": [p["statement"] for p in s["content"]]} for s in slides]
+        prompt = f"""
+        You are an API that outputs ONLY valid JSON.
+        Do NOT include explanations, reasoning, or <think> tags.
+
+        For EACH statement of EACH slide, suggest a minimal design hint (at most 8 words)
+        to make it visually appealing on a PPT slide.
+        Return one list per slide, in the same order, with one hint per statement.
+
+        ### STRICT JSON FORMAT:
+        {{"hints": [["hint for statement 1", "hint for statement 2"]]}}
+
+        Slides:
+        {json.dumps(payload)}
+        """
+        try:
+            response = call_with_retry(self.llm.invoke, prompt, **llm_config("format"))
+            hints = json.loads(response.content.strip())["hints"]
+        except Exception as e:
+            print(f" Design hint request failed for slides: {titles}: {e}")
+            hints = []
+
+        self._apply_rule_hints(slides)
+        for slide, slide_hints in zip(slides, hints):
+            if not isinstance(slide_hints, list):
+                continue
+            for point, hint in zip(slide["content"], slide_hints):
+                if isinstance(hint, str) and hint.strip():
+                    point["design_hint"] = hint.strip()
+        return slides
+
+    def _build_prompt(self, expanded_slides: list, validated_slides: list):
+        batch_expanded = {"slides": expanded_slides}
+        batch_validated = {"slides": validated_slides}
+
+        return f"""
+        You are an API that outputs ONLY valid JSON.
+        Do NOT include explanations, reasoning, or <think> tags.
+        Do NOT output anything before or after the JSON.
+
+        Combine the expanded content and QA validation results into a **final PPT-ready JSON**.
+
+        Rules:
+        - Preserve slide titles.
+        - For each expanded statement:
+            - If QA marked it as "accurate", include it under "status": "accurate".
+            - If QA marked it as "needs_review", include it but flag as "status": "needs_review".
+        - Include for each point:
+            - "statement" → final verified or review-needed text
+            - "status" → "accurate" or "needs_review"
+            - "design_hint" → minimal suggestion to make the slide visually appealing.
+
+        ### STRICT JSON FORMAT:
+        {{
+            "slides": [
+                {{
+                    "title": "Slide title",
+                    "content": [
+                        {{
+                            "statement": "Final verified statement or needs-review statement",
+                            "status": "accurate or needs_review",
+                            "design_hint": "Suggested minimal visual styling"
+                        }}
+                    ]
+                }}
+            ]
+        }}
+
+        Expanded content:
+        {json.dumps(batch_expanded)}
+
+        QA validation results:
+        {json.dumps(batch_validated)}
+        """
+
+    def _format_once(self, expanded_slides: list, validated_slides: list):
+        """One LLM call for a batch; returns (slides, None) or (None, "parse" | "request" | "budget")."""
+        titles = ", ".join(s["title"] for s in expanded_slides)
+        try:
+            response = call_with_retry(self.llm.invoke, self._build_prompt(expanded_slides, validated_slides),
+                                       **llm_config("format"))
+            text_response = response.content.strip()
+            batch_result = json.loads(text_response)
+            return batch_result["slides"], None
+
+        except (json.JSONDecodeError, KeyError, TypeError):
+            print(f" JSON parsing failed in FormatOptimizerAgent for slides: {titles}")
+            return None, "parse"
+        except TokenBudgetExceeded as e:
+            print(f" Skipping formatting for slides: {titles}: {e}")
+            return None, "budget"
+        except Exception as e:
+            print(f" LLM request failed for slides: {titles}: {e}")
+            return None, "request"
+
+    @staticmethod
+    def summarize(all_slides: list):
+        """Build final JSON summary"""
         accurate_count = sum(
             1 for slide in all_slides for point in slide["content"] if point["status"] == "accurate"
         )
         needs_review_count = sum(
             1 for slide in all_slides for point in slide["content"] if point["status"] == "needs_review"
         )
-
-        return {
-            "slides": all_slides,
-            "summary": f"{accurate_count} statements accurate, {needs_review_count} statements need manual review"
-        }
+        return f"{accurate_count} statements accurate, {needs_review_count} statements need manual review"
@@ -1,54 +1,126 @@
+import os
+import copy
 import json
+import threading
+from contextlib import nullcontext
+from queue import Queue, Empty
 from agents.outline_generator_agent import OutlineGeneratorAgent
-from agents.content_expansion_agent import ContentExpansionAgent
-from agents.qa_agent import QAAgent
-from agents.format_optimizer_agent import FormatOptimizerAgent
+from agents.content_expansion_agent import ContentExpansionAgent, EXPANSION_FAILED
+from agents.qa_agent import QAAgent, VALIDATION_FAILED, QA_CONTEXT_K
+from agents.format_optimizer_agent import FormatOptimizerAgent, FORMAT_FAILED, OPTIMIZATION_FAILED
+from utils.llm_cache import llm_cache_stats, refresh_llm_cache
+from utils import llm_retry
+from utils.llm_hedge import hedger
+from utils.llm_usage import bind_context, current as current_usage
+from utils.job_store import job_store
+from rag_pipeline.context_store import ContextStore
+
+# "staged" (default): each stage waits for the previous one; "streaming": slides flow expand -> QA -> format individually
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "staged")
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", 8))
+FORMAT_BATCH_SIZE = 5
+# Retrieve context for every outline slide in the background once the outline exists
+CONTEXT_PREFETCH = os.getenv("CONTEXT_PREFETCH", "1") == "1"
+
+_DONE = object()
+
+def _failed(stage, output):
+    """True if a stage's output for one slide is a fallback placeholder."""
+    if not isinstance(output, dict):
+        return False
+    if stage == "expanded":
+        return EXPANSION_FAILED in output.get("detailed_points", [])
+    if stage == "validated":
+        return any(isinstance(v, dict) and v.get("point") == VALIDATION_FAILED for v in output.get("validation", []))
+    return any(isinstance(p, dict) and p.get("statement") in (FORMAT_FAILED, OPTIMIZATION_FAILED)
+               for p in output.get("content", []))
 
 class PresentationOrchestrator:
-    def __init__(self, persist_directory="vector_db"):
+    def __init__(self, persist_directory="vector_db", mode: str = PIPELINE_MODE):
         """
         Initialize all agents in the pipeline.
         Only OutlineGeneratorAgent and QAAgent require persist_directory.
         """
+        self.mode = mode
         self.outline_agent = OutlineGeneratorAgent(persist_directory=persist_directory)
         self.expansion_agent = ContentExpansionAgent()
         self.qa_agent = QAAgent(persist_directory=persist_directory)
         self.format_optimizer = FormatOptimizerAgent()
 
-    def generate_presentation(self, topic: str, persist_directory: str = "vector_db"):
+    def for_collection(self, persist_directory: str):
+        """
+        Per-request view over a warm orchestrator: shares every LLM client,
+        prompt and executor, and only rebinds the retrieval-backed agents to
+        the requested collection.
+        """
+        orchestrator = copy.copy(self)
+        orchestrator.outline_agent = self.outline_agent.for_collection(persist_directory)
+        orchestrator.qa_agent = self.qa_agent.for_collection(persist_directory)
+        return orchestrator
+
+    def generate_presentation(self, topic: str, persist_directory: str = "vector_db", job_id: str = None):
         """
         Orchestrates the entire workflow:
         1. Generate Outline
         2. Expand Outline
         3. Validate Expanded Content
         4. Format Final PPT JSON
+        In streaming mode steps 2-4 are pipelined per slide.
+        Context for every slide still to expand or validate is prefetched in
+        the background as soon as the outline exists, and shared by both stages.
+        With a job_id every stage is checkpointed to the job store, and a
+        rerun of the same job resumes: completed stages are loaded, and only
+        missing or failed slides are processed again.
         """
         try:
-            print("\n🔹 Step 1: Generating outline...")
-            outline = self.outline_agent.generate_outline(topic)
-            print(" Outline generated successfully!")
-            print(json.dumps(outline, indent=4))
-
-            print("\n🔹 Step 2: Expanding outline...")
-            expanded = self.expansion_agent.expand_outline(outline)
-            print(" Expansion completed successfully!")
-            print(json.dumps(expanded, indent=4))
-
-            print("\n🔹 Step 3: Validating expanded content...")
-            validated = self.qa_agent.validate_content(expanded)
-            print(" Validation completed successfully!")
-            print(json.dumps(validated, indent=4))
+            outline = job_store.load(job_id, "outline") if job_id else None
+            if outline is None:
+                print("\n🔹 Step 1: Generating outline...")
+                outline = self.outline_agent.generate_outline(topic)
+                print(" Outline generated successfully!")
+                print(json.dumps(outline, indent=4))
+                self._checkpoint(job_id, "outline", outline)
+            else:
+                print(f" Resuming job {job_id} from its checkpoints")
 
-            print("\n🔹 Step 4: Optimizing format for PPT...")
-            final_presentation = self.format_optimizer.optimize_format(expanded, validated)
-            print(json.dumps(final_presentation, indent=4))
-            print(" Format optimization completed successfully!")
+            state = self._load_state(job_id, len(outline["slides"]))
+            context = None
+            if CONTEXT_PREFETCH:
+                context = ContextStore(self.qa_agent.rag, k=QA_CONTEXT_K)
+                context.prefetch(outline["slides"], [i for i, verdict in enumerate(state["validated"]) if verdict is None])
+            try:
+                if self.mode == "streaming":
+                    print("\n🔹 Steps 2-4: Expanding, validating and formatting slides (streaming)...")
+                    final_presentation = self._run_streaming(outline, state=state, context=context, job_id=job_id)
+                    print(json.dumps(final_presentation, indent=4))
+                else:
+                    final_presentation = self._run_staged(outline, state=state, job_id=job_id, context=context)
+            finally:
+                if context is not None:
+                    print(f" Context prefetch stats: {context.stats()}")
+                    context.close()
+                # Keep whatever finished, even if a stage failed part-way
+                for stage in ("expanded", "validated", "formatted"):
+                    self._checkpoint(job_id, stage, {"slides": state[stage]})
+            if job_id:
+                failed = self._failed_slides(state)
+                job_store.update(job_id, status="needs_resume" if failed else "completed",
+                                 failed_slides=failed, error=None)
             print(" PPT Generation completed successfully!")
+            print(f" Retrieval cache stats: {self.outline_agent.rag.cache_stats()}")
+            print(f" LLM response cache stats: {llm_cache_stats()}")
+            print(f" LLM circuit breaker: {llm_retry.breaker.stats()}")
+            print(f" LLM request hedging: {hedger.stats()}")
+            usage = current_usage()
+            if usage is not None:
+                print(f" LLM usage: {usage.summary()}")
 
             return final_presentation
 
         except Exception as e:
             print(f" Error in orchestration: {e}")
+            if job_id:
+                job_store.update(job_id, status="failed", error=str(e))
             return {
                 "slides": [
                     {
@@ -58,3 +130,242 @@ class PresentationOrchestrator:
                 ],
                 "summary": " Pipeline execution failed"
             }
+
+    @staticmethod
+    def _checkpoint(job_id, stage, data):
+        if job_id:
+            job_store.save(job_id, stage, data)
+
+    @staticmethod
+    def _load_state(job_id, n):
+        """
+        Per-slide stage outputs (None = still to do) from the job's checkpoints.
+        A slide whose expansion, validation or formatting fell back to a
+        placeholder is cleared from that stage on, so only it is redone, and
+        is listed under "retry" so its LLM calls bypass the response cache
+        (which would otherwise replay the answer that failed).
+        """
+        state = {"retry": set()}
+        for stage in ("expanded", "validated", "formatted"):
+            saved = job_store.load(job_id, stage) if job_id else None
+            slides = (saved or {}).get("slides") or []
+            state[stage] = (slides + [None] * n)[:n]
+        for i in range(n):
+            if _failed("expanded", state["expanded"][i]):
+                state["expanded"][i] = state["validated"][i] = state["formatted"][i] = None
+            elif _failed("validated", state["validated"][i]):
+                state["validated"][i] = state["formatted"][i] = None
+            elif _failed("formatted", state["formatted"][i]):
+                state["formatted"][i] = None
+            else:
+                continue
+            state["retry"].add(i)
+        return state
+
+    @staticmethod
+    def _fresh(state, indices):
+        """Skip cached LLM responses while redoing any previously failed slide in indices."""
+        return refresh_llm_cache() if state.get("retry", set()) & set(indices) else nullcontext()
+
+    @classmethod
+    def _cache_groups(cls, state, indices):
+        """Split indices into (slides to redo fresh, the rest), each with its cache context."""
+        retry = state.get("retry", set())
+        groups = ([i for i in indices if i in retry], [i for i in indices if i not in retry])
+        return [(group, cls._fresh(state, group)) for group in groups if group]
+
+    @staticmethod
+    def _failed_slides(state):
+        """Indices of slides that were never formatted or still hold a placeholder at any stage."""
+        return [i for i in range(len(state["formatted"]))
+                if state["formatted"][i] is None
+                or any(_failed(stage, state[stage][i]) for stage in ("expanded", "validated", "formatted"))]
+
+    def _run_staged(self, outline: dict, state: dict = None, job_id: str = None, context=None):
+        slides = outline["slides"]
+        state = state or {stage: [None] * len(slides) for stage in ("expanded", "validated", "formatted")}
+        expanded, validated, formatted = state["expanded"], state["validated"], state["formatted"]
+
+        todo = [i for i, slide in enumerate(expanded) if slide is None]
+        if todo:
+            print(f"\n🔹 Step 2: Expanding outline ({len(todo)} slide(s))...")
+            for group, cache in self._cache_groups(state, todo):
+                with cache:
+                    result = self.expansion_agent.expand_outline(
+                        {"slides": [slides[i] for i in group]}, context=context.for_slides(group) if context else None)
+                for i, slide in zip(group, result["slides"]):
+                    expanded[i] = slide
+            print(" Expansion completed successfully!")
+            print(json.dumps({"slides": expanded}, indent=4))
+            self._checkpoint(job_id, "expanded", {"slides": expanded})
+
+        todo = [i for i, verdict in enumerate(validated) if verdict is None]
+        if todo:
+            print(f"\n🔹 Step 3: Validating expanded content ({len(todo)} slide(s))...")
+            for group, cache in self._cache_groups(state, todo):
+                with cache:
+                    result = self.qa_agent.validate_content(
+                        {"slides": [expanded[i] for i in group]}, context=context.for_slides(group) if context else None)
+                for i, verdict in zip(group, result["slides"]):
+                    validated[i] = verdict
+            print(" Validation completed successfully!")
+            print(json.dumps({"slides": validated}, indent=4))
+            self._checkpoint(job_id, "validated", {"slides": validated})
+
+        todo = [i for i, slide in enumerate(formatted) if slide is None]
+        if todo:
+            print(f"\n🔹 Step 4: Optimizing format for PPT ({len(todo)} slide(s))...")
+            for group, cache in self._cache_groups(state, todo):
+                with cache:
+                    self._format_into(group, expanded, validated, formatted)
+            print(" Format optimization completed successfully!")
+
+        all_slides = [slide for slide in formatted if slide is not None]
+        final_presentation = {
+            "slides": all_slides,
+            "summary": self.format_optimizer.summarize(all_slides)
+        }
+        print(json.dumps(final_presentation, indent=4))
+        return final_presentation
+
+    def _run_streaming(self, outline: dict, queue_size: int = STAGE_QUEUE_SIZE,
+                       batch_size: int = FORMAT_BATCH_SIZE, state: dict = None, context=None, job_id: str = None):
+        """
+        Pipelined steps 2-4: each slide goes to QA as soon as it is expanded and
+        to formatting as soon as it is validated; QA validates the slides that
+        are ready together, up to the QA agent's batch size. Stages are connected by bounded
+        queues; formatting packs whatever slides are ready into batches of up to
+        batch_size, and results are reassembled in outline order at the end.
+        Outputs already present in state (a resumed job) are passed through.
+        With a ContextStore, expansion and QA read each slide's prefetched context.
+        With a job_id, a stage's checkpoint is rewritten each time one of its
+        slides or batches finishes, so a run cut off mid-way resumes from the
+        slides already done.
+        """
+        slides = outline["slides"]
+        n = len(slides)
+        state = state or {stage: [None] * n for stage in ("expanded", "validated", "formatted")}
+        expanded, validated, formatted = state["expanded"], state["validated"], state["formatted"]
+        errors = []
+        checkpoint_lock = threading.Lock()
+
+        def checkpoint(stage):
+            # Serialized, so an older snapshot never replaces a newer one
+            if job_id:
+                with checkpoint_lock:
+                    self._checkpoint(job_id, stage, {"slides": list(state[stage])})
+
+        todo = Queue()
+        for item in enumerate(slides):
+            todo.put(item)
+        to_qa = Queue(maxsize=queue_size)
+        to_format = Queue(maxsize=queue_size)
+
+        def expand_worker():
+            while True:
+                try:
+                    i, slide = todo.get_nowait()
+                except Empty:
+                    return
+                if expanded[i] is None:
+                    try:
+                        with self._fresh(state, [i]):
+                            expanded[i] = self.expansion_agent.expand_slide(
+                                slide, context.slide_context(i) if context else None)
+                        checkpoint("expanded")
+                    except Exception as e:
+                        errors.append(e)
+                to_qa.put(i)
+
+        def qa_worker():
+            while True:
+                # Validate whatever expanded slides are ready, up to the QA agent's batch size
+                batch = [to_qa.get()]
+                while batch[-1] is not _DONE and len(batch) < self.qa_agent.batch_size:
+                    try:
+                        batch.append(to_qa.get_nowait())
+                    except Empty:
+                        break
+                ready = [i for i in batch if i is not _DONE and expanded[i] is not None and validated[i] is None]
+                if ready:
+                    try:
+                        contexts = [context.slide_context(i) for i in ready] if context else None
+                        with self._fresh(state, ready):
+                            verdicts = self.qa_agent.validate_batch([expanded[i] for i in ready], contexts)
+                        for i, verdict in zip(ready, verdicts):
+                            validated[i] = verdict
+                        checkpoint("validated")
+                    except Exception as e:
+                        errors.append(e)
+                # Always forward, so the format worker sees every slide and the sentinel
+                for i in batch:
+                    if i is not _DONE:
+                        to_format.put(i)
+                if batch[-1] is _DONE:
+                    return
+
+        def format_worker():
+            # Keeps draining to_format until the sentinel even after a failed batch;
+            # otherwise the QA threads would block forever on the bounded queue
+            batch = []
+            while True:
+                i = to_format.get()
+                if i is not _DONE and validated[i] is not None and formatted[i] is None:
+                    batch.append(i)
+                if batch and (i is _DONE or len(batch) >= batch_size or to_format.empty()):
+                    try:
+                        with self._fresh(state, batch):
+                            self._format_into(sorted(batch), expanded, validated, formatted)
+                        checkpoint("formatted")
+                    except Exception as e:
+                        errors.append(e)
+                    batch = []
+                if i is _DONE:
+                    return
+
+        expand_threads = [threading.Thread(target=bind_context(expand_worker), daemon=True)
+                          for _ in range(max(1, min(self.expansion_agent.max_concurrency, n)))]
+        qa_threads = [threading.Thread(target=bind_context(qa_worker), daemon=True)
+                      for _ in range(max(1, min(self.qa_agent.max_concurrency, n)))]
+        format_thread = threading.Thread(target=bind_context(format_worker), daemon=True)
+        for t in expand_threads + qa_threads + [format_thread]:
+            t.start()
+
+        for t in expand_threads:
+            t.join()
+        for _ in qa_threads:
+            to_qa.put(_DONE)
+        for t in qa_threads:
+            t.join()
+        to_format.put(_DONE)
+        format_thread.join()
+
+        if errors:
+            raise errors[0]
+
+        all_slides = [slide for slide in formatted if slide is not None]
+        return {
+            "slides": all_slides,
+            "summary": self.format_optimizer.summarize(all_slides)
+        }
+
+    def _format_into(self, indices, expanded, validated, formatted):
+        """Format one batch and place each result at its outline position."""
+        result = self.format_optimizer.format_batch(
+            [expanded[i] for i in indices], [validated[i] for i in indices]
+        )
+        if len(result) == len(indices):
+            for i, slide in zip(indices, result):
+                formatted[i] = slide
+            return
+        # Model merged or dropped slides: match by title, keep what we can
+        by_title = {slide.get("title"): slide for slide in result}
+        for i in indices:
+            formatted[i] = by_title.get(expanded[i]["title"], {
+                "title": expanded[i]["title"],
+                "content": [{
+                    "statement": FORMAT_FAILED,
+                    "status": "needs_review",
+                    "design_hint": "Manual design needed"
+                }]
+            })
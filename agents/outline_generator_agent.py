@@ -1,37 +1,33 @@
 import os
+import copy
 import json
 from dotenv import load_dotenv
 from langchain.agents import AgentExecutor, Tool, create_json_chat_agent
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferWindowMemory
-from langchain import hub
-from langchain_groq import ChatGroq
+from agents.prompts import REACT_CHAT_JSON_PROMPT
+from utils.llm_provider import get_llm
+from utils.llm_retry import call_with_retry
+from utils.llm_usage import llm_config
 from rag_pipeline.pipeline import RAGPipeline
+from rag_pipeline.context_packer import pack_context
 
 load_dotenv()  # Load .env file
 
+# Estimated-token budget for the context returned by one ContextRetriever call
+OUTLINE_CONTEXT_TOKENS = int(os.getenv("OUTLINE_CONTEXT_TOKENS", 1000))
+
 class OutlineGeneratorAgent:
     def __init__(self, persist_directory="vector_db"):
-        # Load API key
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise ValueError(" Missing GROQ_API_KEY in .env file")
+        # Chat model from the configured provider (groq, fake, record or replay)
+        self.llm = get_llm("outline", temperature=0.3, max_tokens=2048)
 
-        # Load RAG pipeline
+        # Load RAG pipeline (model and vector store are shared process-wide)
         self.rag = RAGPipeline(persist_directory=persist_directory).load()
-        self.retriever = self.rag.retriever
-
-        # Initialize ChatGroq with Qwen model
-        self.llm = ChatGroq(
-            groq_api_key=groq_api_key,
-            model="llama-3.1-8b-instant",
-            temperature=0.3,
-            max_tokens=2048
-        )
 
-        # Memory for contextual conversations
-        self.memory = ConversationBufferWindowMemory(k=3)
+        self._build_executor()
 
+    def _build_executor(self):
+        """ReAct tools and executor bound to this agent's RAG pipeline (no network calls)."""
         # Define RAG tool
         self.tools = [
             Tool(
@@ -41,11 +37,8 @@ class OutlineGeneratorAgent:
             )
         ]
 
-        # Pull a strict JSON-formatted prompt from LangChain Hub
-        self.prompt = hub.pull("hwchase17/react-chat-json")
-
-        # Create JSON agent
-        self.agent = create_json_chat_agent(self.llm, self.tools, self.prompt)
+        # Create JSON agent on the vendored react-chat-json template
+        self.agent = create_json_chat_agent(self.llm, self.tools, REACT_CHAT_JSON_PROMPT)
 
         # Wrap in AgentExecutor for running the agent
         self.agent_executor = AgentExecutor(
@@ -54,10 +47,17 @@ class OutlineGeneratorAgent:
             verbose=True
         )
 
+    def for_collection(self, persist_directory: str):
+        """Copy that shares this agent's LLM client but retrieves from another collection."""
+        agent = copy.copy(self)
+        agent.rag = RAGPipeline(persist_directory=persist_directory).load()
+        agent._build_executor()
+        return agent
+
     def retrieve_context(self, query):
         """Fetch top-5 relevant chunks from the vector DB"""
-        results = self.retriever.get_relevant_documents(query)
-        return "\n\n".join([doc.page_content for doc in results])
+        results = self.rag.get_relevant_documents(query, k=5)
+        return pack_context(results, OUTLINE_CONTEXT_TOKENS)
 
     def generate_outline(self, topic: str, slides: int = 15):
         """Generate a structured presentation outline with strict JSON output"""
@@ -80,7 +80,12 @@ class OutlineGeneratorAgent:
                     {{ "slides": [ {{"title": "Slide 1 Title", "bullet_points": ["point1", "point2"]}}, ... ] }}
                 """
 
-        result = self.agent_executor.invoke({"input": prompt})
+        # Every later stage needs the outline, so there is no per-slide fallback here:
+        # failures surface as one clear error and the job can be resumed from scratch
+        try:
+            result = call_with_retry(self.agent_executor.invoke, {"input": prompt}, **llm_config("outline"))
+        except Exception as e:
+            raise ValueError(f" Outline generation failed: {type(e).__name__}: {e}") from e
 
         # The agent always returns a dict with the final parsed JSON
         output = result.get("output") or result.get("response") or result
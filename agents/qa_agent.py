@@ -1,35 +1,52 @@
 import os
+import copy
 import json
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from langchain.agents import AgentExecutor, Tool, create_json_chat_agent
-from langchain.memory import ConversationBufferWindowMemory
-from langchain import hub
-from langchain_groq import ChatGroq
+from agents.prompts import REACT_CHAT_JSON_PROMPT
+from utils.llm_provider import get_llm
+from utils.llm_retry import call_with_retry
+from utils.llm_usage import bind_context, llm_config
 from rag_pipeline.pipeline import RAGPipeline
+from rag_pipeline.context_packer import pack_context, pack_documents, format_passages
 
 load_dotenv()
 
+# Max slides (or slide batches, in direct mode) validated in parallel (1 = sequential)
+QA_CONCURRENCY = int(os.getenv("QA_CONCURRENCY", 4))
+# "react" (default): let the ReAct agent decide when to call ContextRetriever, one loop per slide;
+# "direct": retrieve context up front, then one LLM call per batch of slides
+QA_MODE = os.getenv("QA_MODE", "react")
+# Slides validated per LLM call in direct mode
+QA_BATCH_SIZE = int(os.getenv("QA_BATCH_SIZE", 4))
+# Context chunks retrieved per statement in direct mode
+QA_CONTEXT_K = 2
+# Estimated-token budget for the (deduplicated) context passages of one QA call
+QA_CONTEXT_TOKENS = int(os.getenv("QA_CONTEXT_TOKENS", 2500))
+# Placeholder point for a slide that could not be validated
+VALIDATION_FAILED = " Validation failed"
+
 class QAAgent:
-    def __init__(self, persist_directory="vector_db"):
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise ValueError(" Missing GROQ_API_KEY in .env file")
-
-        # Load RAG pipeline
-        self.rag = RAGPipeline(persist_directory=persist_directory).load()
-        self.retriever = self.rag.retriever
-
-        # Groq LLM for strict JSON QA
-        self.llm = ChatGroq(
-            groq_api_key=groq_api_key,
-            model="llama-3.1-8b-instant",
-            temperature=0,
-            max_tokens=1200
-        )
+    def __init__(self, persist_directory="vector_db", max_concurrency: int = QA_CONCURRENCY,
+                 mode: str = QA_MODE, batch_size: int = QA_BATCH_SIZE, llm=None, rag=None):
+        self.max_concurrency = max_concurrency
+        self.mode = mode
+        # The ReAct loop validates one slide at a time
+        self.batch_size = max(1, batch_size) if mode == "direct" else 1
+
+        # Any chat model with .invoke() can be injected (e.g. a local fake for tests)
+        # Otherwise a strict JSON QA model from the configured provider
+        self.llm = llm if llm is not None else get_llm("qa", temperature=0, max_tokens=1200)
 
-        # Conversation memory
-        self.memory = ConversationBufferWindowMemory(k=3)
+        # Load RAG pipeline (model and vector store are shared process-wide)
+        self.rag = rag if rag is not None else RAGPipeline(persist_directory=persist_directory).load()
 
+        if self.mode != "direct":
+            self._build_executor()
+
+    def _build_executor(self):
+        """ReAct tools and executor bound to this agent's RAG pipeline (no network calls)."""
         # Context retriever tool with fewer chunks
         self.tools = [
             Tool(
@@ -39,11 +56,8 @@ class QAAgent:
             )
         ]
 
-        # Strict JSON template
-        self.prompt = hub.pull("hwchase17/react-chat-json")
-
-        # JSON-only agent
-        self.agent = create_json_chat_agent(self.llm, self.tools, self.prompt)
+        # JSON-only agent on the vendored react-chat-json template
+        self.agent = create_json_chat_agent(self.llm, self.tools, REACT_CHAT_JSON_PROMPT)
 
         self.agent_executor = AgentExecutor(
             agent=self.agent,
@@ -51,73 +65,231 @@ class QAAgent:
             verbose=True
         )
 
+    def for_collection(self, persist_directory: str):
+        """Copy that shares this agent's LLM client but validates against another collection."""
+        agent = copy.copy(self)
+        agent.rag = RAGPipeline(persist_directory=persist_directory).load()
+        if agent.mode != "direct":
+            agent._build_executor()
+        return agent
+
     def retrieve_context(self, query):
         """Fetch top-2 relevant chunks from the vector DB"""
-        results = self.retriever.get_relevant_documents(query)
-        return "\n\n".join([doc.page_content for doc in results[:2]])
+        results = self.rag.get_relevant_documents(query, k=2)
+        return pack_context(results, QA_CONTEXT_TOKENS)
+
+    @staticmethod
+    def _failed_validation(slide_title, reason="Could not parse model response."):
+        return {
+            "title": slide_title,
+            "validation": [
+                {
+                    "point": VALIDATION_FAILED,
+                    "status": "needs_review",
+                    "reason": reason
+                }
+            ]
+        }
+
+    @staticmethod
+    def _is_verdict(verdict):
+        """A slide verdict as the prompt asks for: a dict with a list of per-statement dicts."""
+        return (isinstance(verdict, dict) and isinstance(verdict.get("validation"), list)
+                and all(isinstance(v, dict) for v in verdict["validation"]))
+
+    @staticmethod
+    def _title_key(title):
+        return " ".join(str(title).lower().split())
 
     def _try_parse_json(self, raw_output, slide_title):
         """Attempt JSON parsing, fallback if failed"""
-        if isinstance(raw_output, dict):
-            return raw_output
-        try:
-            return json.loads(raw_output)
-        except json.JSONDecodeError:
-            print(f" JSON parsing failed for slide: {slide_title}")
-            return {
-                "title": slide_title,
-                "validation": [
-                    {
-                        "point": " Validation failed",
-                        "status": "needs_review",
-                        "reason": "Could not parse model response."
-                    }
-                ]
-            }
-
-    def validate_content(self, expanded_json: dict):
+        if not isinstance(raw_output, dict):
+            try:
+                raw_output = json.loads(raw_output)
+            except (json.JSONDecodeError, TypeError):
+                print(f" JSON parsing failed for slide: {slide_title}")
+                return self._failed_validation(slide_title)
+        if not self._is_verdict(raw_output):
+            print(f" Malformed verdict for slide: {slide_title}")
+            return self._failed_validation(slide_title)
+        return raw_output
+
+    def validate_content(self, expanded_json: dict, max_concurrency: int = None, context=None):
         """
         Validates the expanded slide content against retrieved knowledge base.
-        Returns JSON with per-slide verification results.
+        Slides have no data dependency on each other, so up to max_concurrency
+        batches (one slide each in react mode) are validated in parallel.
+        With a ContextStore, direct mode reuses the slides' prefetched chunks.
+        Returns JSON with per-slide verification results, in input order.
+        """
+        slides = expanded_json["slides"]
+        batches = [range(i, min(i + self.batch_size, len(slides))) for i in range(0, len(slides), self.batch_size)]
+
+        def validate(indices):
+            contexts = [context.slide_context(i) for i in indices] if context and self.mode == "direct" else None
+            return self.validate_batch([slides[i] for i in indices], contexts)
+
+        workers = max(1, min(max_concurrency or self.max_concurrency, len(batches) or 1))
+        if workers == 1:
+            results = [validate(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(bind_context(validate), batches))
+        return {"slides": [slide for batch in results for slide in batch]}
+
+    def validate_batch(self, slides: list, contexts: list = None):
+        """
+        Validate several slides; returns one verdict per slide, in input order.
+        contexts optionally holds each slide's prefetched chunks (one list per
+        statement); slides without them are retrieved here.
+        """
+        if self.mode != "direct":
+            return [self.validate_slide(slide) for slide in slides]
+
+        # Statements expand their bullets one to one, so prefetched per-bullet
+        # context applies only when the counts match (not to failed expansions)
+        contexts = [
+            ctx if ctx is not None and len(ctx) == len(slide["detailed_points"]) else None
+            for slide, ctx in zip(slides, contexts or [None] * len(slides))
+        ]
+        # Retrieve context for every other statement of the batch in one batched search,
+        # numbering each distinct chunk once so shared context is sent only once
+        points = [point for slide, ctx in zip(slides, contexts) if ctx is None for point in slide["detailed_points"]]
+        fetched = iter(self.rag.get_relevant_documents_batch(points, k=QA_CONTEXT_K) if points else [])
+        refs = iter([
+            docs for slide, ctx in zip(slides, contexts)
+            for docs in (ctx if ctx is not None else [next(fetched) for _ in slide["detailed_points"]])
+        ])
+        passages, docs, numbers = {}, [], []
+        for slide in slides:
+            for _ in slide["detailed_points"]:
+                refs_for_point = []
+                for doc in next(refs):
+                    key = doc.metadata.get("chunk_id") or doc.page_content
+                    if key not in passages:
+                        passages[key] = len(passages) + 1
+                        docs.append(doc)
+                    refs_for_point.append(passages[key])
+                numbers.append(refs_for_point)
+        # Overlapping chunks and repeated sentences are sent once, within the token budget;
+        # statements only cite passages that survived
+        packed = pack_documents(docs, QA_CONTEXT_TOKENS)
+        kept = {n for n, _ in packed}
+        numbers = iter(numbers)
+        payload = [
+            {"title": slide["title"], "statements": [
+                {"point": point, "context": [n for n in next(numbers) if n in kept]}
+                for point in slide["detailed_points"]
+            ]}
+            for slide in slides
+        ]
+        context_text = format_passages(packed) or "(no context found)"
+        titles = ", ".join(s["title"] for s in slides)
+
+        prompt = f"""
+        You are an API that outputs ONLY valid JSON.
+        Do NOT add explanations, <think> tags, or commentary.
+
+        Validate EACH statement of EACH slide below against the numbered context passages.
+        Each statement lists the passages retrieved for it under "context".
+        If the context does not support a statement, mark it as "needs_review".
+        Return one entry per slide, in the same order and with the same titles.
+
+        ### JSON format to return:
+        {{
+            "slides": [
+                {{
+                    "title": "Slide title",
+                    "validation": [
+                        {{
+                            "point": "Expanded statement",
+                            "status": "accurate" | "needs_review",
+                            "reason": "Why it needs review (if applicable)"
+                        }}
+                    ]
+                }}
+            ]
+        }}
+
+        Context passages:
+        {context_text}
+
+        Slides to validate:
+        {json.dumps({"slides": payload})}
         """
-        validated_slides = []
-
-        for slide in expanded_json["slides"]:
-            slide_title = slide["title"]
-            detailed_points = slide["detailed_points"]
-
-            # Strict JSON-only prompt
-            prompt = f"""
-            You are an API that outputs ONLY valid JSON.
-            Do NOT add explanations, <think> tags, or commentary.
-
-            Validate EACH statement in the given slide using available context.
-            If context is insufficient, mark as "needs_review".
-
-            ### JSON format to return:
-            {{
-                "title": "{slide_title}",
-                "validation": [
-                    {{
-                        "point": "Expanded statement",
-                        "status": "accurate" | "needs_review",
-                        "reason": "Why it needs review (if applicable)"
-                    }}
-                ]
-            }}
-
-            Slide to validate:
-            {{
-                "title": "{slide_title}",
-                "detailed_points": {json.dumps(detailed_points)}
-            }}
-            """
-
-            # Run agent
-            result = self.agent_executor.invoke({"input": prompt})
-            raw_output = result.get("output") or result.get("response") or result
-
-            # Try parsing JSON safely
-            validated_slides.append(self._try_parse_json(raw_output, slide_title))
-
-        return {"slides": validated_slides}
+
+        try:
+            response = call_with_retry(self.llm.invoke, prompt, **llm_config("qa"))
+            result = json.loads(response.content.strip())["slides"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            print(f" JSON parsing failed in QAAgent for slides: {titles}")
+            return [self._failed_validation(s["title"]) for s in slides]
+        except Exception as e:
+            print(f" LLM request failed for slides: {titles}: {e}")
+            return [self._failed_validation(s["title"], "Validation request failed.") for s in slides]
+
+        if not isinstance(result, list):
+            print(f" Malformed verdicts in QAAgent for slides: {titles}")
+            return [self._failed_validation(s["title"]) for s in slides]
+        # Only well-formed verdicts are kept, matched to slides by title: the one at the
+        # same position first (repeated titles), otherwise the first with that title.
+        # Slides the model merged, dropped or mangled fall back to needs_review.
+        by_title = {}
+        for verdict in result:
+            if self._is_verdict(verdict):
+                by_title.setdefault(self._title_key(verdict.get("title")), verdict)
+        verdicts = []
+        for i, slide in enumerate(slides):
+            key = self._title_key(slide["title"])
+            verdict = result[i] if i < len(result) else None
+            if not (self._is_verdict(verdict) and self._title_key(verdict.get("title")) == key):
+                verdict = by_title.get(key)
+            verdicts.append(verdict or self._failed_validation(slide["title"]))
+        return verdicts
+
+    def validate_slide(self, slide: dict):
+        """Validate a single slide (ReAct loop in react mode)."""
+        if self.mode == "direct":
+            return self.validate_batch([slide])[0]
+
+        slide_title = slide["title"]
+        detailed_points = slide["detailed_points"]
+
+        # Strict JSON-only prompt
+        prompt = f"""
+        You are an API that outputs ONLY valid JSON.
+        Do NOT add explanations, <think> tags, or commentary.
+
+        Validate EACH statement in the given slide using available context.
+        If context is insufficient, mark as "needs_review".
+
+        ### JSON format to return:
+        {{
+            "title": "{slide_title}",
+            "validation": [
+                {{
+                    "point": "Expanded statement",
+                    "status": "accurate" | "needs_review",
+                    "reason": "Why it needs review (if applicable)"
+                }}
+            ]
+        }}
+
+        Slide to validate:
+        {{
+            "title": "{slide_title}",
+            "detailed_points": {json.dumps(detailed_points)}
+        }}
+        """
+
+        # Run agent; a slide whose retries are exhausted (or shed by the circuit
+        # breaker or the token budget) gets a placeholder instead of failing the stage
+        try:
+            result = call_with_retry(self.agent_executor.invoke, {"input": prompt}, **llm_config("qa"))
+        except Exception as e:
+            print(f" LLM request failed for slide: {slide_title}: {e}")
+            return self._failed_validation(slide_title, "Validation request failed.")
+        raw_output = result.get("output") or result.get("response") or result
+
+        # Try parsing JSON safely
+        return self._try_parse_json(raw_output, slide_title)
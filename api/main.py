@@ -1,9 +1,16 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api.routes import upload, generate, download, auth, memory
+from api.routes import upload, generate, download, auth, memory, usage
 from utils.middleware import AuditAndFilterMiddleware
 
-app = FastAPI(title="AI Presentation Orchestrator")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build agents (LLM clients, prompts, executors) once; requests reuse them
+    generate.warm_up(app)
+    yield
+
+app = FastAPI(title="AI Presentation Orchestrator", lifespan=lifespan)
 
 # Middleware
 app.add_middleware(
@@ -21,6 +28,7 @@ app.include_router(upload.router, prefix="/api")
 app.include_router(generate.router, prefix="/api")
 app.include_router(download.router, prefix="/api")
 app.include_router(memory.router, prefix="/api")
+app.include_router(usage.router, prefix="/api")
 
 @app.get("/")
 def root():
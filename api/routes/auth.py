@@ -14,14 +14,15 @@ def login(body: LoginRequest):
     user = authenticate_user(body.email, body.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = create_access_token(subject=body.email, role=user["role"])
+    token = create_access_token(subject=body.email, role=user["role"], collections=user["collections"])
     
     return {
         "access_token": token,
         "token_type": "bearer",
         "user": {
             "email": user["email"],
-            "role": user["role"]
+            "role": user["role"],
+            "collections": user["collections"]
         }
     }
 
@@ -1,32 +1,115 @@
-from fastapi import APIRouter, Depends, HTTPException
+import threading
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
 from agents.orchestration import PresentationOrchestrator
-from utils.security import require_role
+from utils.security import require_role, authorize_collection
 from utils.ppt_generator import PPTGenerator
+from utils.llm_usage import track_usage
+from utils.job_store import job_store
+from rag_pipeline.registry import collection_directory, DEFAULT_COLLECTION
 
 router = APIRouter(tags=["Presentation Generation"])
 
+_warm_lock = threading.Lock()
+
+def warm_up(app):
+    """Build the shared orchestrator at startup; on failure it is retried on first request."""
+    try:
+        get_orchestrator(app)
+        print(" Agent pool ready")
+    except Exception as e:
+        print(f" Agent pool warm-up failed: {e}")
+
+def get_orchestrator(app):
+    """The process-wide orchestrator, built once and reused by every request."""
+    with _warm_lock:
+        if getattr(app.state, "orchestrator", None) is None:
+            app.state.orchestrator = PresentationOrchestrator(
+                persist_directory=collection_directory(DEFAULT_COLLECTION)
+            )
+        return app.state.orchestrator
+
+def _run_job(request: Request, job_id: str, topic: str, collection: str, persist_directory: str, user: dict):
+    """Run (or resume) one generation job and build the API response."""
+    try:
+        orchestrator = get_orchestrator(request.app).for_collection(persist_directory)
+        # Every LLM call below is accounted to this request and capped by LLM_TOKEN_BUDGET
+        with track_usage(user=user["email"]) as usage:
+            final_ppt_json = orchestrator.generate_presentation(topic, persist_directory=persist_directory, job_id=job_id)
+    finally:
+        job_store.release(job_id)
+    usage_summary = usage.finish()
+
+    # Auto-generate PPT
+    ppt_generator = PPTGenerator(output_dir="generated_ppt")
+    ppt_path = ppt_generator.generate_ppt(final_ppt_json, file_name="AI_Presentation.pptx")
+    job = job_store.meta(job_id)
+
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": " Presentation generated successfully!",
+            "topic": topic,
+            "collection": collection,
+            "job_id": job_id,
+            "job_status": job["status"],
+            "failed_slides": job.get("failed_slides", []),
+            "ppt_json": final_ppt_json,
+            "ppt_path": ppt_path,
+            "usage": usage_summary
+        }
+    )
+
+def _owned_job(job_id: str, user: dict):
+    """Job metadata if it exists and belongs to the caller, else 404."""
+    try:
+        job = job_store.meta(job_id)
+    except ValueError:
+        job = None
+    if job is None or job.get("user") != user["email"]:
+        raise HTTPException(status_code=404, detail=f" Job not found: {job_id}")
+    return job
+
 @router.post("/generate-presentation")
 async def generate_presentation(
+    request: Request,
     topic: str,
+    collection: str = DEFAULT_COLLECTION,
     user=Depends(require_role(["Executive", "Senior Manager", "Analyst"]))
 ):
+    collection = collection or DEFAULT_COLLECTION
+    authorize_collection(user, collection)
+    try:
+        persist_directory = collection_directory(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        orchestrator = PresentationOrchestrator(persist_directory="vector_db")
-        final_ppt_json = orchestrator.generate_presentation(topic, persist_directory="vector_db")
-
-        # Auto-generate PPT
-        ppt_generator = PPTGenerator(output_dir="generated_ppt")
-        ppt_path = ppt_generator.generate_ppt(final_ppt_json, file_name="AI_Presentation.pptx")
-
-        return JSONResponse(
-            status_code=200,
-            content={
-                "message": " Presentation generated successfully!",
-                "topic": topic,
-                "ppt_json": final_ppt_json,
-                "ppt_path": ppt_path
-            }
-        )
+        # Stage outputs are checkpointed under this job so a failed run can be resumed
+        job_id = job_store.create(topic=topic, collection=collection, user=user["email"])
+        return _run_job(request, job_id, topic, collection, persist_directory, user)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f" Failed to generate presentation: {e}")
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, user=Depends(require_role(["Executive", "Senior Manager", "Analyst"]))):
+    """Status, checkpointed stages and still-failed slides of a generation job."""
+    return _owned_job(job_id, user)
+
+@router.post("/jobs/{job_id}/resume")
+async def resume_job(
+    request: Request,
+    job_id: str,
+    user=Depends(require_role(["Executive", "Senior Manager", "Analyst"]))
+):
+    """Continue a job from its checkpoints: finished stages and slides are reused, failed ones redone."""
+    job = _owned_job(job_id, user)
+    # Access may have been revoked since the job started
+    authorize_collection(user, job["collection"])
+    persist_directory = collection_directory(job["collection"])
+    # Two runs of one job would write the same checkpoint files
+    if not job_store.claim(job_id):
+        raise HTTPException(status_code=409, detail=f" Job {job_id} is already running")
+    try:
+        return _run_job(request, job_id, job["topic"], job["collection"], persist_directory, user)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f" Failed to resume job {job_id}: {e}")
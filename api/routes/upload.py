@@ -2,7 +2,8 @@ from fastapi import APIRouter, File, UploadFile, Depends, HTTPException
 import os
 import shutil
 from rag_pipeline.pipeline import RAGPipeline
-from utils.security import require_role
+from rag_pipeline.registry import collection_directory, DEFAULT_COLLECTION
+from utils.security import require_role, authorize_collection
 
 router = APIRouter(tags=["Upload"])
 
@@ -20,11 +21,22 @@ ALLOWED_MIME_TYPES = {
 @router.post("/upload-doc")
 async def upload_docs(
     files: list[UploadFile] = File(...),
+    collection: str = DEFAULT_COLLECTION,
     user=Depends(require_role(["Executive", "Senior Manager", "Analyst"]))
 ):
     """
     Upload files and index into RAG. Returns saved file paths and user info.
+    Each collection (user, team or project) is indexed in its own directory;
+    the caller's token must grant access to it.
     """
+    collection = collection or DEFAULT_COLLECTION
+    authorize_collection(user, collection)
+    try:
+        persist_directory = collection_directory(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    upload_dir = UPLOAD_DIR if collection == DEFAULT_COLLECTION else os.path.join(UPLOAD_DIR, collection)
+    os.makedirs(upload_dir, exist_ok=True)
     
     # print("UPLOAD ENDPOINT CALLED  with user:", user)
     # print("FILES RECEIVED:", [f.filename for f in files])
@@ -44,7 +56,7 @@ async def upload_docs(
             if file.size == 0:
                 raise HTTPException(status_code=400, detail=f"File {file.filename} is empty")
                 
-            file_path = os.path.join(UPLOAD_DIR, file.filename)
+            file_path = os.path.join(upload_dir, file.filename)
             file_path = os.path.normpath(file_path)  # prevent path traversal
             
             # Save file
@@ -54,7 +66,7 @@ async def upload_docs(
             saved_files.append(file_path)
 
         # Index into vector DB
-        rag = RAGPipeline(persist_directory="vector_db")
+        rag = RAGPipeline(persist_directory=persist_directory)
         if hasattr(rag, "index_documents"):
             rag.index_documents(saved_files)
         elif hasattr(rag, "build"):
@@ -65,6 +77,7 @@ async def upload_docs(
         return {
             "message": " Documents uploaded & processed",
             "files": saved_files,
+            "collection": collection,
             "user": user
         }
     except Exception as e:
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends
+from utils.llm_usage import usage_by_user
+from utils.security import get_current_user, require_role
+from rag_pipeline.registry import open_indexes
+
+router = APIRouter(tags=["Usage"])
+
+@router.get("/usage")
+async def get_usage(user=Depends(get_current_user)):
+    """
+    LLM usage (requests, tokens, estimated cost) of the current user since
+    the server started.
+    """
+    totals = usage_by_user().get(user["email"], {"requests": 0, "total_tokens": 0, "cost_usd": 0.0})
+    return {"user": user["email"], "usage": totals}
+
+@router.get("/usage/all")
+async def get_all_usage(user=Depends(require_role(["Executive"]))):
+    """
+    LLM usage of every user, plus the vector indexes currently held open
+    by this process (Executive only).
+    """
+    return {"users": usage_by_user(), "open_indexes": open_indexes()}
@@ -99,6 +99,9 @@ if st.session_state.get("token"):
         st.sidebar.success(" Logged out successfully")
         st.rerun()
 
+# ---------------- COLLECTION ----------------
+collection = st.sidebar.text_input("Collection (user, team or project)", "default")
+
 # ---------------- UPLOAD DOCS ----------------
 st.subheader(" Step 1: Upload Documents")
 if not perms["upload"]:
@@ -125,7 +128,9 @@ if uploaded_files and perms["upload"] and st.button(" Upload & Process Documents
             )
 
         try:
-            response = session.post(f"{API_BASE_URL}/upload-doc", files=files, timeout=120)
+            response = session.post(
+                f"{API_BASE_URL}/upload-doc", files=files, params={"collection": collection}, timeout=120
+            )
             if response.status_code == 200:
                 st.success(" Documents uploaded and processed successfully!")
                 # st.json(response.json())
@@ -148,7 +153,7 @@ else:
             try:
                 response = requests.post(
                     f"{API_BASE_URL}/generate-presentation",
-                    params={"topic": topic},
+                    params={"topic": topic, "collection": collection},
                     headers=headers,
                     timeout=600
                 )
@@ -0,0 +1,116 @@
+import re
+from utils.tokens import estimate_tokens
+
+# Sentences sharing at least this fraction of their words count as duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# Shortest text overlap between two chunks treated as splitter overlap (no offsets recorded)
+MIN_TEXT_OVERLAP = 30
+# Splitter overlap is 150 characters; search a little beyond it
+MAX_TEXT_OVERLAP = 400
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _span(doc):
+    start, end = doc.metadata.get("start_index"), doc.metadata.get("end_index")
+    if start is None or end is None:
+        return None
+    return (doc.metadata.get("source"), doc.metadata.get("page")), start, end
+
+
+def _trim_span_overlap(text, start, end, kept):
+    """Cut the parts of text (at start:end of its page) already covered by kept spans."""
+    for s, e in kept:
+        if s <= start and end <= e:
+            return ""
+        if s <= start < e:
+            text, start = text[e - start:], e
+        elif s < end <= e:
+            text, end = text[:len(text) - (end - s)], s
+    return text
+
+
+def _trim_text_overlap(text, kept_texts):
+    """Drop a prefix or suffix of text that repeats the end or start of an earlier chunk."""
+    for other in kept_texts:
+        longest = min(len(text), len(other), MAX_TEXT_OVERLAP)
+        for n in range(longest, MIN_TEXT_OVERLAP - 1, -1):
+            if other.endswith(text[:n]):
+                text = text[n:]
+                break
+            if other.startswith(text[-n:]):
+                text = text[:-n]
+                break
+    return text
+
+
+def _words(sentence):
+    return frozenset(WORD_RE.findall(sentence.lower()))
+
+
+def _is_near_duplicate(words, seen):
+    if not words:
+        return True
+    for other in seen:
+        if len(words & other) / len(words | other) >= NEAR_DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+def pack_documents(docs, max_tokens, labels=None):
+    """
+    Compress retrieved chunks (best first) for a prompt: overlap between
+    chunks of the same document is removed (by recorded offsets, else by
+    matching text), near-duplicate sentences are dropped, and passages are
+    kept in rank order until the "[label] text" lines reach max_tokens.
+    Returns (label, text) pairs; labels default to 1..n, and a label whose
+    chunk was entirely redundant or out of budget is left out.
+    """
+    labels = list(labels) if labels is not None else list(range(1, len(docs) + 1))
+    spans, texts, seen = {}, [], []
+    packed, used = [], 0
+    for label, doc in zip(labels, docs):
+        text = doc.page_content
+        span = _span(doc)
+        if span is not None:
+            key, start, end = span
+            text = _trim_span_overlap(text, start, end, spans.get(key, []))
+            spans.setdefault(key, []).append((start, end))
+        else:
+            text = _trim_text_overlap(text, texts)
+        texts.append(doc.page_content)
+
+        sentences = []
+        for sentence in SENTENCE_RE.split(text.strip()):
+            words = _words(sentence)
+            if sentence.strip() and not _is_near_duplicate(words, seen):
+                seen.append(words)
+                sentences.append(sentence.strip())
+        if not sentences:
+            continue
+
+        # Fill the budget sentence by sentence; lower-ranked chunks get what is left
+        kept = []
+        prefix = estimate_tokens(f"[{label}] ") + 1
+        for sentence in sentences:
+            cost = estimate_tokens(sentence + " ")
+            if used + prefix + cost > max_tokens:
+                break
+            kept.append(sentence)
+            used += cost
+        if kept:
+            used += prefix
+            packed.append((label, " ".join(kept)))
+        if len(kept) < len(sentences):
+            break
+    return packed
+
+
+def format_passages(packed):
+    return "\n\n".join(f"[{label}] {text}" for label, text in packed)
+
+
+def pack_context(docs, max_tokens):
+    """Numbered, deduplicated context text for a prompt or tool answer, within max_tokens."""
+    return format_passages(pack_documents(docs, max_tokens))
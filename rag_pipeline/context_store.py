@@ -0,0 +1,91 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.llm_usage import bind_context
+
+# Background threads retrieving context for one run
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 2))
+# Slides whose bullets are embedded and searched together in one batched call
+PREFETCH_BATCH_SLIDES = 4
+
+
+class ContextStore:
+    """
+    Per-run store of retrieved context, filled speculatively as soon as the
+    outline exists. Each slide's bullets are searched (as "title: bullet") in
+    background batches; expansion and QA then read the results by slide index
+    instead of retrieving inline, so every subject is searched once per run.
+    """
+
+    def __init__(self, rag, k=2, max_workers=PREFETCH_WORKERS):
+        self.rag = rag
+        self.k = k
+        self.hits = 0
+        self.misses = 0
+        self._slides = {}  # slide index -> (future, offset, bullet count)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @staticmethod
+    def _queries(slide):
+        return [f"{slide['title']}: {point}" for point in slide.get("bullet_points", [])]
+
+    def prefetch(self, slides, indices=None):
+        """Start retrieval for the given slides (all by default) without waiting for it."""
+        indices = list(range(len(slides))) if indices is None else list(indices)
+        for start in range(0, len(indices), PREFETCH_BATCH_SLIDES):
+            batch = indices[start:start + PREFETCH_BATCH_SLIDES]
+            queries, spans = [], []
+            for i in batch:
+                slide_queries = self._queries(slides[i])
+                spans.append((i, len(queries), len(slide_queries)))
+                queries.extend(slide_queries)
+            future = self._executor.submit(bind_context(self.rag.get_relevant_documents_batch), queries, k=self.k)
+            with self._lock:
+                for i, offset, count in spans:
+                    self._slides[i] = (future, offset, count)
+
+    def slide_context(self, index):
+        """
+        Retrieved chunks for slide `index`, one list per bullet point, waiting
+        for the prefetch if it is still running; None if it was never
+        prefetched or retrieval failed.
+        """
+        with self._lock:
+            entry = self._slides.get(index)
+            if entry is None:
+                self.misses += 1
+                return None
+        future, offset, count = entry
+        try:
+            docs = future.result()[offset:offset + count]
+        except Exception as e:
+            print(f" Context prefetch failed for slide {index}: {e}")
+            docs = None
+        # Counted under the lock: expansion and QA worker threads read concurrently
+        with self._lock:
+            if docs is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return docs
+
+    def for_slides(self, indices):
+        """View over a subset of slides, indexed by position within `indices`."""
+        return _ContextView(self, list(indices))
+
+    def stats(self):
+        with self._lock:
+            return {"prefetched_slides": len(self._slides), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _ContextView:
+    def __init__(self, store, indices):
+        self.store = store
+        self.indices = indices
+
+    def slide_context(self, index):
+        return self.store.slide_context(self.indices[index])
@@ -1,5 +1,161 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
 from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", 512))
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")  # float16 | float32
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Disk-backed embedding cache keyed by (model name, normalized chunk text hash).
+    Vectors are stored as float16/float32 blobs in SQLite; the least recently
+    used rows are evicted once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, embeddings, model_name=MODEL_NAME, cache_dir=EMBEDDING_CACHE_DIR,
+                 max_bytes=int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024), dtype=EMBEDDING_CACHE_DTYPE):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "embeddings.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, dtype TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def _key(self, text):
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _cached(self, keys, touch):
+        """Cached vectors by key; touch=True also refreshes their LRU timestamp."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector, dtype FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                found.update({key: np.frombuffer(blob, dtype=dt) for key, blob, dt in rows})
+            if found and touch:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(time.time(), k) for k in found]
+                )
+        return found
+
+    def _embed(self, texts, persist):
+        keys = [self._key(t) for t in texts]
+        vectors = [None] * len(texts)
+        now = time.time()
+        found = self._cached(keys, touch=persist)
+
+        missing = []
+        for i, key in enumerate(keys):
+            if key in found:
+                vectors[i] = found[key].astype(np.float32).tolist()
+            else:
+                missing.append(i)
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # Embed each distinct missing text once, in a single model call
+            unique = {}
+            for i in missing:
+                unique.setdefault(keys[i], texts[i])
+            computed = dict(zip(unique, self.embeddings.embed_documents(list(unique.values()))))
+            for i in missing:
+                vectors[i] = list(computed[keys[i]])
+            if persist:
+                self._store(computed, now)
+        if found and persist and not missing:
+            with self._lock:
+                self._conn.commit()
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._embed(texts, persist=True)
+
+    def embed_queries(self, texts):
+        """
+        Embed retrieval queries: served from the cache when a chunk with the
+        same text was embedded, but never written to it (queries are one-off
+        and would crowd chunk vectors out of the LRU).
+        """
+        return self._embed(texts, persist=False)
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def _store(self, computed, now):
+        rows = []
+        for key, vector in computed.items():
+            blob = np.asarray(vector, dtype=self.dtype).tobytes()
+            rows.append((key, blob, self.dtype.name, now))
+        with self._lock:
+            # A key stored meanwhile (e.g. the same chunk in a concurrent upload) is
+            # replaced, so only the difference in size is added
+            replaced = 0
+            keys = [r[0] for r in rows]
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings "
+                    f"WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, dtype, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._size += sum(len(r[1]) for r in rows) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used vectors until the cache is at 90% of max_bytes."""
+        target = int(self.max_bytes * 0.9)
+        for key, size in self._conn.execute(
+            "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used ASC"
+        ).fetchall():
+            if self._size <= target:
+                break
+            self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+            self._size -= size
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "size_bytes": self._size,
+        }
+
 
 def get_embeddings():
-    """Return a Sentence Transformer embedding model."""
-    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    """Return a Sentence Transformer embedding model behind a persistent cache."""
+    embeddings = HuggingFaceEmbeddings(model_name=MODEL_NAME)
+    if os.getenv("EMBEDDING_CACHE", "1") == "0":
+        return embeddings
+    return CachedEmbeddings(embeddings, model_name=MODEL_NAME)
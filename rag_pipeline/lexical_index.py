@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import math
+import threading
+from array import array
+import numpy as np
+from langchain.docstore.document import Document
+
+POSTINGS_FILE = "lexical_postings.npz"
+DOCS_FILE = "lexical_docs.json"
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-_/][a-z0-9]+)*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "to", "was", "were", "will", "with",
+}
+
+
+def tokenize(text):
+    """Lowercase word tokens; keeps codes and figures like 'xr-200' or '3.5' intact."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Incremental BM25 inverted index stored next to the vector store.
+    Postings are compact uint32 arrays (doc numbers + term frequencies);
+    deletions are tombstoned and compacted away on persist().
+    """
+
+    def __init__(self, persist_directory="vector_db", k1=1.5, b=0.75):
+        self.persist_directory = persist_directory
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.ids, self.texts, self.metadatas = [], [], []
+        self.doc_len = array("I")
+        self.alive = bytearray()
+        self.postings = {}  # term -> (array("I") doc numbers, array("I") term frequencies)
+        self.positions = {}  # chunk id -> doc number
+        self.live_count = 0
+        self.total_len = 0
+
+    def _path(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    def exists(self):
+        return os.path.exists(self._path(DOCS_FILE))
+
+    def __len__(self):
+        return self.live_count
+
+    def _load(self):
+        if not self.exists():
+            return
+        with open(self._path(DOCS_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        data = np.load(self._path(POSTINGS_FILE))
+        self.ids, self.texts, self.metadatas = meta["ids"], meta["texts"], meta["metadatas"]
+        self.doc_len = array("I", data["doc_len"].astype(np.uint32).tobytes())
+        self.alive = bytearray(b"\x01" * len(self.ids))
+        self.positions = {id_: n for n, id_ in enumerate(self.ids)}
+        self.live_count = len(self.ids)
+        self.total_len = int(data["doc_len"].sum())
+        offsets, docs, tfs = data["offsets"], data["docs"].astype(np.uint32), data["tfs"].astype(np.uint32)
+        for i, term in enumerate(meta["terms"]):
+            start, end = offsets[i], offsets[i + 1]
+            self.postings[term] = (array("I", docs[start:end].tobytes()), array("I", tfs[start:end].tobytes()))
+
+    def add_documents(self, documents, ids):
+        """Index chunks under their vector-store IDs (re-adding an ID replaces it)."""
+        with self._lock:
+            self._add(documents, ids)
+
+    def _add(self, documents, ids):
+        self._delete(ids)
+        for doc, id_ in zip(documents, ids):
+            n = len(self.ids)
+            tokens = tokenize(doc.page_content)
+            counts = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                posting = self.postings.get(t)
+                if posting is None:
+                    posting = self.postings[t] = (array("I"), array("I"))
+                posting[0].append(n)
+                posting[1].append(tf)
+            self.ids.append(id_)
+            self.texts.append(doc.page_content)
+            self.metadatas.append(dict(doc.metadata))
+            self.doc_len.append(len(tokens))
+            self.alive.append(1)
+            self.positions[id_] = n
+            self.live_count += 1
+            self.total_len += len(tokens)
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+
+    def _delete(self, ids):
+        for id_ in ids:
+            n = self.positions.pop(id_, None)
+            if n is not None and self.alive[n]:
+                self.alive[n] = 0
+                self.live_count -= 1
+                self.total_len -= self.doc_len[n]
+
+    def search(self, query, k=5):
+        """Return up to k (chunk id, BM25 score) pairs, best first."""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self.live_count:
+                return []
+            alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+            doc_len = np.frombuffer(self.doc_len, dtype=np.uint32).astype(np.float32)
+            avg_len = self.total_len / self.live_count
+            scores = np.zeros(len(self.ids), dtype=np.float32)
+            for term in terms:
+                posting = self.postings.get(term)
+                if posting is None:
+                    continue
+                docs = np.frombuffer(posting[0], dtype=np.uint32)
+                tfs = np.frombuffer(posting[1], dtype=np.uint32).astype(np.float32)
+                live = alive[docs]
+                docs, tfs = docs[live], tfs[live]
+                if not len(docs):
+                    continue
+                idf = math.log(1 + (self.live_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * doc_len[docs] / avg_len)
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+            candidates = np.flatnonzero(scores > 0)
+            if not len(candidates):
+                return []
+            top = candidates[np.argsort(-scores[candidates], kind="stable")[:k]]
+            return [(self.ids[n], float(scores[n])) for n in top]
+
+    def get_document(self, id_):
+        with self._lock:
+            n = self.positions.get(id_)
+            if n is None:
+                return None
+            return Document(page_content=self.texts[n], metadata=dict(self.metadatas[n]))
+
+    def persist(self):
+        """Compact tombstones and write postings (npz) plus chunk texts (json) atomically."""
+        with self._lock:
+            if self.live_count < len(self.ids):
+                live = [n for n in range(len(self.ids)) if self.alive[n]]
+                docs = [Document(page_content=self.texts[n], metadata=self.metadatas[n]) for n in live]
+                ids = [self.ids[n] for n in live]
+                self._reset()
+                self._add(docs, ids)
+
+            terms = sorted(self.postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            for i, t in enumerate(terms):
+                offsets[i + 1] = offsets[i] + len(self.postings[t][0])
+            docs = np.concatenate([np.frombuffer(self.postings[t][0], dtype=np.uint32) for t in terms]) \
+                if terms else np.zeros(0, dtype=np.uint32)
+            tfs = np.concatenate([np.frombuffer(self.postings[t][1], dtype=np.uint32) for t in terms]) \
+                if terms else np.zeros(0, dtype=np.uint32)
+
+            os.makedirs(self.persist_directory, exist_ok=True)
+            tmp_postings = self._path(POSTINGS_FILE + ".tmp")
+            with open(tmp_postings, "wb") as f:
+                np.savez(f, offsets=offsets, docs=docs, tfs=tfs,
+                         doc_len=np.frombuffer(self.doc_len, dtype=np.uint32))
+            tmp_docs = self._path(DOCS_FILE + ".tmp")
+            with open(tmp_docs, "w", encoding="utf-8") as f:
+                json.dump({"terms": terms, "ids": self.ids, "texts": self.texts, "metadatas": self.metadatas}, f)
+            os.replace(tmp_postings, self._path(POSTINGS_FILE))
+            os.replace(tmp_docs, self._path(DOCS_FILE))
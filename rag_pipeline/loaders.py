@@ -1,19 +1,136 @@
 import os
+import pickle
+import shutil
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from langchain.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
+from rag_pipeline.splitter import iter_split_documents
+
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", min(4, os.cpu_count() or 1)))
+# Workers are started fresh ("spawn") or from a clean server process ("forkserver"),
+# never forked from the API process, whose other threads may hold locks
+LOADER_START_METHOD = os.getenv("LOADER_START_METHOD", "spawn")
+# Chunks per batch handed from a worker to the indexer, bounding memory for very large files
+SPLIT_BATCH_CHUNKS = int(os.getenv("SPLIT_BATCH_CHUNKS", 256))
+
+def _get_loader(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        return PyPDFLoader(path)
+    elif ext == ".docx":
+        return Docx2txtLoader(path)
+    elif ext == ".txt" or ext == ".md":
+        return TextLoader(path)
+    print(f" Skipping unsupported file: {path}")
+    return None
+
+def _load_file(path):
+    """Parse a single file into Documents (runs inside a worker process)."""
+    loader = _get_loader(path)
+    return loader.load() if loader is not None else []
+
+def _load_and_split_file(path, chunk_size, chunk_overlap, id_prefix, spill_dir):
+    """
+    Parse and split a single file inside a worker process. Pages are consumed
+    lazily and chunks are written to a spill file in spill_dir in batches of
+    SPLIT_BATCH_CHUNKS, so neither the worker nor the parent ever holds (or
+    pickles) all chunks of a file at once. Returns the spill file's path.
+    """
+    loader = _get_loader(path)
+    fd, spill_path = tempfile.mkstemp(suffix=".chunks", dir=spill_dir)
+    with os.fdopen(fd, "wb") as f:
+        if loader is not None:
+            batch = []
+            for chunk in iter_split_documents(loader.lazy_load(), chunk_size, chunk_overlap, id_prefix):
+                batch.append(chunk)
+                if len(batch) >= SPLIT_BATCH_CHUNKS:
+                    pickle.dump(batch, f)
+                    batch = []
+            if batch:
+                pickle.dump(batch, f)
+    return spill_path
+
+def _read_batches(spill_path):
+    """Yield the chunk batches of a spill file one at a time, then remove it."""
+    try:
+        with open(spill_path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+    finally:
+        try:
+            os.remove(spill_path)
+        except OSError:
+            pass
+
+def _iter_parallel(func, jobs, max_workers=None):
+    """
+    Run func(*job) across a process pool and yield (job, result) in input order
+    as soon as each result is ready. At most 2 * max_workers results are held
+    at once, so memory is bounded by the window rather than the whole corpus.
+    result is None if the job failed.
+    """
+    max_workers = max_workers or LOADER_WORKERS
+    if max_workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            try:
+                yield job, func(*job)
+            except Exception as e:
+                print(f" Failed to load {job[0]}: {e}")
+                yield job, None
+        return
+
+    context = multiprocessing.get_context(LOADER_START_METHOD)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        pending = deque()
+        remaining = iter(jobs)
+        for job in remaining:
+            pending.append((job, executor.submit(func, *job)))
+            if len(pending) >= 2 * max_workers:
+                break
+        while pending:
+            job, future = pending.popleft()
+            next_job = next(remaining, None)
+            if next_job is not None:
+                pending.append((next_job, executor.submit(func, *next_job)))
+            try:
+                yield job, future.result()
+            except Exception as e:
+                print(f" Failed to load {job[0]}: {e}")
+                yield job, None
+
+def iter_loaded_files(file_paths: list, max_workers: int = None):
+    """Parse files in parallel and yield (path, documents) in input order; documents is None on failure."""
+    for (path,), docs in _iter_parallel(_load_file, [(path,) for path in file_paths], max_workers):
+        yield path, docs
+
+def iter_split_files(file_paths: list, chunk_size=800, chunk_overlap=150, id_prefixes=None, max_workers: int = None):
+    """
+    Parse and split files in parallel and yield (path, batches) in input order.
+    batches iterates over the file's chunks in lists of at most
+    SPLIT_BATCH_CHUNKS and must be consumed before moving on to the next file;
+    it is None if the file failed to parse. id_prefixes (one per path) give
+    stable chunk IDs.
+    """
+    id_prefixes = id_prefixes or [None] * len(file_paths)
+    spill_dir = tempfile.mkdtemp(prefix="rag-chunks-")
+    try:
+        jobs = [(path, chunk_size, chunk_overlap, prefix, spill_dir) for path, prefix in zip(file_paths, id_prefixes)]
+        for job, spill_path in _iter_parallel(_load_and_split_file, jobs, max_workers):
+            yield job[0], _read_batches(spill_path) if spill_path is not None else None
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+def iter_documents(file_paths: list, max_workers: int = None):
+    """Yield Documents lazily, parsing files in parallel."""
+    for _, docs in iter_loaded_files(file_paths, max_workers):
+        if docs:
+            yield from docs
 
 def load_documents(file_paths: list):
     """Load PDFs, DOCX, TXT, MD into LangChain Document objects."""
-    documents = []
-    for path in file_paths:
-        ext = os.path.splitext(path)[1].lower()
-        if ext == ".pdf":
-            loader = PyPDFLoader(path)
-        elif ext == ".docx":
-            loader = Docx2txtLoader(path)
-        elif ext == ".txt" or ext == ".md":
-            loader = TextLoader(path)
-        else:
-            print(f" Skipping unsupported file: {path}")
-            continue
-        documents.extend(loader.load())
-    return documents
+    return list(iter_documents(file_paths))
@@ -0,0 +1,139 @@
+import os
+import json
+import hashlib
+
+MANIFEST_FILE = "index_manifest.json"
+
+
+def file_hash(path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IndexManifest:
+    """
+    Record of the files already embedded into a persist directory.
+    Entries are keyed by content hash + chunking parameters, so a byte-identical
+    re-upload is a no-op and a changed file only replaces its own vectors.
+    """
+
+    def __init__(self, persist_directory="vector_db", backend="chroma"):
+        self.path = os.path.join(persist_directory, MANIFEST_FILE)
+        self.backend = backend
+        self.entries = {}   # fingerprint -> {"hash", "chunk_size", "chunk_overlap", "sources", "ids"}
+        self.sources = {}   # normalized file path -> fingerprint
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("backend", "chroma") != self.backend:
+                    # Index was written by another vector backend: re-embed everything
+                    # (chunk IDs are stable, so switching back upserts instead of duplicating)
+                    return
+                self.entries = data.get("entries", {})
+                self.sources = data.get("sources", {})
+            except (OSError, json.JSONDecodeError):
+                print(f" Ignoring unreadable index manifest: {self.path}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"backend": self.backend, "entries": self.entries, "sources": self.sources}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def fingerprint(content_hash, chunk_size, chunk_overlap):
+        return f"{content_hash}:{chunk_size}:{chunk_overlap}"
+
+    @staticmethod
+    def normalize(path):
+        return os.path.normpath(os.path.abspath(path))
+
+    def plan(self, file_paths, chunk_size, chunk_overlap):
+        """
+        Compare file_paths against the manifest.
+        Returns (to_index, stale_ids): files whose content must be embedded as
+        [(path, fingerprint)], and vector IDs no longer referenced by any file.
+        The manifest is updated in memory; call save() once the store is written.
+        """
+        to_index = []
+        released = set()
+
+        for path in file_paths:
+            key = self.normalize(path)
+            fp = self.fingerprint(file_hash(path), chunk_size, chunk_overlap)
+            previous = self.sources.get(key)
+            if previous == fp:
+                continue
+
+            # File changed (or chunking changed): drop its claim on the old vectors
+            if previous is not None:
+                self._release(previous, key, released)
+
+            self.sources[key] = fp
+            entry = self.entries.get(fp)
+            if entry is not None:
+                # Byte-identical content is already embedded (or queued in this plan) under another name
+                if key not in entry["sources"]:
+                    entry["sources"].append(key)
+                released.discard(fp)
+                continue
+
+            content_hash, _, _ = fp.split(":")
+            self.entries[fp] = {
+                "hash": content_hash,
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "sources": [key],
+                "ids": [],
+            }
+            to_index.append((path, fp))
+
+        stale_ids = []
+        for fp in released:
+            entry = self.entries.get(fp)
+            if entry is not None and not entry["sources"]:
+                stale_ids.extend(entry["ids"])
+                del self.entries[fp]
+        return to_index, stale_ids
+
+    def _release(self, fp, key, released):
+        entry = self.entries.get(fp)
+        if entry is None:
+            return
+        if key in entry["sources"]:
+            entry["sources"].remove(key)
+        released.add(fp)
+
+    def record(self, fp, ids):
+        """Attach the vector IDs produced for an indexed fingerprint."""
+        self.entries[fp]["ids"] = list(ids)
+
+    def discard(self, fp):
+        """Forget a fingerprint whose indexing failed so it is retried next build."""
+        entry = self.entries.pop(fp, None)
+        if entry is None:
+            return
+        for key in entry["sources"]:
+            if self.sources.get(key) == fp:
+                del self.sources[key]
+
+
+def chunk_id_prefix(fp):
+    """Stable, content-derived prefix of the vector IDs of one file's chunks."""
+    content_hash, chunk_size, chunk_overlap = fp.split(":")
+    return f"{content_hash[:16]}-{chunk_size}-{chunk_overlap}"
+
+
+def chunk_ids(fp, count):
+    """Stable, content-derived vector IDs for the chunks of one file."""
+    prefix = chunk_id_prefix(fp)
+    return [f"{prefix}-{i}" for i in range(count)]
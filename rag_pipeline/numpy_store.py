@@ -0,0 +1,236 @@
+import os
+import json
+import uuid
+import threading
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.vectorstores.base import VectorStore
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu is optional; exact search is always available
+    faiss = None
+
+VECTORS_FILE = "vectors.npy"
+METADATA_FILE = "vectors_meta.json"
+IVF_FILE = "vectors_ivf.faiss"
+
+NUMPY_STORE_DTYPE = os.getenv("NUMPY_STORE_DTYPE", "float32")  # float32 | float16
+IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", 20000))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+SCORE_BLOCK_ROWS = int(os.getenv("SCORE_BLOCK_ROWS", 65536))  # stored rows converted to float32 at a time
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector index: L2-normalized vectors in a memory-mapped .npy matrix,
+    ids/texts/metadata in a JSON sidecar, exact top-k by one matrix product.
+    With index_type="ivf" (and faiss installed) an IVF index is built at
+    persist() time once the corpus reaches IVF_MIN_VECTORS.
+    Scores are cosine similarities (higher is better).
+    """
+
+    def __init__(self, embedding_function, persist_directory="vector_db",
+                 dtype=NUMPY_STORE_DTYPE, index_type="exact"):
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.dtype = np.dtype(dtype)
+        self.index_type = index_type
+        if index_type == "ivf" and faiss is None:
+            print(" faiss is not installed, falling back to exact search")
+            self.index_type = "exact"
+
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._pending = []  # rows added since the matrix was last stacked
+        self._ids, self._texts, self._metadatas = [], [], []
+        self._ivf = None
+        self._closed = False
+        self._load()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def _path(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    def _load(self):
+        if not os.path.exists(self._path(METADATA_FILE)):
+            return
+        with open(self._path(METADATA_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self._ids, self._texts, self._metadatas = meta["ids"], meta["texts"], meta["metadatas"]
+        self._map()
+
+    def _map(self):
+        if self._ids:
+            # Read-only mapping: pages are shared between worker processes via the page cache
+            self._vectors = np.load(self._path(VECTORS_FILE), mmap_mode="r")
+        if self.index_type == "ivf" and os.path.exists(self._path(IVF_FILE)):
+            self._ivf = faiss.read_index(self._path(IVF_FILE))
+        self._closed = False
+
+    def close(self):
+        """
+        Release the memory-mapped matrix and the IVF index. Both are mapped
+        again on the next use, so a reader still holding the store keeps working.
+        Rows that are not persisted yet are kept.
+        """
+        with self._lock:
+            if self._pending or not isinstance(self._vectors, np.memmap):
+                return
+            self._vectors, self._ivf, self._closed = None, None, True
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+
+        vectors = np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.maximum(norms, 1e-12)).astype(self.dtype)
+
+        with self._lock:
+            # Upsert: re-adding an existing ID replaces it instead of duplicating it
+            self._remove(set(ids))
+            # Stacked once on the next search or persist(), not on every batch
+            self._pending = self._pending + [vectors]
+            self._ids = self._ids + ids
+            self._texts = self._texts + texts
+            self._metadatas = self._metadatas + metadatas
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return
+        with self._lock:
+            self._remove(set(ids))
+
+    def _stacked(self):
+        """The full matrix, stacking rows added since the last call (caller holds _lock)."""
+        if self._closed:
+            self._map()
+        if self._pending:
+            blocks = self._pending if self._vectors is None else [self._vectors] + self._pending
+            self._vectors = np.vstack(blocks) if len(blocks) > 1 else blocks[0]
+            self._pending = []
+        return self._vectors
+
+    def _remove(self, ids):
+        if not ids.intersection(self._ids):
+            return
+        self._stacked()
+        keep = [i for i, id_ in enumerate(self._ids) if id_ not in ids]
+        self._vectors = np.asarray(self._vectors[keep]) if keep else None
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        self._ivf = None
+
+    def persist(self):
+        """Atomically write the matrix and sidecar, then re-map the matrix read-only."""
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with self._lock:
+            vectors = self._stacked()
+            vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=self.dtype)
+            tmp_vectors = self._path(VECTORS_FILE + ".tmp")
+            with open(tmp_vectors, "wb") as f:
+                np.save(f, np.ascontiguousarray(vectors, dtype=self.dtype))
+            tmp_meta = self._path(METADATA_FILE + ".tmp")
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump({"ids": self._ids, "texts": self._texts, "metadatas": self._metadatas}, f)
+            os.replace(tmp_vectors, self._path(VECTORS_FILE))
+            os.replace(tmp_meta, self._path(METADATA_FILE))
+            if self._ids:
+                self._vectors = np.load(self._path(VECTORS_FILE), mmap_mode="r")
+            self._build_ivf()
+
+    def _build_ivf(self):
+        if self.index_type != "ivf":
+            return
+        n = len(self._ids)
+        if n < IVF_MIN_VECTORS:
+            self._ivf = None
+            if os.path.exists(self._path(IVF_FILE)):
+                os.remove(self._path(IVF_FILE))
+            return
+        data = np.ascontiguousarray(self._vectors, dtype=np.float32)
+        dim = data.shape[1]
+        nlist = max(1, int(4 * np.sqrt(n)))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(data)
+        index.add(data)
+        faiss.write_index(index, self._path(IVF_FILE))
+        self._ivf = index
+
+    def _search(self, query_vectors, k):
+        """Return per-query lists of (Document, score) for a 2-D float32 query matrix."""
+        with self._lock:
+            # Snapshot: writers replace these objects rather than mutating them in place
+            vectors, ivf, texts, metadatas = self._stacked(), self._ivf, self._texts, self._metadatas
+        if vectors is None or k <= 0:
+            return [[] for _ in range(len(query_vectors))]
+        norms = np.linalg.norm(query_vectors, axis=1, keepdims=True)
+        queries = (query_vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+        k = min(k, len(vectors))
+
+        if ivf is not None and ivf.ntotal == len(vectors):
+            ivf.nprobe = IVF_NPROBE
+            scores, rows = ivf.search(queries, k)
+            return [
+                [(Document(page_content=texts[r], metadata=dict(metadatas[r])), float(s)) for r, s in zip(rr, ss) if r >= 0]
+                for rr, ss in zip(rows, scores)
+            ]
+
+        # Score block by block so a float16 (memory-mapped) matrix is never copied to float32 whole
+        scores = np.empty((len(queries), len(vectors)), dtype=np.float32)
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for q, candidates in enumerate(top):
+            ordered = candidates[np.argsort(-scores[q, candidates])]
+            results.append([
+                (Document(page_content=texts[r], metadata=dict(metadatas[r])), float(scores[q, r])) for r in ordered
+            ])
+        return results
+
+    def get(self):
+        """Return all chunks in the same shape as Chroma.get()."""
+        with self._lock:
+            return {"ids": list(self._ids), "documents": list(self._texts), "metadatas": list(self._metadatas)}
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        return self._search(np.asarray([embedding], dtype=np.float32), k)[0]
+
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        """Batched search: score all query vectors against the index in one matrix product."""
+        return [[doc for doc, _ in hits] for hits in self._search(np.asarray(embeddings, dtype=np.float32), k)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None,
+                   persist_directory="vector_db", **kwargs):
+        store = cls(embedding, persist_directory=persist_directory, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        store.persist()
+        return store
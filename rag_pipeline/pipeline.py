@@ -1,27 +1,147 @@
-from rag_pipeline.loaders import load_documents
-from rag_pipeline.splitter import split_documents
-from rag_pipeline.embeddings import get_embeddings
-from rag_pipeline.vector_store import build_vectorstore, load_vectorstore
-from rag_pipeline.retriever import get_retriever, retrieve_with_citations
+from rag_pipeline.loaders import iter_split_files
+from rag_pipeline.manifest import IndexManifest, chunk_id_prefix
+from rag_pipeline.vector_store import (
+    add_to_vectorstore, delete_from_vectorstore, batch_similarity_search, VECTOR_BACKEND
+)
+from rag_pipeline import registry
+from rag_pipeline.retriever import get_retriever, hybrid_search, to_citations
+from rag_pipeline.query_cache import query_cache, normalize_query
+import os
+import threading
+
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")  # hybrid | dense
 
 class RAGPipeline:
-    def __init__(self, persist_directory="vector_db"):
+    def __init__(self, persist_directory="vector_db", chunk_size=800, chunk_overlap=150, backend=None,
+                 search_mode=SEARCH_MODE):
         self.persist_directory = persist_directory
-        self.embeddings = get_embeddings()
+        self.backend = backend or VECTOR_BACKEND
+        self.search_mode = search_mode
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embeddings = registry.get_shared_embeddings()
         self.vectorstore = None
         self.retriever = None
+        self.lexical = None
+        self.version = None
+        self._refresh_lock = threading.Lock()  # pipelines are shared by concurrent agent workers
 
     def build(self, file_paths):
-        docs = load_documents(file_paths)
-        split_docs = split_documents(docs)
-        self.vectorstore = build_vectorstore(split_docs, self.embeddings, self.persist_directory)
+        """
+        Incrementally index file_paths: only new or changed files are loaded,
+        split and embedded; vectors of changed files are replaced in place.
+        """
+        with registry.build_lock(self.persist_directory):
+            manifest = IndexManifest(self.persist_directory, self.backend.split("-")[0])
+            to_index, stale_ids = manifest.plan(file_paths, self.chunk_size, self.chunk_overlap)
+
+            self.vectorstore, self.version = registry.get_vectorstore(self.persist_directory, self.backend)
+            self.lexical = registry.get_lexical_index(self.persist_directory, self.backend)
+
+            fingerprints = dict(to_index)
+            # Files are parsed and split in a process pool; each one is embedded
+            # batch by batch as it arrives while later files are still being parsed.
+            paths = [path for path, _ in to_index]
+            prefixes = [chunk_id_prefix(fp) for _, fp in to_index]
+            for path, batches in iter_split_files(paths, self.chunk_size, self.chunk_overlap, prefixes):
+                fp = fingerprints[path]
+                if batches is None:
+                    manifest.discard(fp)
+                    continue
+                try:
+                    ids = []
+                    for split_docs in batches:
+                        batch_ids = [doc.metadata["chunk_id"] for doc in split_docs]
+                        add_to_vectorstore(self.vectorstore, split_docs, batch_ids)
+                        self.lexical.add_documents(split_docs, batch_ids)
+                        ids.extend(batch_ids)
+                    manifest.record(fp, ids)
+                except Exception as e:
+                    print(f" Indexing failed for {path}: {e}")
+                    manifest.discard(fp)
+
+            delete_from_vectorstore(self.vectorstore, stale_ids)
+            self.lexical.delete(stale_ids)
+            if to_index or stale_ids:
+                self.vectorstore.persist()
+                self.lexical.persist()
+            manifest.save()
+            self.version = registry.mark_updated(self.persist_directory, self.backend)
+
+        print(f" Indexed {len(to_index)} new/changed file(s), "
+              f"skipped {len(file_paths) - len(to_index)}, removed {len(stale_ids)} stale chunk(s)")
         self.retriever = get_retriever(self.vectorstore)
         return self
 
     def load(self):
-        self.vectorstore = load_vectorstore(self.embeddings, self.persist_directory)
+        self.vectorstore, self.version = registry.get_vectorstore(self.persist_directory, self.backend)
+        self.lexical = registry.get_lexical_index(self.persist_directory, self.backend)
         self.retriever = get_retriever(self.vectorstore)
         return self
 
+    def refresh(self):
+        """Rebuild the retriever if the shared index changed since it was created."""
+        vectorstore, version = registry.get_vectorstore(self.persist_directory, self.backend)
+        with self._refresh_lock:
+            if self.retriever is None or version != self.version:
+                self.vectorstore, self.version = vectorstore, version
+                self.lexical = registry.get_lexical_index(self.persist_directory, self.backend)
+                self.retriever = get_retriever(self.vectorstore)
+        return self
+
+    def _cache_key(self, question, k):
+        return (registry.index_key(self.persist_directory, self.backend), self.version,
+                self.search_mode, k, normalize_query(question))
+
+    def get_relevant_documents(self, question, k=5):
+        """Top-k chunks for question: BM25 + dense fused by RRF, or dense only."""
+        self.refresh()
+        key = self._cache_key(question, k)
+        results = query_cache.get(key)
+        if results is None:
+            if self.search_mode == "hybrid":
+                results = hybrid_search(self.vectorstore, self.lexical, question, k=k)
+            else:
+                results = self.vectorstore.similarity_search(question, k=k)
+            query_cache.put(key, results)
+        return list(results)
+
+    def get_relevant_documents_batch(self, questions, k=5, fetch_k=20):
+        """
+        Top-k chunks for several questions at once: cached questions are served
+        from the query cache, the rest are embedded in one model call and scored
+        against the index in one batched search.
+        """
+        self.refresh()
+        results = [query_cache.get(self._cache_key(q, k)) for q in questions]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            unique = list(dict.fromkeys(questions[i] for i in missing))
+            # Queries are looked up in the chunk-embedding cache but not added to it
+            embed = getattr(self.embeddings, "embed_queries", self.embeddings.embed_documents)
+            vectors = embed(unique)
+            n_dense = fetch_k if self.search_mode == "hybrid" else k
+            dense = dict(zip(unique, batch_similarity_search(self.vectorstore, vectors, k=n_dense)))
+            for i in missing:
+                question = questions[i]
+                if self.search_mode == "hybrid":
+                    docs = hybrid_search(self.vectorstore, self.lexical, question, k=k, dense=dense[question])
+                else:
+                    docs = dense[question][:k]
+                query_cache.put(self._cache_key(question, k), docs)
+                results[i] = docs
+        return [list(r) for r in results]
+
     def query(self, question, k=5):
-        return retrieve_with_citations(self.retriever, question)
+        return to_citations(self.get_relevant_documents(question, k=k))
+
+    def query_batch(self, questions, k=5):
+        """Per-question citation lists (source, chunk ID, offsets) for a batch of questions."""
+        return [to_citations(docs) for docs in self.get_relevant_documents_batch(questions, k=k)]
+
+    def cache_stats(self):
+        """Hit/miss counters of the shared query-result and embedding caches."""
+        stats = {"query_cache": query_cache.stats()}
+        if hasattr(self.embeddings, "stats"):
+            stats["embedding_cache"] = self.embeddings.stats()
+        return stats
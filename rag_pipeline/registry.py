@@ -0,0 +1,230 @@
+import os
+import re
+import time
+import itertools
+import threading
+from collections import OrderedDict
+from rag_pipeline.embeddings import get_embeddings
+from rag_pipeline.manifest import MANIFEST_FILE
+from rag_pipeline.lexical_index import BM25Index
+from rag_pipeline.vector_store import load_vectorstore, all_documents, VECTOR_BACKEND
+
+# Process-wide registry: the embedding model is loaded once and each persist
+# directory is opened once, then shared by every RAGPipeline in the process.
+# Open indexes are kept in an LRU bounded by count, estimated size and idle time.
+VECTOR_DB_ROOT = os.getenv("VECTOR_DB_ROOT", "vector_db")
+DEFAULT_COLLECTION = "default"
+MAX_OPEN_COLLECTIONS = int(os.getenv("MAX_OPEN_COLLECTIONS", 32))
+MAX_OPEN_COLLECTIONS_MB = float(os.getenv("MAX_OPEN_COLLECTIONS_MB", 2048))
+COLLECTION_IDLE_SECONDS = float(os.getenv("COLLECTION_IDLE_SECONDS", 1800))
+# How often a background sweep closes idle indexes, even when no index is requested
+COLLECTION_SWEEP_SECONDS = float(os.getenv("COLLECTION_SWEEP_SECONDS", 60))
+COLLECTION_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+_lock = threading.RLock()
+_embeddings = None
+_stores = OrderedDict()  # (persist_directory, backend) -> {"vectorstore", "lexical", "mtime", "version", "size", "last_used"}
+_build_locks = {}
+_open_locks = {}  # (persist_directory, backend) -> lock held while that index is being opened
+_embeddings_lock = threading.Lock()
+_versions = itertools.count()  # process-wide, so a reopened index never reuses an old version
+_sweeper = None
+
+
+def _key(persist_directory, backend=None):
+    return os.path.normpath(os.path.abspath(persist_directory)), backend or VECTOR_BACKEND
+
+
+def index_key(persist_directory="vector_db", backend=None):
+    """Stable identity of an index (directory + backend), e.g. for cache keys."""
+    return _key(persist_directory, backend)
+
+
+def collection_directory(name=DEFAULT_COLLECTION):
+    """
+    Persist directory of a named collection (per user, team or project).
+    The default collection lives directly in VECTOR_DB_ROOT, so existing
+    indexes keep working; others are isolated under VECTOR_DB_ROOT/collections/.
+    """
+    name = name or DEFAULT_COLLECTION
+    if not COLLECTION_NAME_RE.match(name) or ".." in name:
+        raise ValueError(f" Invalid collection name '{name}'. Use letters, digits, '_', '-' or '.' (max 64).")
+    if name == DEFAULT_COLLECTION:
+        return VECTOR_DB_ROOT
+    return os.path.join(VECTOR_DB_ROOT, "collections", name)
+
+
+def _disk_size(persist_directory):
+    """On-disk size of an index, used as the memory estimate of its open handle."""
+    total = 0
+    for root, dirs, files in os.walk(persist_directory):
+        if root == persist_directory:
+            dirs[:] = [d for d in dirs if d != "collections"]  # other tenants under the default root
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _release(entry):
+    """Free what an index holds open (memory maps, clients); stores without close() are just dropped."""
+    for handle in (entry["vectorstore"], entry["lexical"]):
+        close = getattr(handle, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                print(f" Failed to close {type(handle).__name__}: {e}")
+
+
+def _evict(keep_key=None):
+    """Close idle and least recently used indexes beyond the count and size limits (caller holds _lock)."""
+    now = time.monotonic()
+    max_bytes = MAX_OPEN_COLLECTIONS_MB * 1024 * 1024
+    for key in list(_stores):
+        lock = _build_locks.get(key[0])
+        if key == keep_key or (lock is not None and lock.locked()):
+            continue
+        entry = _stores[key]
+        over_count = len(_stores) > MAX_OPEN_COLLECTIONS
+        over_size = sum(e["size"] for e in _stores.values()) > max_bytes
+        idle = now - entry["last_used"] > COLLECTION_IDLE_SECONDS
+        if over_count or over_size or idle:
+            print(f" Closing vector index {key[0]} ({key[1]})")
+            _release(_stores.pop(key))
+
+
+def _sweep_forever():
+    while True:
+        time.sleep(COLLECTION_SWEEP_SECONDS)
+        with _lock:
+            _evict()
+
+
+def _start_sweeper():
+    """Start the idle sweep once, with the first opened index (caller holds _lock)."""
+    global _sweeper
+    if _sweeper is None and COLLECTION_SWEEP_SECONDS > 0:
+        _sweeper = threading.Thread(target=_sweep_forever, name="vector-index-sweeper", daemon=True)
+        _sweeper.start()
+
+
+def _manifest_mtime(persist_directory):
+    try:
+        return os.path.getmtime(os.path.join(persist_directory, MANIFEST_FILE))
+    except OSError:
+        return None
+
+
+def get_shared_embeddings():
+    """Return the process-wide embedding model, loading it on first use."""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                _embeddings = get_embeddings()
+    return _embeddings
+
+
+def _open_lexical(persist_directory, vectorstore):
+    lexical = BM25Index(persist_directory)
+    if not lexical.exists():
+        # Index predates the lexical index: backfill it once from the vector store
+        ids, docs = all_documents(vectorstore)
+        if ids:
+            print(f" Backfilling lexical index for {persist_directory} ({len(ids)} chunks)")
+            lexical.add_documents(docs, ids)
+            lexical.persist()
+    return lexical
+
+
+def _use(key, entry):
+    """Mark an entry most recently used (caller holds _lock)."""
+    entry["last_used"] = time.monotonic()
+    _stores.move_to_end(key)
+    return entry
+
+
+def _entry(persist_directory, backend):
+    key = _key(persist_directory, backend)
+    mtime = _manifest_mtime(persist_directory)
+    with _lock:
+        entry = _stores.get(key)
+        if entry is not None and entry["mtime"] == mtime:
+            _use(key, entry)
+            _evict(key)
+            return entry
+        open_lock = _open_locks.setdefault(key, threading.Lock())
+
+    # Opening a store (and backfilling its BM25 index) can take a while: do it
+    # outside the process-wide lock so requests on other indexes are not held
+    # up, and under a per-index lock so concurrent readers open it only once
+    with open_lock:
+        with _lock:
+            entry = _stores.get(key)
+            if entry is not None and entry["mtime"] == mtime:
+                return _use(key, entry)
+        vectorstore = load_vectorstore(get_shared_embeddings(), persist_directory, key[1])
+        entry = {
+            "vectorstore": vectorstore,
+            "lexical": _open_lexical(persist_directory, vectorstore),
+            "mtime": mtime,
+            "size": _disk_size(persist_directory),
+        }
+        with _lock:
+            entry["version"] = next(_versions)
+            replaced = _stores.get(key)
+            _stores[key] = entry
+            if replaced is not None:
+                _release(replaced)
+            _use(key, entry)
+            _evict(key)
+            _start_sweeper()
+            return entry
+
+
+def get_vectorstore(persist_directory="vector_db", backend=None):
+    """
+    Return (vectorstore, version) for persist_directory, opening it once.
+    If another process rewrote the index (manifest mtime changed), the store
+    is reopened and the version bumped so readers rebuild their retrievers.
+    """
+    entry = _entry(persist_directory, backend)
+    return entry["vectorstore"], entry["version"]
+
+
+def get_lexical_index(persist_directory="vector_db", backend=None):
+    """Return the BM25 index kept alongside the vector store of persist_directory."""
+    return _entry(persist_directory, backend)["lexical"]
+
+
+def build_lock(persist_directory="vector_db"):
+    """Lock serializing index writes (and manifest updates) for one directory."""
+    key = _key(persist_directory)[0]
+    with _lock:
+        return _build_locks.setdefault(key, threading.Lock())
+
+
+def mark_updated(persist_directory="vector_db", backend=None):
+    """Record an in-process index write so readers refresh without reopening the store."""
+    key = _key(persist_directory, backend)
+    with _lock:
+        entry = _stores.get(key)
+        if entry is not None:
+            entry["mtime"] = _manifest_mtime(persist_directory)
+            entry["size"] = _disk_size(persist_directory)
+            entry["version"] = next(_versions)
+            return entry["version"]
+    # Closed while it was being written: the next access reopens it under a new version
+    return next(_versions)
+
+
+def open_indexes():
+    """Summary of the currently open indexes, most recently used last."""
+    with _lock:
+        return [
+            {"persist_directory": key[0], "backend": key[1], "size_bytes": e["size"], "version": e["version"]}
+            for key, e in _stores.items()
+        ]
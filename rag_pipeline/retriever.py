@@ -1,12 +1,45 @@
 def get_retriever(vectorstore, k=5):
     """Return retriever with top-k relevant chunks."""
-    return vectorstore.as_retriever(search_type="similarity", k=k)
+    return vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": k})
+
+def _doc_key(doc):
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+def reciprocal_rank_fusion(ranked_lists, k=5, rrf_k=60):
+    """
+    Fuse several best-first Document lists: score(d) = sum(1 / (rrf_k + rank)).
+    Documents are matched across lists by chunk_id (falling back to their text).
+    """
+    scores, docs = {}, {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+def hybrid_search(vectorstore, lexical_index, query, k=5, fetch_k=20, dense=None):
+    """Dense similarity + BM25 lexical search, fused by reciprocal rank."""
+    if dense is None:
+        dense = vectorstore.similarity_search(query, k=fetch_k)
+    if lexical_index is None or not len(lexical_index):
+        return dense[:k]
+    lexical = [lexical_index.get_document(id_) for id_, _ in lexical_index.search(query, fetch_k)]
+    return reciprocal_rank_fusion([dense, [d for d in lexical if d is not None]], k=k)
+
+def to_citations(docs):
+    """Citation dicts with source plus, when recorded at split time, chunk ID and character offsets."""
+    citations = []
+    for doc in docs:
+        citation = {"content": doc.page_content, "source": doc.metadata.get("source", "Unknown")}
+        for field in ("page", "chunk_id", "start_index", "end_index"):
+            if field in doc.metadata:
+                citation[field] = doc.metadata[field]
+        citations.append(citation)
+    return citations
 
 def retrieve_with_citations(retriever, query):
     """Retrieve chunks with sources for citation tracking."""
     results = retriever.get_relevant_documents(query)
-    citations = [
-        {"content": doc.page_content, "source": doc.metadata.get("source", "Unknown")}
-        for doc in results
-    ]
-    return citations
+    return to_citations(results)
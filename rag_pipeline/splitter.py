@@ -1,9 +1,56 @@
+from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-def split_documents(docs, chunk_size=800, chunk_overlap=150):
-    """Split docs into overlapping chunks for better embeddings."""
+# Very long texts are split window by window so no single split_text call
+# (and no intermediate chunk list) grows with the size of the file.
+WINDOW_CHUNKS = 64
+
+def _iter_chunks(splitter, text, chunk_size, chunk_overlap):
+    """Yield (start offset, chunk text) over text, one bounded window at a time."""
+    window = chunk_size * WINDOW_CHUNKS
+    pos = 0
+    while pos < len(text):
+        end = min(len(text), pos + window)
+        segment = text[pos:end]
+        chunks = splitter.split_text(segment)
+        last_window = end >= len(text) or len(chunks) <= 1
+
+        index, prev_len = 0, 0
+        for i, chunk in enumerate(chunks):
+            offset = index + prev_len - chunk_overlap
+            found = segment.find(chunk, max(0, offset))
+            index = found if found >= 0 else max(0, offset)
+            prev_len = len(chunk)
+            if not last_window and i == len(chunks) - 1:
+                # The final chunk may be cut by the window edge: restart the next window there
+                break
+            yield pos + index, chunk
+
+        if last_window:
+            break
+        pos += max(index, 1)
+
+def iter_split_documents(docs, chunk_size=800, chunk_overlap=150, id_prefix=None):
+    """
+    Lazily split an iterable of Documents into overlapping chunks.
+    Each chunk keeps its parent's metadata (source, page) plus start_index /
+    end_index character offsets within that page or document, a per-file
+    chunk_index, and - when id_prefix is given - a stable chunk_id.
+    """
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
     )
-    return splitter.split_documents(docs)
+    ordinal = 0
+    for doc in docs:
+        for start, chunk in _iter_chunks(splitter, doc.page_content, chunk_size, chunk_overlap):
+            metadata = dict(doc.metadata)
+            metadata.update({"start_index": start, "end_index": start + len(chunk), "chunk_index": ordinal})
+            if id_prefix is not None:
+                metadata["chunk_id"] = f"{id_prefix}-{ordinal}"
+            ordinal += 1
+            yield Document(page_content=chunk, metadata=metadata)
+
+def split_documents(docs, chunk_size=800, chunk_overlap=150):
+    """Split docs into overlapping chunks for better embeddings."""
+    return list(iter_split_documents(docs, chunk_size, chunk_overlap))
@@ -1,20 +1,80 @@
 from langchain.vectorstores import Chroma
+from langchain.docstore.document import Document
+from rag_pipeline.numpy_store import NumpyVectorStore
 import os
 
-def build_vectorstore(split_docs, embeddings, persist_directory="vector_db"):
-    """Build or update Chroma vector store."""
+# "chroma" (default), "numpy" (memory-mapped exact search) or "numpy-ivf" (FAISS IVF for large corpora)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+BACKENDS = ("chroma", "numpy", "numpy-ivf")
+
+def _check_backend(backend):
+    backend = backend or VECTOR_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f" Unknown vector backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+    return backend
+
+def build_vectorstore(split_docs, embeddings, persist_directory="vector_db", ids=None, backend=None):
+    """Build or update a vector store with the selected backend."""
+    backend = _check_backend(backend)
     os.makedirs(persist_directory, exist_ok=True)
-    vectorstore = Chroma.from_documents(
-        documents=split_docs,
-        embedding=embeddings,
-        persist_directory=persist_directory
-    )
+    if backend == "chroma":
+        vectorstore = Chroma.from_documents(
+            documents=split_docs,
+            embedding=embeddings,
+            persist_directory=persist_directory,
+            ids=ids
+        )
+    else:
+        vectorstore = load_vectorstore(embeddings, persist_directory, backend)
+        add_to_vectorstore(vectorstore, split_docs, ids)
     vectorstore.persist()
     return vectorstore
 
-def load_vectorstore(embeddings, persist_directory="vector_db"):
-    """Load an existing Chroma vector store."""
-    return Chroma(
-        embedding_function=embeddings,
-        persist_directory=persist_directory
+def load_vectorstore(embeddings, persist_directory="vector_db", backend=None):
+    """Load an existing vector store with the selected backend."""
+    backend = _check_backend(backend)
+    if backend == "chroma":
+        return Chroma(
+            embedding_function=embeddings,
+            persist_directory=persist_directory
+        )
+    return NumpyVectorStore(
+        embeddings,
+        persist_directory=persist_directory,
+        index_type="ivf" if backend == "numpy-ivf" else "exact"
     )
+
+def add_to_vectorstore(vectorstore, split_docs, ids):
+    """Upsert chunks under stable IDs so re-adding the same chunk never duplicates it."""
+    if split_docs:
+        vectorstore.add_documents(split_docs, ids=ids)
+
+def delete_from_vectorstore(vectorstore, ids):
+    """Remove vectors by ID (used when a file's content changes)."""
+    if ids:
+        vectorstore.delete(ids=ids)
+
+def all_documents(vectorstore):
+    """Return (ids, Documents) for every chunk in the store (used to backfill other indexes)."""
+    data = vectorstore.get()
+    docs = [
+        Document(page_content=text, metadata=meta or {})
+        for text, meta in zip(data["documents"], data["metadatas"])
+    ]
+    return data["ids"], docs
+
+def batch_similarity_search(vectorstore, query_embeddings, k=5):
+    """Top-k Documents for each of several pre-computed query embeddings, in one index call."""
+    if not query_embeddings:
+        return []
+    if isinstance(vectorstore, NumpyVectorStore):
+        return vectorstore.similarity_search_by_vectors(query_embeddings, k=k)
+    if isinstance(vectorstore, Chroma):
+        result = vectorstore._collection.query(
+            query_embeddings=query_embeddings, n_results=k, include=["documents", "metadatas"]
+        )
+        return [
+            [Document(page_content=text, metadata=meta or {}) for text, meta in zip(texts, metas)]
+            for texts, metas in zip(result["documents"], result["metadatas"])
+        ]
+    return [vectorstore.similarity_search_by_vector(e, k=k) for e in query_embeddings]
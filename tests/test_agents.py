@@ -1,7 +1,14 @@
+import json
+import time
+import threading
+import pytest
+from langchain_core.messages import AIMessage
 from agents.outline_generator_agent import OutlineGeneratorAgent
 from agents.content_expansion_agent import ContentExpansionAgent
 from agents.qa_agent import QAAgent
 from agents.format_optimizer_agent import FormatOptimizerAgent
+from utils import llm_retry
+from utils.llm_provider import FakeChatModel
 
 def test_outline_generator():
     agent = OutlineGeneratorAgent()
@@ -26,3 +33,516 @@ def test_format_optimizer():
     slides = [{"title": "AI", "content": [{"statement": "AI"}]}]
     formatted = agent.optimize_format(slides)
     assert "design_hint" in formatted[0]["content"][0]
+
+class ScriptedLLM:
+    """
+    Stand-in chat model for tests: answers each prompt with respond(prompt)
+    (a dict is sent as JSON) after `delay` seconds, recording the prompts and
+    the peak number of concurrent calls.
+    """
+
+    def __init__(self, respond, delay=0):
+        self.respond = respond
+        self.delay = delay
+        self.prompts = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt, **kwargs):
+        with self._lock:
+            self.prompts.append(prompt)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.delay)
+            payload = self.respond(prompt)
+            return AIMessage(content=payload if isinstance(payload, str) else json.dumps(payload))
+        finally:
+            with self._lock:
+                self.active -= 1
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """ScriptedLLM factory, with a fresh circuit breaker so earlier failures do not leak in."""
+    monkeypatch.setattr(llm_retry, "breaker", llm_retry.CircuitBreaker())
+    return ScriptedLLM
+
+def expansion_reply(prompt, fail_titles=()):
+    """A schema-valid expansion of the slide in an expansion prompt."""
+    title = prompt.split('"title": "')[1].split('"')[0]
+    if title in fail_titles:
+        raise TimeoutError("simulated provider timeout")
+    return {"title": title, "detailed_points": [f"{title} expanded"]}
+
+def qa_reply(prompt):
+    """Every statement of a direct-mode QA prompt marked accurate."""
+    slides = json.loads(prompt.split("Slides to validate:")[1])["slides"]
+    return {"slides": [{"title": s["title"], "validation": [
+        {"point": st["point"], "status": "accurate", "reason": ""} for st in s["statements"]
+    ]} for s in slides]}
+
+def test_content_expansion_concurrent_keeps_order_and_fallback(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_retry, "LLM_MAX_RETRIES", 0)
+    llm = fake_llm(lambda prompt: expansion_reply(prompt, fail_titles={"Slide 3"}), delay=0.05)
+    agent = ContentExpansionAgent(llm=llm, max_concurrency=4)
+    outline = {"slides": [{"title": f"Slide {i}", "bullet_points": ["point"]} for i in range(8)]}
+
+    expanded = agent.expand_outline(outline)
+
+    assert [s["title"] for s in expanded["slides"]] == [f"Slide {i}" for i in range(8)]
+    assert expanded["slides"][3]["detailed_points"] == [" Expansion failed, please retry."]
+    assert expanded["slides"][0]["detailed_points"] == ["Slide 0 expanded"]
+    assert 1 < llm.peak <= 4
+
+def test_streaming_orchestration_assembles_slides_in_order():
+    from agents.orchestration import PresentationOrchestrator
+
+    class SlowByIndex:
+        """Fake stage agent: earlier slides are slower, so completion order is reversed."""
+        max_concurrency = 4
+        batch_size = 3
+
+        def expand_slide(self, slide, context_docs=None):
+            time.sleep(0.01 * (10 - int(slide["title"].split()[-1])))
+            return {"title": slide["title"], "detailed_points": slide["bullet_points"]}
+
+        def validate_slide(self, slide):
+            return {"title": slide["title"],
+                    "validation": [{"point": p, "status": "accurate"} for p in slide["detailed_points"]]}
+
+        def validate_batch(self, slides, contexts=None):
+            return [self.validate_slide(slide) for slide in slides]
+
+    class FakeFormatter:
+        def format_batch(self, expanded, validated):
+            return [{"title": s["title"], "content": [{"statement": s["detailed_points"][0], "status": "accurate",
+                                                     "design_hint": ""}]} for s in expanded]
+
+        summarize = staticmethod(FormatOptimizerAgent.summarize)
+
+    orchestrator = PresentationOrchestrator.__new__(PresentationOrchestrator)
+    orchestrator.expansion_agent = orchestrator.qa_agent = SlowByIndex()
+    orchestrator.format_optimizer = FakeFormatter()
+    outline = {"slides": [{"title": f"Slide {i}", "bullet_points": [f"p{i}"]} for i in range(10)]}
+
+    result = orchestrator._run_streaming(outline, queue_size=2, batch_size=3)
+
+    assert [s["title"] for s in result["slides"]] == [f"Slide {i}" for i in range(10)]
+    assert result["summary"].startswith("10 statements accurate")
+
+def test_streaming_orchestration_surfaces_worker_errors_instead_of_hanging():
+    from agents.orchestration import PresentationOrchestrator
+
+    class Stages:
+        max_concurrency = 2
+        batch_size = 2
+
+        def expand_slide(self, slide, context_docs=None):
+            return {"title": slide["title"], "detailed_points": slide["bullet_points"]}
+
+        def validate_batch(self, slides, contexts=None):
+            return ["looks fine" for _ in slides]
+
+    class BrokenFormatter:
+        def format_batch(self, expanded, validated):
+            raise AttributeError("'str' object has no attribute 'get'")
+
+    orchestrator = PresentationOrchestrator.__new__(PresentationOrchestrator)
+    orchestrator.expansion_agent = orchestrator.qa_agent = Stages()
+    orchestrator.format_optimizer = BrokenFormatter()
+    outline = {"slides": [{"title": f"Slide {i}", "bullet_points": [f"p{i}"]} for i in range(20)]}
+    outcome = []
+
+    def run():
+        try:
+            orchestrator._run_streaming(outline, queue_size=2, batch_size=3)
+        except AttributeError as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive() and outcome
+
+    state = {"expanded": [{}], "validated": [{}], "formatted": [None]}
+    assert PresentationOrchestrator._failed_slides(state) == [0]
+
+def test_qa_direct_mode_validates_a_batch_in_one_call(fake_llm):
+    from langchain_core.documents import Document
+
+    class FakeRAG:
+        def __init__(self):
+            self.calls = []
+
+        def get_relevant_documents_batch(self, questions, k=5):
+            self.calls.append(list(questions))
+            return [[Document(page_content="Shared passage", metadata={"chunk_id": "doc-0"})] for _ in questions]
+
+    rag, llm = FakeRAG(), fake_llm(qa_reply)
+    agent = QAAgent(mode="direct", batch_size=3, max_concurrency=1, llm=llm, rag=rag)
+    expanded = {"slides": [{"title": f"Slide {i}", "detailed_points": [f"a{i}", f"b{i}"]} for i in range(5)]}
+
+    validated = agent.validate_content(expanded)
+
+    assert [s["title"] for s in validated["slides"]] == [f"Slide {i}" for i in range(5)]
+    assert validated["slides"][4]["validation"][1]["point"] == "b4"
+    assert len(llm.prompts) == 2
+    assert [len(c) for c in rag.calls] == [6, 4]
+    assert llm.prompts[0].count("Shared passage") == 1
+
+def test_qa_concurrent_keeps_order_caps_workers_and_falls_back(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_retry, "LLM_MAX_RETRIES", 0)
+
+    class FakeRAG:
+        def get_relevant_documents_batch(self, questions, k=5):
+            return [[] for _ in questions]
+
+    def slow_by_index(prompt):
+        """Earlier slides answer last, so verdicts complete in reverse order."""
+        title = json.loads(prompt.split("Slides to validate:")[1])["slides"][0]["title"]
+        time.sleep(0.01 * (10 - int(title.split()[-1])))
+        if title == "Slide 5":
+            raise TimeoutError("simulated provider timeout")
+        return qa_reply(prompt)
+
+    llm = fake_llm(slow_by_index)
+    agent = QAAgent(mode="direct", batch_size=1, max_concurrency=3, llm=llm, rag=FakeRAG())
+    expanded = {"slides": [{"title": f"Slide {i}", "detailed_points": [f"p{i}"]} for i in range(8)]}
+
+    validated = agent.validate_content(expanded)
+
+    assert [s["title"] for s in validated["slides"]] == [f"Slide {i}" for i in range(8)]
+    assert validated["slides"][0]["validation"][0] == {"point": "p0", "status": "accurate", "reason": ""}
+    assert validated["slides"][5]["validation"][0]["reason"] == "Validation request failed."
+    assert 1 < llm.peak <= 3
+
+def test_qa_direct_mode_rejects_malformed_and_reordered_verdicts(fake_llm):
+    from langchain_core.documents import Document
+
+    class FakeRAG:
+        def get_relevant_documents_batch(self, questions, k=5):
+            return [[Document(page_content="Passage", metadata={"chunk_id": "doc-0"})] for _ in questions]
+
+    verdict = {"validation": [{"point": "x", "status": "accurate", "reason": ""}]}
+    shuffled = {"slides": ["looks fine", dict(verdict, title="B"), dict(verdict, title="A")]}
+
+    agent = QAAgent(mode="direct", llm=fake_llm(lambda prompt: shuffled), rag=FakeRAG(), batch_size=3)
+    slides = [{"title": t, "detailed_points": ["x"]} for t in ("A", "B", "C")]
+    verdicts = agent.validate_batch(slides)
+
+    assert [v["title"] for v in verdicts] == ["A", "B", "C"]
+    assert verdicts[0]["validation"][0]["status"] == "accurate"
+    assert verdicts[2]["validation"][0]["point"] == " Validation failed"
+
+def test_format_optimizer_packs_by_tokens_and_retries_only_failed_half(fake_llm):
+    def batch(prompt):
+        return json.loads(prompt.split("Expanded content:")[1].split("QA validation results:")[0])["slides"]
+
+    def truncating(prompt):
+        """Valid JSON for batches of at most 2 slides, truncated output otherwise."""
+        slides = batch(prompt)
+        if len(slides) > 2:
+            return '{"slides": [{"title": "'
+        return {"slides": [{"title": s["title"], "content": [
+            {"statement": p, "status": "accurate", "design_hint": "Bullets"} for p in s["detailed_points"]
+        ]} for s in slides]}
+
+    llm = fake_llm(truncating)
+    agent = FormatOptimizerAgent(llm=llm, mode="llm")
+    expanded = {"slides": [{"title": f"Slide {i}", "detailed_points": [f"Point {i}"]} for i in range(4)]}
+    validated = {"slides": [{"title": f"Slide {i}", "validation": []} for i in range(4)]}
+
+    # Small slides all fit one call; the failed call is split instead of falling back
+    assert agent.plan_batches(expanded["slides"], validated["slides"]) == [[0, 1, 2, 3]]
+    result = agent.optimize_format(expanded, validated)
+    assert [s["title"] for s in result["slides"]] == [f"Slide {i}" for i in range(4)]
+    assert result["summary"].startswith("4 statements accurate")
+    assert [len(batch(p)) for p in llm.prompts] == [4, 2, 2]
+
+    # Long statements no longer fit one completion
+    long_slides = [{"title": f"Long {i}", "detailed_points": ["word " * 300] * 3} for i in range(4)]
+    assert len(agent.plan_batches(long_slides, [{} for _ in long_slides])) > 1
+
+def test_format_optimizer_does_not_split_batches_on_request_failures(fake_llm, monkeypatch):
+    from agents.format_optimizer_agent import OPTIMIZATION_FAILED
+    monkeypatch.setattr(llm_retry, "LLM_MAX_RETRIES", 0)
+
+    def saturated(prompt):
+        raise TimeoutError("provider saturated")
+
+    llm = fake_llm(saturated)
+    agent = FormatOptimizerAgent(llm=llm, mode="llm")
+    expanded = {"slides": [{"title": f"Slide {i}", "detailed_points": [f"Point {i}"]} for i in range(4)]}
+    validated = {"slides": [{"title": f"Slide {i}", "validation": []} for i in range(4)]}
+
+    result = agent.optimize_format(expanded, validated)
+
+    assert len(llm.prompts) == 1
+    assert [s["content"][0]["statement"] for s in result["slides"]] == [OPTIMIZATION_FAILED] * 4
+
+def test_format_optimizer_local_merge_needs_no_llm(monkeypatch):
+    from agents.format_optimizer_agent import merge_slide
+    monkeypatch.delenv("GROQ_API_KEY", raising=False)
+    agent = FormatOptimizerAgent(mode="local", hints="rules")
+    expanded = {"slides": [{"title": "Adoption", "detailed_points": ["Usage grew 40% in 2023", "Clinics adopt AI"]},
+                           {"title": "Failed", "detailed_points": [" Expansion failed, please retry."]}]}
+    validated = {"slides": [{"title": "Adoption", "validation": [
+                                {"point": "clinics adopt AI", "status": "needs_review", "reason": "No source"},
+                                {"point": "Usage grew 40% in 2023", "status": "accurate"}]},
+                            {"title": "Failed", "validation": [{"point": " Validation failed", "status": "needs_review"}]}]}
+
+    result = agent.optimize_format(expanded, validated)
+
+    adoption = result["slides"][0]["content"]
+    assert [p["status"] for p in adoption] == ["accurate", "needs_review"]
+    assert adoption[0]["design_hint"] == "Highlight the key figure in bold, larger font"
+    assert result["slides"][1]["content"][0]["status"] == "needs_review"
+    assert result["summary"] == "1 statements accurate, 2 statements need manual review"
+
+    # Malformed QA output never reaches the merge as anything but "needs_review"
+    for verdict in ("looks fine", None, {"title": "Adoption", "validation": "ok"}):
+        merged = merge_slide(expanded["slides"][0], verdict)
+        assert [p["status"] for p in merged["content"]] == ["needs_review", "needs_review"]
+
+def test_format_optimizer_local_merge_with_one_hints_call(fake_llm):
+    llm = fake_llm(lambda prompt: {"hints": [["Icon row"], ["Bold title", ""]]})
+    agent = FormatOptimizerAgent(llm=llm, mode="local", hints="llm")
+    expanded = [{"title": "A", "detailed_points": ["a"]}, {"title": "B", "detailed_points": ["b1", "b2"]}]
+    validated = [{"title": "A", "validation": [{"point": "a", "status": "accurate"}]},
+                 {"title": "B", "validation": []}]
+
+    slides = agent.format_batch(expanded, validated)
+
+    assert len(llm.prompts) == 1
+    assert [p["design_hint"] for p in slides[1]["content"]] == ["Bold title", "Mark with a subtle review flag icon"]
+    assert slides[0]["content"][0]["design_hint"] == "Icon row"
+
+def test_qa_agent_for_collection_shares_llm_and_rebinds_rag(monkeypatch):
+    import agents.qa_agent as qa_module
+
+    class FakePipeline:
+        def __init__(self, persist_directory):
+            self.persist_directory = persist_directory
+
+        def load(self):
+            return self
+
+    monkeypatch.setattr(qa_module, "RAGPipeline", FakePipeline)
+    llm = object()
+    warm = QAAgent(mode="direct", llm=llm, rag=FakePipeline("vector_db"))
+
+    scoped = warm.for_collection("vector_db/collections/team-a")
+
+    assert scoped.llm is llm
+    assert scoped.rag.persist_directory == "vector_db/collections/team-a"
+    assert warm.rag.persist_directory == "vector_db"
+
+def test_qa_react_mode_gives_a_shed_slide_its_fallback(monkeypatch):
+    monkeypatch.setattr(llm_retry, "breaker", llm_retry.CircuitBreaker())
+
+    class SheddingExecutor:
+        def invoke(self, inputs, **kwargs):
+            if '"title": "B"' in inputs["input"]:
+                raise llm_retry.CircuitOpenError(" LLM provider is saturated")
+            return {"output": {"title": "A", "validation": [{"point": "x", "status": "accurate", "reason": ""}]}}
+
+    agent = QAAgent(mode="react", llm=FakeChatModel(stage="qa", cache=False), rag=object(), max_concurrency=2)
+    agent.agent_executor = SheddingExecutor()
+    slides = [{"title": t, "detailed_points": ["x"]} for t in ("A", "B")]
+
+    result = agent.validate_content({"slides": slides})
+
+    assert result["slides"][0]["validation"][0]["status"] == "accurate"
+    assert result["slides"][1]["validation"][0]["reason"] == "Validation request failed."
+
+def test_content_expansion_retries_only_the_throttled_slide(fake_llm):
+    class RateLimitError(Exception):
+        status_code = 429
+        response = type("Response", (), {"status_code": 429, "headers": {"retry-after": "0"}})()
+
+    calls = {}
+
+    def throttle_once(prompt):
+        title = prompt.split('"title": "')[1].split('"')[0]
+        calls[title] = calls.get(title, 0) + 1
+        if title == "Slide 1" and calls[title] == 1:
+            raise RateLimitError("rate limited")
+        return expansion_reply(prompt)
+
+    agent = ContentExpansionAgent(llm=fake_llm(throttle_once), max_concurrency=2)
+    outline = {"slides": [{"title": f"Slide {i}", "bullet_points": ["point"]} for i in range(3)]}
+
+    expanded = agent.expand_outline(outline)
+
+    assert [s["detailed_points"] for s in expanded["slides"]] == [[f"Slide {i} expanded"] for i in range(3)]
+    assert calls == {"Slide 0": 1, "Slide 1": 2, "Slide 2": 1}
+
+def test_fake_provider_runs_stages_offline(monkeypatch):
+    from utils import llm_provider
+    monkeypatch.delenv("GROQ_API_KEY", raising=False)
+    monkeypatch.setattr(llm_provider, "LLM_PROVIDER", "fake")
+
+    outline = {"slides": [{"title": f"Slide {i}", "bullet_points": ["Adoption", "Cost"]} for i in range(3)]}
+    expanded = ContentExpansionAgent(max_concurrency=2).expand_outline(outline)
+    validated = {"slides": [{"title": s["title"], "validation": []} for s in expanded["slides"]]}
+    formatted = FormatOptimizerAgent(mode="llm").optimize_format(expanded, validated)
+
+    assert expanded["slides"][2] == {"title": "Slide 2", "detailed_points": [
+        "Adoption, explained in one short sentence", "Cost, explained in one short sentence"]}
+    assert [len(s["content"]) for s in formatted["slides"]] == [2, 2, 2]
+
+def test_usage_tracking_per_stage_and_token_budget(monkeypatch):
+    from utils import llm_provider
+    from utils.llm_usage import track_usage
+    monkeypatch.setattr(llm_provider, "LLM_PROVIDER", "fake")
+    agent = ContentExpansionAgent(max_concurrency=3)
+    outline = {"slides": [{"title": f"Slide {i}", "bullet_points": ["Adoption"]} for i in range(3)]}
+
+    # Worker threads report into the request that started them
+    with track_usage(user="exec@example.com", token_budget=0) as usage:
+        agent.expand_outline(outline)
+    summary = usage.finish()
+    assert summary["stages"]["expansion"]["calls"] == 3
+    assert summary["prompt_tokens"] > 0 and summary["completion_tokens"] > 0
+    assert summary["user_totals"]["requests"] >= 1
+
+    # Once the budget is spent, remaining slides fall back without calling the model
+    agent.max_concurrency = 1
+    with track_usage(token_budget=1) as usage:
+        expanded = agent.expand_outline(outline)
+    summary = usage.finish()
+    assert summary["calls"] == 1 and summary["budget_exceeded"]
+    assert expanded["slides"][2]["detailed_points"] == [" Expansion failed, please retry."]
+
+def test_job_resume_redoes_only_failed_slides(tmp_path, monkeypatch):
+    from langchain_core.outputs import ChatGeneration
+    from agents import orchestration
+    from agents.content_expansion_agent import EXPANSION_FAILED
+    from agents.orchestration import PresentationOrchestrator
+    from utils.llm_cache import SQLiteLLMCache
+    monkeypatch.setattr(orchestration.job_store, "root", str(tmp_path))
+    monkeypatch.setattr(orchestration, "CONTEXT_PREFETCH", False)
+    cache = SQLiteLLMCache(path=str(tmp_path / "responses.sqlite"))
+
+    class Stages:
+        """Expansion goes through the response cache, like a real chat model."""
+        max_concurrency = 2
+        batch_size = 2
+
+        def __init__(self):
+            self.outlines, self.expanded, self.broken = 0, [], {"Slide 2"}
+            self.rag = type("RAG", (), {"cache_stats": lambda self: {}})()
+
+        def generate_outline(self, topic):
+            self.outlines += 1
+            return {"slides": [{"title": f"Slide {i}", "bullet_points": [f"p{i}"]} for i in range(4)]}
+
+        def expand_slide(self, slide, context_docs=None):
+            cached = cache.lookup(slide["title"], "expansion")
+            if cached:
+                points = json.loads(cached[0].message.content)
+            else:
+                self.expanded.append(slide["title"])
+                points = [EXPANSION_FAILED] if slide["title"] in self.broken else slide["bullet_points"]
+                cache.update(slide["title"], "expansion", [ChatGeneration(message=AIMessage(content=json.dumps(points)))])
+            return {"title": slide["title"], "detailed_points": points}
+
+        def validate_batch(self, slides, contexts=None):
+            return [{"title": s["title"], "validation": [{"point": p, "status": "accurate"}
+                                                         for p in s["detailed_points"]]} for s in slides]
+
+    stages = Stages()
+    orchestrator = PresentationOrchestrator.__new__(PresentationOrchestrator)
+    orchestrator.mode = "streaming"
+    orchestrator.outline_agent = orchestrator.expansion_agent = orchestrator.qa_agent = stages
+    orchestrator.format_optimizer = FormatOptimizerAgent(mode="local", hints="rules")
+    job_id = orchestration.job_store.create(topic="AI", collection="default", user="exec@example.com")
+
+    orchestrator.generate_presentation("AI", job_id=job_id)
+    assert orchestration.job_store.meta(job_id)["status"] == "needs_resume"
+    assert orchestration.job_store.meta(job_id)["failed_slides"] == [2]
+
+    stages.broken, stages.expanded = set(), []
+    result = orchestrator.generate_presentation("AI", job_id=job_id)
+
+    assert stages.outlines == 1 and stages.expanded == ["Slide 2"]
+    assert [s["content"][0]["statement"] for s in result["slides"]] == ["p0", "p1", "p2", "p3"]
+    assert orchestration.job_store.meta(job_id)["status"] == "completed"
+
+def test_streaming_checkpoints_slides_as_they_finish(tmp_path, monkeypatch):
+    from agents import orchestration
+    from agents.orchestration import PresentationOrchestrator
+    monkeypatch.setattr(orchestration.job_store, "root", str(tmp_path))
+    job_id = orchestration.job_store.create(topic="AI", collection="default", user="exec@example.com")
+    on_disk = {}
+
+    class Stages:
+        max_concurrency = 1
+        batch_size = 1
+
+        def expand_slide(self, slide, context_docs=None):
+            return {"title": slide["title"], "detailed_points": slide["bullet_points"]}
+
+        def validate_batch(self, slides, contexts=None):
+            return [{"title": s["title"], "validation": [{"point": p, "status": "accurate"}
+                                                         for p in s["detailed_points"]]} for s in slides]
+
+    class SnapshotFormatter(FormatOptimizerAgent):
+        """Records what a crash while formatting Slide 3 would leave on disk."""
+
+        def format_batch(self, expanded, validated):
+            if expanded[0]["title"] == "Slide 3":
+                on_disk.update(PresentationOrchestrator._load_state(job_id, 5))
+            return super().format_batch(expanded, validated)
+
+    orchestrator = PresentationOrchestrator.__new__(PresentationOrchestrator)
+    orchestrator.expansion_agent = orchestrator.qa_agent = Stages()
+    orchestrator.format_optimizer = SnapshotFormatter(mode="local", hints="rules")
+    outline = {"slides": [{"title": f"Slide {i}", "bullet_points": [f"p{i}"]} for i in range(5)]}
+
+    orchestrator._run_streaming(outline, batch_size=1, job_id=job_id)
+
+    assert [slide is not None for slide in on_disk["formatted"]] == [True, True, True, False, False]
+    assert on_disk["expanded"][3] is not None and on_disk["validated"][3] is not None
+    assert PresentationOrchestrator._load_state(job_id, 5)["formatted"][4]["title"] == "Slide 4"
+
+def test_prefetched_context_is_shared_by_expansion_and_qa(fake_llm):
+    from langchain_core.documents import Document
+    from agents.orchestration import PresentationOrchestrator
+    from rag_pipeline.context_store import ContextStore
+
+    class FakeRAG:
+        def __init__(self):
+            self.calls = []
+
+        def get_relevant_documents_batch(self, questions, k=5):
+            self.calls.append(list(questions))
+            return [[Document(page_content=f"Passage for {q}", metadata={"chunk_id": q})] for q in questions]
+
+    def echo(prompt):
+        if "Slides to validate:" in prompt:
+            return qa_reply(prompt)
+        title = prompt.split('"title": "')[-1].split('"')[0]
+        bullets = json.loads(prompt.split('"bullet_points": ')[-1].split("\n")[0])
+        return {"title": title, "detailed_points": [f"{b} expanded" for b in bullets]}
+
+    rag, llm = FakeRAG(), fake_llm(echo)
+    orchestrator = PresentationOrchestrator.__new__(PresentationOrchestrator)
+    orchestrator.expansion_agent = ContentExpansionAgent(llm=llm, max_concurrency=2)
+    orchestrator.qa_agent = QAAgent(mode="direct", llm=llm, rag=rag, batch_size=2, max_concurrency=1)
+    orchestrator.format_optimizer = FormatOptimizerAgent(mode="local", hints="rules")
+    outline = {"slides": [{"title": f"Slide {i}", "bullet_points": [f"a{i}", f"b{i}"]} for i in range(3)]}
+
+    context = ContextStore(rag, k=2)
+    context.prefetch(outline["slides"])
+    result = orchestrator._run_streaming(outline, context=context)
+    context.close()
+
+    # Every subject is searched once, up front; QA reuses it instead of retrieving again
+    assert sorted(q for call in rag.calls for q in call) == sorted(
+        f"Slide {i}: {p}{i}" for i in range(3) for p in "ab")
+    assert all("Passage for Slide" in p for p in llm.prompts if "Slide to expand:" in p)
+    assert all("[1] Passage for Slide" in p for p in llm.prompts if "Slides to validate:" in p)
+    assert len(result["slides"]) == 3
+    assert context.stats() == {"prefetched_slides": 3, "hits": 6, "misses": 0}
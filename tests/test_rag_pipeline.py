@@ -0,0 +1,464 @@
+import os
+import time
+import pytest
+from langchain.docstore.document import Document
+from rag_pipeline.manifest import IndexManifest, chunk_ids
+from rag_pipeline.numpy_store import NumpyVectorStore
+from rag_pipeline.lexical_index import BM25Index
+from rag_pipeline.retriever import reciprocal_rank_fusion
+from rag_pipeline.query_cache import QueryCache, normalize_query
+from rag_pipeline.context_packer import pack_context, pack_documents
+from rag_pipeline.embeddings import CachedEmbeddings
+from rag_pipeline import splitter, registry, loaders
+
+class KeywordEmbeddings:
+    """Tiny deterministic embedding: one dimension per vocabulary word."""
+    vocab = ["solar", "wind", "battery", "grid"]
+
+    def embed_documents(self, texts):
+        return [[float(w in t.lower()) + 0.01 for w in self.vocab] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def test_manifest_skips_identical_reupload(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_text("Solar storage capacity grew 40% in 2023.")
+    store = str(tmp_path / "vector_db")
+
+    manifest = IndexManifest(store)
+    to_index, stale = manifest.plan([str(doc)], 800, 150)
+    assert len(to_index) == 1 and stale == []
+    manifest.record(to_index[0][1], chunk_ids(to_index[0][1], 2))
+    manifest.save()
+
+    to_index, stale = IndexManifest(store).plan([str(doc)], 800, 150)
+    assert to_index == [] and stale == []
+
+def test_manifest_replaces_changed_file(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_text("version one")
+    manifest = IndexManifest(str(tmp_path / "vector_db"))
+    (_, fp), = manifest.plan([str(doc)], 800, 150)[0]
+    old_ids = chunk_ids(fp, 3)
+    manifest.record(fp, old_ids)
+
+    doc.write_text("version two")
+    to_index, stale = manifest.plan([str(doc)], 800, 150)
+    assert len(to_index) == 1
+    assert stale == old_ids
+
+def test_manifest_dedupes_identical_content_under_new_name(tmp_path):
+    a = tmp_path / "a.txt"
+    b = tmp_path / "b.txt"
+    a.write_text("same bytes")
+    b.write_text("same bytes")
+    manifest = IndexManifest(str(tmp_path / "vector_db"))
+    to_index, _ = manifest.plan([str(a), str(b)], 800, 150)
+    assert len(to_index) == 1
+
+def test_manifest_rechunks_on_parameter_change(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_text("chunk me")
+    manifest = IndexManifest(str(tmp_path / "vector_db"))
+    (_, fp), = manifest.plan([str(doc)], 800, 150)[0]
+    manifest.record(fp, chunk_ids(fp, 1))
+    to_index, stale = manifest.plan([str(doc)], 400, 50)
+    assert len(to_index) == 1 and stale == chunk_ids(fp, 1)
+
+def test_numpy_store_upsert_delete_and_reload(tmp_path):
+    store = NumpyVectorStore(KeywordEmbeddings(), persist_directory=str(tmp_path))
+    docs = [Document(page_content=t, metadata={"source": "a.txt"}) for t in ["solar panels", "wind farms", "battery packs"]]
+    store.add_documents(docs, ids=["c0", "c1", "c2"])
+    store.add_documents([docs[0]], ids=["c0"])
+    assert len(store) == 3
+
+    store.delete(ids=["c1"])
+    store.persist()
+
+    reloaded = NumpyVectorStore(KeywordEmbeddings(), persist_directory=str(tmp_path))
+    assert len(reloaded) == 2
+    top = reloaded.similarity_search("battery storage", k=1)
+    assert top[0].page_content == "battery packs"
+
+def test_bm25_exact_terms_incremental_and_persisted(tmp_path):
+    index = BM25Index(str(tmp_path))
+    docs = [
+        Document(page_content="The XR-200 inverter is rated at 3.5 kW."),
+        Document(page_content="Inverters convert DC to AC power."),
+        Document(page_content="Grid-scale batteries smooth demand peaks."),
+    ]
+    index.add_documents(docs, ["c0", "c1", "c2"])
+    assert index.search("xr-200 rating", k=1)[0][0] == "c0"
+
+    index.delete(["c0"])
+    assert all(id_ != "c0" for id_, _ in index.search("xr-200", k=3))
+    index.persist()
+
+    reloaded = BM25Index(str(tmp_path))
+    assert len(reloaded) == 2
+    assert reloaded.search("batteries", k=1)[0][0] == "c2"
+    assert reloaded.get_document("c2").page_content.startswith("Grid-scale")
+
+def test_reciprocal_rank_fusion_prefers_docs_ranked_by_both():
+    a, b, c = (Document(page_content=t, metadata={"chunk_id": t}) for t in "abc")
+    fused = reciprocal_rank_fusion([[a, b, c], [b, c]], k=2)
+    assert [d.page_content for d in fused] == ["b", "c"]
+
+def test_query_cache_lru_ttl_and_version_keys():
+    cache = QueryCache(max_entries=2, ttl=60)
+    key = lambda q, version: ("vector_db", version, normalize_query(q))
+    cache.put(key("Solar growth?", 1), ["doc"])
+    assert cache.get(key("  solar   GROWTH", 1)) == ["doc"]
+    assert cache.get(key("solar growth", 2)) is None  # index rebuilt -> new version
+
+    cache.put(key("b", 1), [])
+    cache.put(key("c", 1), [])
+    assert cache.get(key("solar growth", 1)) is None  # evicted as least recently used
+    assert cache.stats()["hits"] == 1
+
+    expired = QueryCache(ttl=0)
+    expired.put("k", ["doc"])
+    assert expired.get("k") is None
+
+def test_numpy_store_batched_search_matches_single_queries(tmp_path):
+    embeddings = KeywordEmbeddings()
+    store = NumpyVectorStore(embeddings, persist_directory=str(tmp_path))
+    store.add_texts(["solar panels", "wind farms", "battery packs", "grid links"])
+    queries = ["wind power", "grid upgrades", "solar output"]
+    batched = store.similarity_search_by_vectors(embeddings.embed_documents(queries), k=2)
+    assert [docs[0].page_content for docs in batched] == \
+        [store.similarity_search(q, k=1)[0].page_content for q in queries]
+
+def test_numpy_store_stacks_added_rows_once_and_scores_float16_in_blocks(tmp_path, monkeypatch):
+    from rag_pipeline import numpy_store
+    stacks = []
+    vstack = numpy_store.np.vstack
+    monkeypatch.setattr(numpy_store.np, "vstack", lambda blocks: stacks.append(len(blocks)) or vstack(blocks))
+    monkeypatch.setattr(numpy_store, "SCORE_BLOCK_ROWS", 2)
+    texts = ["solar panels", "wind farms", "battery packs", "grid links", "solar wind hybrid"]
+
+    store = NumpyVectorStore(KeywordEmbeddings(), persist_directory=str(tmp_path), dtype="float16")
+    for i, text in enumerate(texts):
+        store.add_texts([text], ids=[f"c{i}"])
+    store.persist()
+    assert stacks == [5]
+
+    reloaded = NumpyVectorStore(KeywordEmbeddings(), persist_directory=str(tmp_path), dtype="float16")
+    exact = NumpyVectorStore(KeywordEmbeddings(), persist_directory=str(tmp_path / "f32"))
+    exact.add_texts(texts)
+    for query in ["wind power", "grid upgrades", "solar hybrid"]:
+        got = reloaded.similarity_search_with_score(query, k=3)
+        want = exact.similarity_search_with_score(query, k=3)
+        assert got[0][0].page_content == want[0][0].page_content
+        assert [s for _, s in got] == pytest.approx([s for _, s in want], abs=1e-3)
+
+def test_streaming_splitter_offsets_pages_and_ids(monkeypatch):
+    monkeypatch.setattr(splitter, "WINDOW_CHUNKS", 4)  # force several windows
+    pages = [
+        Document(page_content=" ".join(f"sentence {p}-{i} about storage." for i in range(200)),
+                 metadata={"source": "report.pdf", "page": p})
+        for p in range(2)
+    ]
+    chunks = list(splitter.iter_split_documents(iter(pages), chunk_size=200, chunk_overlap=40, id_prefix="abc"))
+
+    for chunk in chunks:
+        page = pages[chunk.metadata["page"]].page_content
+        assert page[chunk.metadata["start_index"]:chunk.metadata["end_index"]] == chunk.page_content
+    assert [c.metadata["chunk_id"] for c in chunks] == [f"abc-{i}" for i in range(len(chunks))]
+    assert {c.metadata["page"] for c in chunks} == {0, 1}
+
+def _marked_job(index, marker_dir):
+    """Pool job for the loader tests: records that it started; job 0 is slow, job 3 fails."""
+    import time
+    open(os.path.join(marker_dir, str(index)), "w").close()
+    if index == 0:
+        time.sleep(1.0)
+    if index == 3:
+        raise ValueError("corrupt file")
+    return index
+
+def test_parallel_loading_streams_in_order_within_a_window(tmp_path):
+    jobs = [(i, str(tmp_path)) for i in range(10)]
+    results = loaders._iter_parallel(_marked_job, jobs, max_workers=2)
+
+    first = next(results)
+    started = len(os.listdir(tmp_path))
+    rest = list(results)
+
+    assert first == (jobs[0], 0)
+    # While the slow first job blocks, only the window (2 * max_workers) plus the
+    # replacement submitted on its completion have started, not all ten
+    assert started <= 2 * 2 + 1
+    assert [result for _, result in rest] == [1, 2, None, 4, 5, 6, 7, 8, 9]
+
+def test_split_files_in_worker_processes_yield_none_for_failures(tmp_path):
+    paths = [tmp_path / "a.txt", tmp_path / "missing.txt", tmp_path / "b.md"]
+    paths[0].write_text("Solar capacity grew. " * 20)
+    paths[2].write_text("Wind output was flat. " * 20)
+
+    results = [(path, None if batches is None else [c for batch in batches for c in batch])
+               for path, batches in loaders.iter_split_files([str(p) for p in paths], chunk_size=100,
+                                                             chunk_overlap=20, id_prefixes=["a", "m", "b"],
+                                                             max_workers=2)]
+
+    assert [path for path, _ in results] == [str(p) for p in paths]
+    assert results[1][1] is None
+    assert results[0][1][0].metadata["chunk_id"] == "a-0" and "Wind" in results[2][1][0].page_content
+
+def test_split_files_hands_over_chunks_in_bounded_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(loaders, "SPLIT_BATCH_CHUNKS", 2)
+    doc = tmp_path / "long.txt"
+    doc.write_text("Solar capacity grew again this year. " * 40)
+
+    sizes, ids = [], []
+    for _, batches in loaders.iter_split_files([str(doc)], chunk_size=100, chunk_overlap=20,
+                                               id_prefixes=["f"], max_workers=1):
+        for batch in batches:
+            sizes.append(len(batch))
+            ids.extend(c.metadata["chunk_id"] for c in batch)
+
+    assert len(sizes) > 2 and max(sizes) == 2
+    assert ids == [f"f-{i}" for i in range(len(ids))]
+
+def test_collection_directories_are_isolated_and_validated():
+    assert registry.collection_directory("default") == registry.VECTOR_DB_ROOT
+    assert registry.collection_directory("team-energy") == \
+        os.path.join(registry.VECTOR_DB_ROOT, "collections", "team-energy")
+    for bad in ["../etc", "a/b", "x" * 65]:
+        with pytest.raises(ValueError):
+            registry.collection_directory(bad)
+
+@pytest.fixture
+def fresh_registry(monkeypatch):
+    """Empty process-wide registry with the keyword embeddings as the shared model."""
+    from collections import OrderedDict
+    monkeypatch.setattr(registry, "_stores", OrderedDict())
+    monkeypatch.setattr(registry, "_open_locks", {})
+    monkeypatch.setattr(registry, "_embeddings", KeywordEmbeddings())
+    return registry
+
+class FakeStore:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def _fake_open(monkeypatch, opened, gate=None):
+    """Replace store opening with a recorder; opening a directory named "slow" waits for gate."""
+    def load_vectorstore(embeddings, persist_directory, backend):
+        if gate is not None and os.path.basename(persist_directory) == "slow":
+            gate.wait(5)
+        opened.append(os.path.basename(persist_directory))
+        return FakeStore(os.path.basename(persist_directory))
+
+    monkeypatch.setattr(registry, "load_vectorstore", load_vectorstore)
+    monkeypatch.setattr(registry, "_open_lexical", lambda persist_directory, vectorstore: None)
+
+def test_registry_loads_one_embedding_model_per_process(monkeypatch):
+    import threading
+    loads = []
+    monkeypatch.setattr(registry, "_embeddings", None)
+    monkeypatch.setattr(registry, "get_embeddings", lambda: loads.append(1) or KeywordEmbeddings())
+    models = []
+    threads = [threading.Thread(target=lambda: models.append(registry.get_shared_embeddings())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(loads) == 1 and all(m is models[0] for m in models)
+
+def test_registry_build_refreshes_other_pipelines(fresh_registry, tmp_path):
+    from rag_pipeline.pipeline import RAGPipeline
+    doc = tmp_path / "energy.txt"
+    doc.write_text("Solar storage capacity grew 40% in 2023.")
+    store = str(tmp_path / "vector_db")
+
+    reader = RAGPipeline(persist_directory=store, backend="numpy", search_mode="dense").load()
+    assert reader.get_relevant_documents("solar", k=1) == []
+
+    writer = RAGPipeline(persist_directory=store, backend="numpy", search_mode="dense").build([str(doc)])
+    docs = reader.get_relevant_documents("solar", k=1)
+
+    assert reader.vectorstore is writer.vectorstore and reader.version == writer.version
+    assert "Solar storage" in docs[0].page_content
+
+def test_registry_reopens_a_store_rewritten_by_another_process(fresh_registry, tmp_path, monkeypatch):
+    opened = []
+    _fake_open(monkeypatch, opened)
+    manifest = tmp_path / registry.MANIFEST_FILE
+    manifest.write_text("{}")
+
+    store, version = registry.get_vectorstore(str(tmp_path), "numpy")
+    assert registry.get_vectorstore(str(tmp_path), "numpy") == (store, version)
+    os.utime(manifest, (1, 1))
+    reopened, new_version = registry.get_vectorstore(str(tmp_path), "numpy")
+
+    assert reopened is not store and new_version > version and len(opened) == 2
+
+def test_registry_evicts_least_recently_used_indexes(fresh_registry, tmp_path, monkeypatch):
+    opened = []
+    _fake_open(monkeypatch, opened)
+    monkeypatch.setattr(registry, "MAX_OPEN_COLLECTIONS", 2)
+    for name in ("a", "b", "a", "c"):
+        registry.get_vectorstore(str(tmp_path / name), "numpy")
+
+    assert [os.path.basename(i["persist_directory"]) for i in registry.open_indexes()] == ["a", "c"]
+    registry.get_vectorstore(str(tmp_path / "b"), "numpy")
+    assert opened == ["a", "b", "c", "b"]
+
+def test_registry_closes_idle_indexes_on_any_access(fresh_registry, tmp_path, monkeypatch):
+    opened = []
+    _fake_open(monkeypatch, opened)
+    a, _ = registry.get_vectorstore(str(tmp_path / "a"), "numpy")
+    b, _ = registry.get_vectorstore(str(tmp_path / "b"), "numpy")
+
+    # No other index is opened: reusing "b" alone sweeps the idle "a" and releases it
+    monkeypatch.setattr(registry, "COLLECTION_IDLE_SECONDS", 0)
+    time.sleep(0.01)
+    assert registry.get_vectorstore(str(tmp_path / "b"), "numpy")[0] is b
+    assert a.closed and not b.closed
+    assert [os.path.basename(i["persist_directory"]) for i in registry.open_indexes()] == ["b"]
+
+    # The background sweep needs no request at all
+    time.sleep(0.01)
+    with registry._lock:
+        registry._evict()
+    assert b.closed and registry.open_indexes() == []
+
+def test_numpy_store_close_releases_the_map_and_reopens_on_use(tmp_path):
+    store = NumpyVectorStore(KeywordEmbeddings(), persist_directory=str(tmp_path))
+    store.add_texts(["solar panels", "wind farms"])
+    store.close()
+    assert store._pending  # unpersisted rows are never dropped
+
+    store.persist()
+    store.close()
+    assert store._vectors is None
+    assert store.similarity_search("wind", k=1)[0].page_content == "wind farms"
+
+def test_registry_opens_one_index_without_blocking_others(fresh_registry, tmp_path, monkeypatch):
+    import threading
+    gate, opened = threading.Event(), []
+    _fake_open(monkeypatch, opened, gate)
+    slow = threading.Thread(target=registry.get_vectorstore, args=(str(tmp_path / "slow"), "numpy"))
+    slow.start()
+
+    registry.get_vectorstore(str(tmp_path / "fast"), "numpy")
+    assert opened == ["fast"] and slow.is_alive()
+    gate.set()
+    slow.join()
+    assert opened == ["fast", "slow"]
+
+def test_context_packer_removes_overlap_duplicates_and_fits_budget():
+    page = ("Solar capacity grew 40% in 2023. Battery prices fell again. "
+            "Grid operators added storage. Wind output was flat.")
+    first = Document(page_content=page[:80], metadata={"source": "a.pdf", "start_index": 0, "end_index": 80})
+    second = Document(page_content=page[50:], metadata={"source": "a.pdf", "start_index": 50,
+                                                         "end_index": len(page)})
+    boilerplate = Document(page_content="Solar capacity grew 40% in 2023! Confidential.", metadata={"source": "b.pdf"})
+
+    packed = pack_documents([first, second, boilerplate], max_tokens=1000)
+    text = " ".join(t for _, t in packed)
+    assert text.count("Battery prices") == 1 and text.count("Solar capacity") == 1
+    assert [n for n, _ in packed] == [1, 2, 3] and packed[2][1] == "Confidential."
+
+    # Overlap found by matching text when no offsets were recorded
+    bare = [Document(page_content=d.page_content) for d in (first, second)]
+    assert pack_context(bare, 1000).count("Battery prices") == 1
+
+    small = pack_context([first, second, boilerplate], max_tokens=20)
+    assert small.startswith("[1] Solar capacity") and "[2]" not in small
+
+class CountingEmbeddings(KeywordEmbeddings):
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[v + 0.123456 for v in vector] for vector in super().embed_documents(texts)]
+
+def test_cached_embeddings_hits_misses_and_float16_round_trip(tmp_path):
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, cache_dir=str(tmp_path), dtype="float16")
+
+    first = cache.embed_documents(["Solar  power", "Wind power"])
+    again = cache.embed_documents(["Solar power", "wind power", "Wind power"])
+
+    # Whitespace is normalized; case is not
+    assert model.embedded == ["Solar  power", "Wind power", "wind power"]
+    assert (cache.hits, cache.misses) == (2, 3)
+    assert again[0] == pytest.approx(first[0], abs=1e-3) and again[0] != first[0]
+
+    reopened = CachedEmbeddings(CountingEmbeddings(), cache_dir=str(tmp_path), dtype="float16")
+    assert reopened.embed_documents(["Wind power"])[0] == again[2]
+    assert reopened.embeddings.embedded == []
+
+def test_cached_embeddings_serve_but_never_store_queries(tmp_path):
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, cache_dir=str(tmp_path))
+    cache.embed_documents(["Solar power"])
+    size = cache.stats()["size_bytes"]
+
+    assert cache.embed_query("Solar power") == cache.embed_documents(["Solar power"])[0]
+    cache.embed_queries(["battery storage", "grid"])
+    cache.embed_queries(["battery storage"])
+
+    assert model.embedded == ["Solar power", "battery storage", "grid", "battery storage"]
+    assert cache.stats()["size_bytes"] == size
+
+def test_cached_embeddings_evict_least_recently_used_past_max_bytes(tmp_path):
+    row = 4 * 4  # four float32 dimensions
+    cache = CachedEmbeddings(CountingEmbeddings(), cache_dir=str(tmp_path), dtype="float32", max_bytes=3 * row)
+    cache.embed_documents(["solar"])
+    cache.embed_documents(["wind"])
+    cache.embed_documents(["battery"])
+    cache.embed_documents(["solar"])  # now more recently used than "wind"
+    cache.embed_documents(["grid"])
+
+    assert cache.stats()["size_bytes"] <= 3 * row
+    model = CountingEmbeddings()
+    cache.embeddings = model
+    cache.embed_documents(["solar", "grid", "wind"])
+    assert model.embedded == ["wind"]
+
+
+def test_cached_embeddings_size_counts_a_replaced_row_once(tmp_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), cache_dir=str(tmp_path), dtype="float32")
+    key = cache._key("solar")
+
+    # Two concurrent uploads both missed on the same chunk and both store it
+    cache._store({key: [1.0, 0.0, 0.0, 0.0]}, time.time())
+    cache._store({key: [1.0, 0.0, 0.0, 0.0]}, time.time())
+
+    on_disk = cache._conn.execute("SELECT SUM(LENGTH(vector)) FROM embeddings").fetchone()[0]
+    assert cache.stats()["size_bytes"] == on_disk == 4 * 4
+
+def test_context_store_counts_concurrent_reads_exactly():
+    import sys
+    import threading
+    from rag_pipeline.context_store import ContextStore
+
+    class FakeRAG:
+        def get_relevant_documents_batch(self, questions, k=5):
+            return [[Document(page_content=q)] for q in questions]
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads often so unlocked updates would be lost
+    try:
+        store = ContextStore(FakeRAG(), k=1)
+        store.prefetch([{"title": "Solar", "bullet_points": ["growth"]}])
+        readers = [threading.Thread(target=lambda: [store.slide_context(i % 2) for i in range(2000)])
+                   for _ in range(8)]
+        for t in readers:
+            t.start()
+        for t in readers:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    store.close()
+
+    assert store.stats() == {"prefetched_slides": 1, "hits": 8000, "misses": 8000}
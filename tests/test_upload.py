@@ -8,3 +8,17 @@ def test_upload_small_txt(client, auth_headers, tmp_path):
 
     assert response.status_code == 200
     assert "message" in response.json() or "success" in response.json()
+
+def test_upload_rejects_a_collection_the_token_does_not_grant(client, tmp_path):
+    from utils.security import create_access_token
+    token = create_access_token("exec@example.com", "Executive", collections=["leadership", "strategy"])
+    file_path = tmp_path / "test.txt"
+    file_path.write_text("Quarterly research notes.")
+
+    with open(file_path, "rb") as f:
+        response = client.post("/api/upload-doc?collection=research",
+                               files={"files": ("test.txt", f, "text/plain")},
+                               headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 403
+    assert "research" in response.json()["detail"]
@@ -0,0 +1,19 @@
+def _login(client, email, password):
+    login = client.post("/api/login", json={"email": email, "password": password})
+    assert login.status_code == 200
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+def test_usage_reports_the_callers_totals(client):
+    response = client.get("/api/usage", headers=_login(client, "exec@example.com", "execpass"))
+    assert response.status_code == 200
+    assert response.json()["user"] == "exec@example.com"
+    assert set(response.json()["usage"]) >= {"requests", "total_tokens", "cost_usd"}
+
+def test_usage_of_all_users_is_executive_only(client):
+    response = client.get("/api/usage/all", headers=_login(client, "exec@example.com", "execpass"))
+    assert response.status_code == 200
+    assert isinstance(response.json()["users"], dict)
+    assert isinstance(response.json()["open_indexes"], list)
+
+    analyst = _login(client, "analyst@example.com", "analystpass")
+    assert client.get("/api/usage/all", headers=analyst).status_code == 403
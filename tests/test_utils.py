@@ -1,11 +1,29 @@
-from utils.security import create_access_token, verify_token
+import pytest
+from utils.security import create_access_token, verify_token, authorize_collection
 from utils.ppt_generator import PPTGenerator
+from utils.llm_cache import SQLiteLLMCache
+from utils.llm_provider import FakeChatModel, RecordReplayChatModel, fake_response
+from utils.llm_hedge import Hedger
+from utils.llm_retry import CircuitBreaker, CircuitOpenError, call_with_retry, is_retryable, retry_after
+from langchain_core.outputs import ChatGeneration
+from langchain_core.messages import AIMessage
 
 def test_security_jwt():
     token = create_access_token({"sub": "test@example.com", "role": "Executive"})
     payload = verify_token(token)
     assert payload["role"] == "Executive"
 
+def test_collections_are_authorized_from_token_claims():
+    from fastapi import HTTPException
+    token = create_access_token("analyst@example.com", "Analyst", collections=["research"])
+    user = {"email": "analyst@example.com", "collections": verify_token(token)["collections"]}
+
+    assert authorize_collection(user, "research") == "research"
+    assert authorize_collection(user, "default") == "default"
+    with pytest.raises(HTTPException) as denied:
+        authorize_collection(user, "leadership")
+    assert denied.value.status_code == 403
+
 def test_ppt_generator(tmp_path):
     ppt_gen = PPTGenerator(output_dir=str(tmp_path))
     fake_json = {
@@ -14,3 +32,107 @@ def test_ppt_generator(tmp_path):
     }
     path = ppt_gen.generate_ppt(fake_json, filename="test.pptx")
     assert path.endswith(".pptx")
+
+def test_llm_cache_hits_identical_requests_and_expires(tmp_path):
+    cache = SQLiteLLMCache(path=str(tmp_path / "responses.sqlite"), ttl=60)
+    generations = [ChatGeneration(message=AIMessage(content='{"slides": []}'))]
+    llm_string = "model=llama-3.1-8b-instant temperature=0"
+
+    assert cache.lookup("prompt", llm_string) is None
+    cache.update("prompt", llm_string, generations)
+    assert cache.lookup("prompt", llm_string)[0].message.content == '{"slides": []}'
+    assert cache.lookup("prompt", "model=llama-3.1-8b-instant temperature=0.3") is None
+
+    expired = SQLiteLLMCache(path=str(tmp_path / "responses.sqlite"), ttl=0)
+    assert expired.lookup("prompt", llm_string) is None
+
+def test_llm_cache_skips_sampled_stages_by_default(monkeypatch):
+    from utils import llm_cache
+    monkeypatch.setattr(llm_cache, "install_llm_cache", lambda: None)
+
+    assert llm_cache.llm_cache_for("qa", temperature=0) is None
+    assert llm_cache.llm_cache_for("expansion", temperature=0.3) is False
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_SAMPLED", True)
+    assert llm_cache.llm_cache_for("expansion", temperature=0.3) is None
+
+def test_llm_retry_backs_off_then_opens_circuit(monkeypatch):
+    monkeypatch.setattr("utils.llm_retry.time.sleep", lambda seconds: None)
+    circuit = CircuitBreaker(threshold=2, reset_seconds=60, max_wait=0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise TimeoutError("slow provider")
+        return "ok"
+
+    assert call_with_retry(flaky, retries=3, circuit=circuit) == "ok"
+    assert len(attempts) == 2
+
+    def throttled():
+        raise TimeoutError("still slow")
+
+    with pytest.raises(TimeoutError):
+        call_with_retry(throttled, retries=1, circuit=circuit)
+    # Threshold reached: further calls are shed without reaching the provider
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(flaky, circuit=circuit)
+    assert circuit.stats()["state"] == "open"
+
+def test_llm_retry_classifies_errors_and_reads_retry_after():
+    class HTTPError(Exception):
+        def __init__(self, status, headers=None):
+            self.response = type("Response", (), {"status_code": status, "headers": headers or {}})()
+
+    assert is_retryable(HTTPError(429)) and is_retryable(HTTPError(503))
+    assert not is_retryable(HTTPError(400)) and not is_retryable(ValueError("bad json"))
+    assert retry_after(HTTPError(429, {"retry-after": "2.5"})) == 2.5
+    assert retry_after(HTTPError(429)) is None
+
+def test_llm_record_then_replay_without_provider(tmp_path):
+    inner = FakeChatModel(stage="expansion", cache=False)
+    recorder = RecordReplayChatModel(stage="expansion", mode="record", inner=inner,
+                                     recordings_dir=str(tmp_path), cache=False)
+    prompt = 'Slide to expand:\n{\n"title": "AI",\n"bullet_points": ["Agents"]\n}\n'
+    recorded = recorder.invoke(prompt).content
+
+    replayer = RecordReplayChatModel(stage="expansion", mode="replay", recordings_dir=str(tmp_path), cache=False)
+    assert replayer.invoke(prompt).content == recorded == fake_response("expansion", prompt)
+    with pytest.raises(LookupError):
+        replayer.invoke("a prompt that was never recorded")
+
+def test_llm_hedge_duplicates_slow_calls_within_cap():
+    import time
+    hedger = Hedger(enabled=True, percentile=0.9, max_ratio=0.5, min_samples=5)
+    for _ in range(10):
+        hedger.record("qa", 0.01)
+    assert hedger.threshold("qa") == 0.01 and hedger.threshold("expansion") is None
+
+    attempts = []
+
+    def first_call_stalls():
+        attempts.append(1)
+        time.sleep(1.0 if len(attempts) == 1 else 0.01)
+        return len(attempts)
+
+    started = time.monotonic()
+    assert hedger.call(first_call_stalls, stage="qa") == 2  # the duplicate answered first
+    assert time.monotonic() - started < 0.5
+    assert hedger.stats() == {"enabled": True, "calls": 1, "hedged": 1, "hedge_wins": 1}
+
+    # Extra load stays within max_ratio of calls: the next slow call is not duplicated
+    attempts.clear()
+    assert hedger.call(first_call_stalls, stage="qa") == 1
+    assert len(attempts) == 1 and hedger.stats()["hedged"] == 1
+
+
+def test_job_store_claim_rejects_a_job_already_running(tmp_path):
+    from utils.job_store import JobStore
+    store = JobStore(root=str(tmp_path))
+    job_id = store.create(topic="AI", user="exec@example.com")
+
+    assert not store.claim(job_id)
+    store.release(job_id)
+    assert store.claim(job_id) and store.meta(job_id)["status"] == "running"
+    # A "running" job from a previous process (not tracked here) can be resumed
+    assert JobStore(root=str(tmp_path)).claim(job_id)
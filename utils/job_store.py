@@ -0,0 +1,97 @@
+# utils/job_store.py
+import os
+import re
+import json
+import time
+import uuid
+import threading
+
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+# Checkpointed stage outputs, in pipeline order
+STAGES = ("outline", "expanded", "validated", "formatted")
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobStore:
+    """
+    Durable per-job checkpoints: jobs/<job_id>/job.json holds the job's
+    metadata and status, and one <stage>.json per completed (or partially
+    completed) stage holds that stage's output. Writes are atomic, so a crash
+    mid-write never leaves a corrupt checkpoint behind.
+    Jobs running in this process are tracked, so a job cannot be run twice
+    at once; a "running" job not tracked here was cut off by a restart.
+    """
+
+    def __init__(self, root=JOBS_DIR):
+        self.root = root
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def _dir(self, job_id):
+        if not _JOB_ID.match(job_id or ""):
+            raise ValueError(f" Invalid job id: {job_id!r}")
+        return os.path.join(self.root, job_id)
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def create(self, **meta):
+        """Start a job (topic, collection, user, ...) and return its ID."""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._dir(job_id), exist_ok=True)
+        now = time.time()
+        with self._lock:
+            self._write(os.path.join(self._dir(job_id), "job.json"),
+                        dict(meta, job_id=job_id, status="running", error=None, created=now, updated=now))
+            self._active.add(job_id)
+        return job_id
+
+    def claim(self, job_id):
+        """Mark a job running for a resume; False if it is already running in this process."""
+        with self._lock:
+            if job_id in self._active:
+                return False
+            self._active.add(job_id)
+        self.update(job_id, status="running")
+        return True
+
+    def release(self, job_id):
+        with self._lock:
+            self._active.discard(job_id)
+
+    def meta(self, job_id):
+        """Job metadata plus the stages checkpointed so far, or None if unknown."""
+        meta = self._read(os.path.join(self._dir(job_id), "job.json"))
+        if meta is not None:
+            meta["checkpoints"] = [s for s in STAGES if os.path.exists(os.path.join(self._dir(job_id), f"{s}.json"))]
+        return meta
+
+    def update(self, job_id, **fields):
+        path = os.path.join(self._dir(job_id), "job.json")
+        with self._lock:
+            meta = self._read(path) or {"job_id": job_id}
+            meta.update(fields, updated=time.time())
+            self._write(path, meta)
+        return meta
+
+    def save(self, job_id, stage, data):
+        if stage not in STAGES:
+            raise ValueError(f" Unknown stage: {stage}")
+        self._write(os.path.join(self._dir(job_id), f"{stage}.json"), data)
+
+    def load(self, job_id, stage):
+        """A stage's checkpoint, or None if the stage has not run yet."""
+        return self._read(os.path.join(self._dir(job_id), f"{stage}.json"))
+
+
+job_store = JobStore()
@@ -0,0 +1,175 @@
+# utils/llm_cache.py
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain.globals import set_llm_cache
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache/responses.sqlite")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))  # seconds
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", 256))
+# Comma-separated stages that must always call the model, e.g. "outline,expansion"
+LLM_CACHE_DISABLED_STAGES = {
+    s.strip() for s in os.getenv("LLM_CACHE_DISABLED_STAGES", "").split(",") if s.strip()
+}
+# Also cache sampled (temperature > 0) calls (1), so regenerating a deck repeats its content,
+# or only deterministic temperature-0 calls (0)
+LLM_CACHE_SAMPLED = os.getenv("LLM_CACHE_SAMPLED", "0") == "1"
+
+_refresh = contextvars.ContextVar("llm_cache_refresh", default=False)
+
+
+@contextmanager
+def refresh_llm_cache():
+    """
+    Calls made in this context skip cached responses and overwrite them with
+    fresh ones, e.g. when redoing a slide whose cached answer failed to parse.
+    """
+    token = _refresh.set(True)
+    try:
+        yield
+    finally:
+        _refresh.reset(token)
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Disk-backed LangChain LLM cache keyed by sha256(llm_string + prompt).
+    llm_string carries the model name and every invocation parameter
+    (temperature, max_tokens, stop, ...), so only byte-identical requests hit.
+    Entries expire after ttl seconds; least recently used rows are evicted
+    once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024)):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def _key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        if _refresh.get():
+            return None
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._size -= len(row[0])
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        try:
+            generations = [loads(gen) for gen in json.loads(row[0])]
+        except Exception:
+            return None
+        for gen in generations:
+            message = getattr(gen, "message", None)
+            if message is not None:
+                # Lets usage accounting tell free cache hits from billed calls
+                message.response_metadata = dict(message.response_metadata or {}, cache_hit=True)
+        return generations
+
+    def update(self, prompt, llm_string, return_val):
+        value = json.dumps([dumps(gen) for gen in return_val])
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT LENGTH(value) FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._size += len(value) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop expired rows, then least recently used ones until at 90% of max_bytes."""
+        cutoff = time.time() - self.ttl
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (cutoff,))
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        for key, size in self._conn.execute(
+            "SELECT key, LENGTH(value) FROM responses ORDER BY last_used ASC"
+        ).fetchall():
+            if self._size <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._size -= size
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size_bytes": self._size,
+            }
+
+
+_cache = None
+_install_lock = threading.Lock()
+
+
+def install_llm_cache():
+    """Install the shared response cache as LangChain's global LLM cache (once per process)."""
+    global _cache
+    with _install_lock:
+        if _cache is None:
+            _cache = SQLiteLLMCache()
+            set_llm_cache(_cache)
+    return _cache
+
+
+def llm_cache_for(stage: str, temperature: float = 0):
+    """
+    Value for a chat model's `cache` field for one pipeline stage:
+    None uses the shared cache, False opts the stage out. Sampled stages
+    (outline and expansion run at temperature 0.3) opt out unless
+    LLM_CACHE_SAMPLED is set, so a regenerated deck gets fresh content.
+    """
+    if not LLM_CACHE_ENABLED or stage in LLM_CACHE_DISABLED_STAGES:
+        return False
+    if temperature > 0 and not LLM_CACHE_SAMPLED:
+        return False
+    install_llm_cache()
+    return None
+
+
+def llm_cache_stats():
+    return _cache.stats() if _cache is not None else None
@@ -0,0 +1,118 @@
+# utils/llm_hedge.py
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from utils.llm_usage import bind_context
+
+# Send a duplicate of an LLM call that is slower than usual (1) or never (0)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+# Hedge once a call outlives this percentile of the stage's recent latencies
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 0.95))
+# Cap on duplicate requests, as a fraction of all calls
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", 0.1))
+# Successful calls per stage to learn from before hedging starts, and how many are kept
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_HEDGE_WINDOW = 200
+
+
+def _start(func, args, kwargs):
+    """Run func on its own thread (in the caller's context); returns (future, start time)."""
+    future = Future()
+    started = time.monotonic()
+
+    def run():
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=bind_context(run), daemon=True).start()
+    return future, started
+
+
+class Hedger:
+    """
+    Tail-latency hedging for LLM calls. Latencies of successful calls are
+    kept per stage; once a stage has min_samples of them, a call still
+    running after the stage's `percentile` latency gets one duplicate request
+    and whichever answers first wins. Duplicates are limited to max_ratio of
+    all calls, so a slow provider never sees more than that in extra load.
+    The losing request cannot be cancelled and completes in the background.
+    """
+
+    def __init__(self, enabled=LLM_HEDGE, percentile=LLM_HEDGE_PERCENTILE, max_ratio=LLM_HEDGE_MAX_RATIO,
+                 min_samples=LLM_HEDGE_MIN_SAMPLES, window=LLM_HEDGE_WINDOW):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, latency):
+        with self._lock:
+            self._latencies.setdefault(stage, deque(maxlen=self.window)).append(latency)
+
+    def threshold(self, stage):
+        """Seconds after which a call of this stage is hedged, or None while still learning."""
+        with self._lock:
+            samples = sorted(self._latencies.get(stage, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(self.percentile * len(samples)))]
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self.hedged >= self.max_ratio * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def _track(self, stage, future, started):
+        future.add_done_callback(
+            lambda f: f.exception() is None and self.record(stage, time.monotonic() - started))
+
+    def call(self, func, *args, stage=None, **kwargs):
+        """func(*args, **kwargs), hedged when enabled and the call runs long."""
+        stage = stage or "other"
+        if not self.enabled:
+            started = time.monotonic()
+            result = func(*args, **kwargs)
+            self.record(stage, time.monotonic() - started)
+            return result
+
+        with self._lock:
+            self.calls += 1
+        delay = self.threshold(stage)
+        primary, started = _start(func, args, kwargs)
+        self._track(stage, primary, started)
+        if delay is None or wait([primary], timeout=delay).done or not self._allow_hedge():
+            return primary.result()
+
+        print(f" LLM {stage} call slower than {delay:.2f}s; sending a hedged request")
+        hedge, hedge_started = _start(func, args, kwargs)
+        self._track(stage, hedge, hedge_started)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+        # Both attempts failed: surface the original call's error (retried by the caller)
+        return primary.result()
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled, "calls": self.calls, "hedged": self.hedged, "hedge_wins": self.hedge_wins}
+
+
+hedger = Hedger()
@@ -0,0 +1,232 @@
+# utils/llm_provider.py
+import os
+import re
+import json
+import time
+import zlib
+import random
+import hashlib
+import threading
+from typing import Any, List, Optional
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_groq import ChatGroq
+from utils.llm_cache import llm_cache_for
+
+load_dotenv()
+
+# "groq": real provider; "fake": local deterministic stand-in (no network);
+# "record": call Groq and save every response; "replay": serve saved responses only
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+LLM_RECORDINGS_DIR = os.getenv("LLM_RECORDINGS_DIR", "llm_recordings")
+# Replay with the latency observed while recording (1) or as fast as possible (0)
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0") == "1"
+# Fake backend: per-call latency in seconds (mean and gaussian jitter) and error injection
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", 0.0))
+LLM_FAKE_JITTER = float(os.getenv("LLM_FAKE_JITTER", 0.0))
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", 0.0))
+LLM_FAKE_SEED = int(os.getenv("LLM_FAKE_SEED", 0))
+
+_rng = random.Random(LLM_FAKE_SEED)
+_rng_lock = threading.Lock()
+
+
+def _prompt_text(messages):
+    return "\n".join(str(message.content) for message in messages)
+
+
+class FakeRateLimitError(Exception):
+    """Injected provider error; looks like a Groq 429 to utils.llm_retry."""
+    status_code = 429
+    response = type("Response", (), {"status_code": 429, "headers": {}})()
+
+
+def _json_after(text, marker):
+    """Decode the first JSON object following marker, or None."""
+    start = text.find(marker)
+    if start < 0:
+        return None
+    brace = text.find("{", start + len(marker))
+    if brace < 0:
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(text[brace:])[0]
+    except json.JSONDecodeError:
+        return None
+
+
+def _list_after(text, key):
+    """The JSON list that follows `"key":` in text (prompts interpolate lists with json.dumps)."""
+    match = re.search(rf'"{key}":\s*(\[.*?\])\s*\n', text, re.S)
+    try:
+        return json.loads(match.group(1)) if match else []
+    except json.JSONDecodeError:
+        return []
+
+
+def _title_after(text, marker):
+    match = re.search(r'"title":\s*"(.*?)"\s*,?\s*\n', text[text.find(marker):], re.S)
+    return match.group(1) if match else "Untitled"
+
+
+def _status(point):
+    """Deterministic verdict: roughly one statement in five needs review."""
+    return "needs_review" if zlib.crc32(str(point).encode("utf-8")) % 5 == 0 else "accurate"
+
+
+def fake_response(stage, prompt):
+    """Schema-valid JSON answer for one pipeline stage, derived only from the prompt."""
+    react = "RESPONSE FORMAT INSTRUCTIONS" in prompt
+    if stage == "outline":
+        match = re.search(r"outline of (\d+) slides about (.+?)\.\s*\n", prompt)
+        count, topic = (int(match.group(1)), match.group(2).strip()) if match else (5, "the topic")
+        payload = {"slides": [
+            {"title": f"{topic}: part {i + 1}", "bullet_points": [f"Key idea {j + 1} of part {i + 1}" for j in range(3)]}
+            for i in range(count)
+        ]}
+    elif stage == "expansion":
+        payload = {
+            "title": _title_after(prompt, "Slide to expand:"),
+            "detailed_points": [f"{point}, explained in one short sentence"
+                                for point in _list_after(prompt, "bullet_points")],
+        }
+    elif stage == "qa" and "Slides to validate:" in prompt:
+        slides = (_json_after(prompt, "Slides to validate:") or {}).get("slides", [])
+        payload = {"slides": [
+            {"title": s["title"], "validation": [
+                {"point": st["point"], "status": _status(st["point"]), "reason": ""} for st in s["statements"]
+            ]} for s in slides
+        ]}
+    elif stage == "qa":
+        payload = {
+            "title": _title_after(prompt, "Slide to validate:"),
+            "validation": [{"point": p, "status": _status(p), "reason": ""}
+                           for p in _list_after(prompt, "detailed_points")],
+        }
+    elif stage == "format" and '{"hints":' in prompt:
+        slides = json.loads(prompt[prompt.rfind("Slides:") + len("Slides:"):].strip() or "[]")
+        payload = {"hints": [["Simple bullet with an icon"] * len(s["statements"]) for s in slides]}
+    else:
+        slides = (_json_after(prompt, "Expanded content:") or {}).get("slides", [])
+        payload = {"slides": [
+            {"title": s["title"], "content": [
+                {"statement": p, "status": _status(p), "design_hint": "Simple bullet with an icon"}
+                for p in s["detailed_points"]
+            ]} for s in slides
+        ]}
+
+    text = json.dumps(payload)
+    if react:
+        return "```json\n" + json.dumps({"action": "Final Answer", "action_input": payload}) + "\n```"
+    return text
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Local deterministic stand-in for the provider: answers each stage with
+    schema-valid JSON built from the prompt, after LLM_FAKE_LATENCY seconds,
+    raising a retryable 429 at LLM_FAKE_ERROR_RATE. Works both for direct
+    .invoke() calls and inside the ReAct agent executors.
+    """
+
+    stage: str = "expansion"
+    latency: float = LLM_FAKE_LATENCY
+    jitter: float = LLM_FAKE_JITTER
+    error_rate: float = LLM_FAKE_ERROR_RATE
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs):
+        with _rng_lock:
+            delay = max(0.0, _rng.gauss(self.latency, self.jitter)) if self.latency or self.jitter else 0.0
+            fail = _rng.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise FakeRateLimitError(f"injected failure in {self.stage} stage")
+        content = fake_response(self.stage, _prompt_text(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+class RecordReplayChatModel(BaseChatModel):
+    """
+    Record mode forwards to `inner` and saves each response (and its latency)
+    under LLM_RECORDINGS_DIR; replay mode serves those files and never calls
+    the network. Responses are keyed by stage, model settings and prompt.
+    """
+
+    stage: str
+    mode: str = "replay"
+    model_name: str = LLM_MODEL
+    temperature: float = 0.0
+    max_tokens: int = 0
+    recordings_dir: str = LLM_RECORDINGS_DIR
+    replay_latency: bool = LLM_REPLAY_LATENCY
+    inner: Optional[Any] = None
+
+    @property
+    def _llm_type(self):
+        return f"{self.mode}-{self.stage}"
+
+    def _path(self, prompt, stop):
+        settings = json.dumps([self.stage, self.model_name, self.temperature, self.max_tokens, stop or []])
+        key = hashlib.sha256(f"{settings}\0{prompt}".encode("utf-8")).hexdigest()
+        return os.path.join(self.recordings_dir, self.stage, f"{key}.json")
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs):
+        prompt = _prompt_text(messages)
+        path = self._path(prompt, stop)
+
+        if self.mode == "replay":
+            if not os.path.exists(path):
+                raise LookupError(f" No recorded {self.stage} response for this prompt in {self.recordings_dir}")
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            if self.replay_latency:
+                time.sleep(record.get("latency", 0.0))
+            content = record["response"]
+        else:
+            started = time.perf_counter()
+            content = self.inner.invoke(messages, stop=stop).content
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"stage": self.stage, "prompt": prompt, "response": content,
+                           "latency": time.perf_counter() - started}, f)
+            os.replace(tmp_path, path)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def get_llm(stage: str, temperature: float, max_tokens: int, provider: str = None):
+    """Chat model for one pipeline stage from the configured LLM_PROVIDER."""
+    provider = provider or LLM_PROVIDER
+    if provider == "fake":
+        return FakeChatModel(stage=stage, cache=False)
+    if provider == "replay":
+        return RecordReplayChatModel(stage=stage, mode="replay", temperature=temperature,
+                                     max_tokens=max_tokens, cache=False)
+    if provider not in ("groq", "record"):
+        raise ValueError(f" Unknown LLM_PROVIDER: {provider}")
+
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        raise ValueError(" Missing GROQ_API_KEY in .env file")
+
+    llm = ChatGroq(
+        groq_api_key=groq_api_key,
+        model=LLM_MODEL,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        max_retries=0,  # retries and backoff are handled by utils.llm_retry
+        # shared disk cache for deterministic stages; recordings must capture real calls
+        cache=False if provider == "record" else llm_cache_for(stage, temperature)
+    )
+    if provider == "record":
+        return RecordReplayChatModel(stage=stage, mode="record", temperature=temperature,
+                                     max_tokens=max_tokens, inner=llm, cache=False)
+    return llm
@@ -0,0 +1,177 @@
+# utils/llm_retry.py
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from utils import llm_usage
+from utils.llm_hedge import hedger
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))  # seconds
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 20))  # seconds
+# Consecutive retryable failures before the circuit opens for everyone
+LLM_CIRCUIT_THRESHOLD = int(os.getenv("LLM_CIRCUIT_THRESHOLD", 5))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", 30))
+# Longest a call waits for an open circuit before giving up
+LLM_CIRCUIT_MAX_WAIT = float(os.getenv("LLM_CIRCUIT_MAX_WAIT", 60))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+                    "ReadTimeout", "ConnectTimeout", "RemoteProtocolError"}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the provider while it is known to be saturated."""
+
+
+def _status_code(exc):
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc):
+    """Throttling, timeouts, connection drops and 5xx are worth retrying; bad requests are not."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    code = _status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return type(exc).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(exc):
+    """Seconds the provider asked us to wait (Retry-After header), or None."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    value = headers.get("retry-after") if hasattr(headers, "get") else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Process-wide breaker shared by every agent. After `threshold` consecutive
+    retryable failures (or whenever the provider sends Retry-After) callers are
+    held back until the pause ends; then a single probe call is let through and
+    its outcome closes or re-opens the circuit. Callers that would wait longer
+    than max_wait fail fast with CircuitOpenError.
+    """
+
+    def __init__(self, threshold=LLM_CIRCUIT_THRESHOLD, reset_seconds=LLM_CIRCUIT_RESET_SECONDS,
+                 max_wait=LLM_CIRCUIT_MAX_WAIT):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.max_wait = max_wait
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Block until a call may go out; raises CircuitOpenError past max_wait."""
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now >= self.open_until:
+                    if self.failures < self.threshold:
+                        return
+                    if not self.probing:
+                        self.probing = True
+                        return
+                    wait = self.reset_seconds  # a probe is in flight; woken when it finishes
+                elif self.open_until > deadline:
+                    wait = None
+                else:
+                    wait = self.open_until - now
+                if wait is None or now >= deadline:
+                    self.rejected += 1
+                    raise CircuitOpenError(" LLM provider is saturated; call shed by circuit breaker")
+                self._cond.wait(min(wait, deadline - now))
+
+    def record_success(self):
+        with self._cond:
+            self.failures = 0
+            self.probing = False
+            self._cond.notify_all()
+
+    def record_failure(self, pause=None):
+        with self._cond:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.threshold:
+                pause = max(pause or 0.0, self.reset_seconds)
+            if pause:
+                self.open_until = max(self.open_until, time.monotonic() + pause)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "state": "open" if self.failures >= self.threshold or time.monotonic() < self.open_until
+                else "closed",
+                "consecutive_failures": self.failures,
+                "rejected": self.rejected,
+            }
+
+
+breaker = CircuitBreaker()
+
+
+def backoff_delay(attempt, base=LLM_BACKOFF_BASE, cap=LLM_BACKOFF_MAX):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retry(func, *args, retries=None, circuit=None, **kwargs):
+    """
+    Call func(*args, **kwargs) (an LLM invoke) through the shared circuit breaker,
+    retrying retryable failures with jittered exponential backoff. A Retry-After
+    from the provider pauses every caller via the breaker instead of the backoff.
+    Each call covers one slide or batch, so only the failed work is retried.
+    Inside a tracked request, retries are counted and every attempt first
+    checks the request's token budget. With LLM_HEDGE on, a slow attempt is
+    hedged with a duplicate request (see utils.llm_hedge).
+    """
+    retries = LLM_MAX_RETRIES if retries is None else retries
+    circuit = circuit or breaker
+    tracker = llm_usage.current()
+    stage = ((kwargs.get("config") or {}).get("metadata") or {}).get("stage")
+    for attempt in range(retries + 1):
+        if tracker is not None:
+            tracker.check_budget()
+        circuit.acquire()
+        try:
+            result = hedger.call(func, *args, stage=stage, **kwargs)
+        except Exception as e:
+            if not is_retryable(e):
+                circuit.record_success()  # the provider answered; the request itself was bad
+                raise
+            pause = retry_after(e)
+            circuit.record_failure(pause)
+            if attempt == retries:
+                raise
+            if tracker is not None:
+                tracker.record_retry(stage)
+            if pause is None:
+                delay = backoff_delay(attempt)
+                print(f" LLM call failed ({type(e).__name__}); retry {attempt + 1}/{retries} in {delay:.1f}s")
+                time.sleep(delay)
+            else:
+                print(f" LLM provider asked to retry after {pause:.1f}s; retry {attempt + 1}/{retries}")
+        else:
+            circuit.record_success()
+            return result
@@ -0,0 +1,191 @@
+# utils/llm_usage.py
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from utils.tokens import estimate_tokens
+
+# Per-request cap on prompt + completion tokens (0 = unlimited)
+LLM_TOKEN_BUDGET = int(os.getenv("LLM_TOKEN_BUDGET", 0))
+# USD per million tokens (defaults: Groq llama-3.1-8b-instant list price)
+LLM_PRICE_INPUT_PER_MTOK = float(os.getenv("LLM_PRICE_INPUT_PER_MTOK", 0.05))
+LLM_PRICE_OUTPUT_PER_MTOK = float(os.getenv("LLM_PRICE_OUTPUT_PER_MTOK", 0.08))
+
+_current = contextvars.ContextVar("llm_usage", default=None)
+_user_totals = {}
+_user_lock = threading.Lock()
+
+
+class TokenBudgetExceeded(RuntimeError):
+    """Raised before an LLM call once the request has used up its token budget."""
+
+
+def _empty_stage():
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_s": 0.0,
+            "retries": 0, "errors": 0, "cache_hits": 0, "cost_usd": 0.0}
+
+
+class UsageTracker:
+    """Token, latency and cost accounting for one request, rolled up per stage."""
+
+    def __init__(self, user=None, token_budget=LLM_TOKEN_BUDGET):
+        self.user = user
+        self.token_budget = token_budget
+        self.started = time.perf_counter()
+        self.calls = []
+        self.stages = {}
+        self.budget_exceeded = False
+        self._lock = threading.Lock()
+
+    def _stage(self, stage):
+        return self.stages.setdefault(stage or "other", _empty_stage())
+
+    @property
+    def total_tokens(self):
+        return sum(s["prompt_tokens"] + s["completion_tokens"] for s in self.stages.values())
+
+    def record_call(self, stage, model, prompt_tokens, completion_tokens, latency, cached=False, estimated=False):
+        # Cache hits cost nothing and do not count against the budget
+        cost = 0.0 if cached else (prompt_tokens * LLM_PRICE_INPUT_PER_MTOK
+                                   + completion_tokens * LLM_PRICE_OUTPUT_PER_MTOK) / 1e6
+        with self._lock:
+            self.calls.append({"stage": stage, "model": model, "prompt_tokens": prompt_tokens,
+                               "completion_tokens": completion_tokens, "latency_s": round(latency, 4),
+                               "cached": cached, "estimated": estimated})
+            totals = self._stage(stage)
+            totals["calls"] += 1
+            totals["latency_s"] += latency
+            totals["cache_hits"] += int(cached)
+            if not cached:
+                totals["prompt_tokens"] += prompt_tokens
+                totals["completion_tokens"] += completion_tokens
+                totals["cost_usd"] += cost
+
+    def record_retry(self, stage):
+        with self._lock:
+            self._stage(stage)["retries"] += 1
+
+    def record_error(self, stage):
+        with self._lock:
+            self._stage(stage)["errors"] += 1
+
+    def check_budget(self):
+        """Stop further LLM calls once the request's token budget is spent."""
+        if self.token_budget and self.total_tokens >= self.token_budget:
+            self.budget_exceeded = True
+            raise TokenBudgetExceeded(f" Token budget of {self.token_budget} exhausted for this request")
+
+    def summary(self):
+        with self._lock:
+            stages = {
+                name: dict(s, latency_s=round(s["latency_s"], 3), cost_usd=round(s["cost_usd"], 6))
+                for name, s in self.stages.items()
+            }
+            prompt = sum(s["prompt_tokens"] for s in self.stages.values())
+            completion = sum(s["completion_tokens"] for s in self.stages.values())
+            return {
+                "user": self.user,
+                "calls": len(self.calls),
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "total_tokens": prompt + completion,
+                "cost_usd": round(sum(s["cost_usd"] for s in self.stages.values()), 6),
+                "wall_time_s": round(time.perf_counter() - self.started, 3),
+                "token_budget": self.token_budget or None,
+                "budget_exceeded": self.budget_exceeded,
+                "stages": stages,
+            }
+
+    def finish(self):
+        """Add this request to its user's running totals; returns the request summary."""
+        summary = self.summary()
+        if self.user is not None:
+            with _user_lock:
+                totals = _user_totals.setdefault(self.user, {"requests": 0, "total_tokens": 0, "cost_usd": 0.0})
+                totals["requests"] += 1
+                totals["total_tokens"] += summary["total_tokens"]
+                totals["cost_usd"] = round(totals["cost_usd"] + summary["cost_usd"], 6)
+                summary["user_totals"] = dict(totals)
+        return summary
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Records every chat-model call made under one stage into a UsageTracker."""
+
+    def __init__(self, tracker, stage):
+        self.tracker = tracker
+        self.stage = stage
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        prompt = "\n".join(str(m.content) for batch in messages for m in batch)
+        self._runs[run_id] = (time.perf_counter(), params.get("model") or params.get("model_name"), prompt)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        self._runs[run_id] = (time.perf_counter(), params.get("model") or params.get("model_name"), "\n".join(prompts))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, model, prompt = self._runs.pop(run_id, (time.perf_counter(), None, ""))
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        message = getattr(generation, "message", None)
+        text = getattr(generation, "text", "") or ""
+        metadata = getattr(message, "response_metadata", None) or {}
+        cached = bool(metadata.get("cache_hit"))
+
+        usage = getattr(message, "usage_metadata", None) or {}
+        token_usage = (response.llm_output or {}).get("token_usage") or metadata.get("token_usage") or {}
+        prompt_tokens = usage.get("input_tokens") or token_usage.get("prompt_tokens")
+        completion_tokens = usage.get("output_tokens") or token_usage.get("completion_tokens")
+        estimated = prompt_tokens is None or completion_tokens is None
+        if estimated:
+            prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(text)
+
+        model = model or (response.llm_output or {}).get("model_name") or metadata.get("model_name") or "unknown"
+        self.tracker.record_call(self.stage, model, prompt_tokens, completion_tokens,
+                                 time.perf_counter() - started, cached=cached, estimated=estimated)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+        self.tracker.record_error(self.stage)
+
+
+def current():
+    """The UsageTracker of the request running in this context, or None."""
+    return _current.get()
+
+
+@contextmanager
+def track_usage(user=None, token_budget=LLM_TOKEN_BUDGET):
+    """Account every LLM call made in this context (and threads bound with bind_context)."""
+    tracker = UsageTracker(user=user, token_budget=token_budget)
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+
+
+def bind_context(func):
+    """Wrap func so it runs in a copy of the caller's context, e.g. as a worker thread target."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(func, *args, **kwargs)
+
+
+def llm_config(stage):
+    """
+    Keyword arguments for an LLM/executor invoke: usage callbacks and the stage
+    tag while a request is being tracked, nothing otherwise.
+    """
+    tracker = _current.get()
+    if tracker is None:
+        return {}
+    return {"config": {"callbacks": [UsageCallback(tracker, stage)], "metadata": {"stage": stage}}}
+
+
+def usage_by_user():
+    with _user_lock:
+        return {user: dict(totals) for user, totals in _user_totals.items()}
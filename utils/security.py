@@ -13,6 +13,8 @@ load_dotenv()
 JWT_SECRET = os.getenv("JWT_SECRET", "change_this_now")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_SECONDS = int(os.getenv("JWT_EXP_SECONDS", 60 * 60 * 4))  # 4 hours
+# Collections every authenticated user may read and write (comma-separated)
+SHARED_COLLECTIONS = {c.strip() for c in os.getenv("SHARED_COLLECTIONS", "default").split(",") if c.strip()}
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 bearer = HTTPBearer(auto_error=False)
@@ -22,32 +24,38 @@ DEMO_USERS = {
     "exec@example.com": {
         "name": "Exec User",
         "role": "Executive",
-        "password_hash": pwd_context.hash("execpass")
+        "password_hash": pwd_context.hash("execpass"),
+        "collections": ["leadership", "strategy"]
     },
     "senior@example.com": {
         "name": "Senior User",
         "role": "Senior Manager",
-        "password_hash": pwd_context.hash("seniorpass")
+        "password_hash": pwd_context.hash("seniorpass"),
+        "collections": ["strategy"]
     },
     "analyst@example.com": {
         "name": "Analyst User",
         "role": "Analyst",
-        "password_hash": pwd_context.hash("analystpass")
+        "password_hash": pwd_context.hash("analystpass"),
+        "collections": ["research"]
     },
     "junior@example.com": {
         "name": "Junior User",
         "role": "Junior Staff",
-        "password_hash": pwd_context.hash("juniorpass")
+        "password_hash": pwd_context.hash("juniorpass"),
+        "collections": []
     },
 }
 
 
-def create_access_token(subject: str, role: str, expires_in: int = ACCESS_TOKEN_EXPIRE_SECONDS) -> str:
-    """Create JWT with role embedded."""
+def create_access_token(subject: str, role: str, expires_in: int = ACCESS_TOKEN_EXPIRE_SECONDS,
+                        collections: Optional[List[str]] = None) -> str:
+    """Create JWT with role and the caller's (non-shared) collections embedded."""
     now = int(time.time())
     payload = {
         "sub": subject,
         "role": role.strip(),  # keep stored role clean
+        "collections": list(collections or []),
         "iat": now,
         "exp": now + expires_in,
     }
@@ -74,7 +82,7 @@ def authenticate_user(email: str, password: str) -> Optional[dict]:
         return None
     if not pwd_context.verify(password, user["password_hash"]):
         return None
-    return {"email": email, "name": user["name"], "role": user["role"]}
+    return {"email": email, "name": user["name"], "role": user["role"], "collections": user.get("collections", [])}
 
 
 def get_current_user(credentials: HTTPAuthorizationCredentials = Security(bearer)) -> dict:
@@ -90,7 +98,7 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Security(bearer
     # Debug log
     print(" Decoded JWT payload:", payload)
 
-    return {"email": payload["sub"], "role": payload["role"]}
+    return {"email": payload["sub"], "role": payload["role"], "collections": payload.get("collections", [])}
 
 
 def require_role(allowed_roles: List[str]):
@@ -113,3 +121,17 @@ def require_role(allowed_roles: List[str]):
         return user
 
     return dependency
+
+
+def authorize_collection(user: dict, collection: str):
+    """
+    Raise 403 unless the caller may use this collection: shared collections
+    are open to every authenticated user, any other only to users whose
+    token lists it. Check this before resolving the collection's directory.
+    """
+    if collection in SHARED_COLLECTIONS or collection in user.get("collections", []):
+        return collection
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail=f"No access to collection '{collection}'"
+    )
@@ -0,0 +1,9 @@
+# utils/tokens.py
+
+# Llama-family tokenizers average ~4 characters per token on English prose and
+# fewer on JSON punctuation; 3 keeps estimates on the safe side of the limits.
+CHARS_PER_TOKEN = 3
+
+def estimate_tokens(text: str) -> int:
+    """Cheap, slightly pessimistic token count for budgeting prompts (no tokenizer needed)."""
+    return -(-len(text) // CHARS_PER_TOKEN)